@@ -0,0 +1,121 @@
+import numpy as np
+from polygon_engine import (pack_polygons, unpack_polygons, transform_coords, clip_polygons, simplify_polygons, bounding_box,
+                            UNIT_BOX)
+from label_codec import read_labels, write_labels, boxes_to_polygons, polygon_bounds, polygon_areas
+
+# Labels of one image as a struct of arrays: float32 (N, 2) normalized vertices, int32 offsets
+# of length P + 1 (instance i is coords[offsets[i]:offsets[i + 1]]) and an int16 class id per
+# instance. This is what augment_data, the batch engine and the GUI pass around. Indexing an
+# instance gives a view into coords, and transforms return new Annotations that share every array
+# they don't change, so there are no per-instance Python objects anywhere.
+
+CLASS_DTYPE = np.int16
+
+def parse_class_ids(class_ids):
+    # int16 array from class ids as ints or as the strings label_codec reads
+    if isinstance(class_ids, np.ndarray) and class_ids.dtype == CLASS_DTYPE:
+        return class_ids
+    try:
+        return np.array(class_ids, dtype=CLASS_DTYPE).reshape(-1)
+    except (ValueError, OverflowError) as e:
+        raise ValueError(f"Class ids have to be integers from 0 to {np.iinfo(CLASS_DTYPE).max}: {e}") from None
+
+class Annotations:
+    __slots__ = ('coords', 'offsets', 'class_ids')
+
+    def __init__(self, coords=None, offsets=None, class_ids=None):
+        self.coords = np.zeros((0, 2), dtype=np.float32) if coords is None else coords
+        self.offsets = np.zeros(1, dtype=np.int32) if offsets is None else offsets
+        self.class_ids = np.zeros(0, dtype=CLASS_DTYPE) if class_ids is None else parse_class_ids(class_ids)
+
+    @classmethod
+    def from_polygons(cls, polygons, class_ids):
+        # From a list of [(x, y), ...] polygons
+        return cls(*pack_polygons(polygons), class_ids)
+
+    @classmethod
+    def read(cls, label_path):
+        # Box lines stay two-point instances, see boxes_to_polygons
+        return cls(*read_labels(label_path))
+
+    def write(self, label_path, precision=6):
+        write_labels(label_path, self.coords, self.offsets, self.class_ids.tolist(), precision)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        # An int gives the (n, 2) vertices of one instance, a slice the Annotations of a run of
+        # instances, both as views into coords. A boolean mask or index array selects instances
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            return self.coords[self.offsets[index]:self.offsets[index + 1]]
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                stop = max(stop, start)
+                first = self.offsets[start]
+                return Annotations(self.coords[first:self.offsets[stop]], self.offsets[start:stop + 1] - first, self.class_ids[start:stop])
+            index = np.arange(start, stop, step)
+        return self.select(index)
+
+    def __iter__(self):
+        # (class id, vertices view) per instance
+        bounds = self.offsets.tolist()
+        for i, class_id in enumerate(self.class_ids.tolist()):
+            yield class_id, self.coords[bounds[i]:bounds[i + 1]]
+
+    def __repr__(self):
+        return f'Annotations({len(self)} instances, {len(self.coords)} vertices)'
+
+    def vertex_counts(self):
+        return np.diff(self.offsets)
+
+    def select(self, selection):
+        # Instances of a boolean mask or an index array, in that order
+        selection = np.asarray(selection)
+        indices = np.nonzero(selection)[0] if selection.dtype == bool else selection.astype(np.int64)
+        counts = self.vertex_counts()[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int32)
+        np.cumsum(counts, out=offsets[1:])
+
+        # Vertex index of every kept vertex, without a Python loop over the instances
+        starts = self.offsets[:-1][indices]
+        vertices = np.repeat(starts - offsets[:-1], counts) + np.arange(int(offsets[-1]))
+        return Annotations(self.coords[vertices], offsets, self.class_ids[indices])
+
+    def transform(self, matrix, clamp=False):
+        # Every vertex through one normalized-space affine. clamp only clamps the vertices to
+        # [0, 1], clip cuts the polygons at the image border
+        return Annotations(transform_coords(self.coords, matrix, clip=clamp), self.offsets, self.class_ids)
+
+    def clip(self, rect=UNIT_BOX):
+        # Clipping can drop instances or split one into parts with the same class id
+        return Annotations(*clip_polygons(self.coords, self.offsets, self.class_ids, rect))
+
+    def simplify(self, tolerance, width=1.0, height=1.0):
+        # Douglas-Peucker with a tolerance in pixels of a width x height image
+        return Annotations(*simplify_polygons(self.coords, self.offsets, tolerance, (width, height)), self.class_ids)
+
+    def boxes_to_polygons(self):
+        coords, offsets = boxes_to_polygons(self.coords, self.offsets)
+        return Annotations(coords, offsets, self.class_ids)
+
+    def bounds(self):
+        # x_min, y_min, x_max, y_max over all vertices, None without vertices
+        return bounding_box(self.coords)
+
+    def instance_bounds(self):
+        return polygon_bounds(self.coords, self.offsets)
+
+    def areas(self):
+        return polygon_areas(self.coords, self.offsets)
+
+    def denormalized(self, width, height):
+        # Vertices in pixels of a width x height image
+        return self.coords * np.array([width, height], dtype=np.float32)
+
+    def polygons(self):
+        # [(x, y), ...] lists, for code that still wants Python polygons
+        return unpack_polygons(self.coords, self.offsets)
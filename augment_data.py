@@ -1,160 +1,117 @@
-import os
 import cv2
 import random
 import numpy as np
-import math
-import shutil
-from shapely.geometry import Polygon, box, MultiPolygon
-from shapely.ops import unary_union
+from polygon_engine import (pack_polygons, transform_polygons, compose, identity_matrix, scale_translate_matrix,
+                            mirror_matrix, normalize_matrix, denormalize_matrix, rotation_matrix, pixel_rotation_matrix,
+                            pixel_to_normalized_matrix, bounding_box)
+from annotations import Annotations
+from overlay_pool import get_overlay_pool
+from augmentation_plan import sample_plan, uniform_index
+from photometric import has_photometric, apply_photometric
+from stage_profiler import stage, count
+
+# Inside the pipeline the labels of an image are an Annotations (packed coords, offsets and a
+# class id per polygon). Stages that can push vertices out of the image clip the polygons to
+# it, which can drop polygons or split them into parts with the same class id.
 
 def mirror_polygon(polygon):
-    return [(1 - x, y) for x, y in polygon]
+    return mirror_polygons([polygon])[0]
 
-def clamp(value, min_value=0.0, max_value=1.0):
-    return max(min_value, min(max_value, value))
+def mirror_polygons(polygons):
+    return transform_polygons(polygons, mirror_matrix(), clip=False)
 
 def calculate_overall_bounding_box(polygons):
-    # Unpack all points from the polygons
-    all_points = [point for polygon in polygons for point in polygon]
-    if not all_points:
-        return None
-
-    # Calculate min/max x and y coordinates
-    min_x = min(point[0] for point in all_points)
-    max_x = max(point[0] for point in all_points)
-    min_y = min(point[1] for point in all_points)
-    max_y = max(point[1] for point in all_points)
-
-    return min_x, min_y, max_x, max_y
+    # Min/max x and y over the vertices of all polygons
+    coords, _ = pack_polygons(polygons)
+    return bounding_box(coords)
 
 def rotate_polygon(polygon, angle, original_center, new_center, original_dims, new_dims):
-    angle_rad = math.radians(-angle)
-    cos_angle = math.cos(angle_rad)
-    sin_angle = math.sin(angle_rad)
-    rotated_polygon = []
-
-    for x, y in polygon:
-        # Denormalize points using original dimensions
-        x_denorm = x * original_dims[0]
-        y_denorm = y * original_dims[1]
-
-        # Shift to origin based on the original center
-        x_shifted = x_denorm - original_center[0]
-        y_shifted = y_denorm - original_center[1]
-
-        # Rotate
-        x_rotated = x_shifted * cos_angle - y_shifted * sin_angle
-        y_rotated = x_shifted * sin_angle + y_shifted * cos_angle
-
-        # Shift back using the new center
-        x_new = x_rotated + new_center[0]
-        y_new = y_rotated + new_center[1]
+    return rotate_polygons([polygon], angle, original_center, new_center, original_dims, new_dims)[0]
 
-        # Renormalize using new dimensions
-        x_norm = x_new / new_dims[0]
-        y_norm = y_new / new_dims[1]
+def rotate_polygons(polygons, angle, original_center, new_center, original_dims, new_dims):
+    # Denormalize, rotate around the original center, shift to the new center and renormalize
+    matrix = rotation_matrix(angle, original_center, new_center, original_dims, new_dims)
+    return transform_polygons(polygons, matrix, clip=True)
 
-        # Clamp values to ensure they are normalized
-        x_clamped = clamp(x_norm)
-        y_clamped = clamp(y_norm)
-
-        rotated_polygon.append((x_clamped, y_clamped))
-
-    return rotated_polygon
-
-def get_rotation_angle():
-    # 25% chance to rotate randomly
-    if random.random() < 0.25:
-        return random.uniform(0, 360)
-    # 75% chance to rotate by 0, 90, 180, or 270 degrees
-    else:
-        return random.choice([0, 90, 180, 270])
+def transform_labels(annotations, matrix):
+    # Move all labels of an image with one normalized-space affine and clip them to the image
+    return annotations.transform(matrix).clip()
 
 def mirror_image(image):
     return cv2.flip(image, 1)
 
-def rotate_image(image, angle):
-    (h, w) = image.shape[:2]
+def get_rotation_canvas(w, h, angle):
     center = (w / 2, h / 2)
-    
+
     # Determine the rotation matrix and calculate the new bounding dimensions of the image
     M = cv2.getRotationMatrix2D(center, angle, 1.0)
     cos = np.abs(M[0, 0])
     sin = np.abs(M[0, 1])
-    
+
     # Compute the new bounding dimensions of the image
     nW = int((h * sin) + (w * cos))
     nH = int((h * cos) + (w * sin))
-    
+
     # Adjust the rotation matrix to take into account translation
     M[0, 2] += (nW / 2) - center[0]
     M[1, 2] += (nH / 2) - center[1]
-    
+
+    return M, nW, nH
+
+def rotate_image(image, angle):
+    (h, w) = image.shape[:2]
+    M, nW, nH = get_rotation_canvas(w, h, angle)
+
     # Perform the actual rotation and return the image
     return cv2.warpAffine(image, M, (nW, nH))
 
-def zoom_out_image_and_polygons(image, polygons, min_padding=0.1, max_padding=0.5):
-    if not polygons:
-        return image, polygons  # No action if there are no polygons
-
-    img_height, img_width = image.shape[:2]
+def rotate_image_and_labels(image, annotations, angle):
+    (h, w) = image.shape[:2]
+    rotated_image = rotate_image(image, angle)
+    new_w, new_h = rotated_image.shape[1], rotated_image.shape[0]
 
-    # Independently determine padding for width and height
-    padding_x = random.uniform(min_padding, max_padding) + 1  # Random padding for width
-    padding_y = random.uniform(min_padding, max_padding) + 1  # Random padding for height
+    # Corners of the rotated image are outside the original, so clip instead of clamping
+    matrix = rotation_matrix(angle, (w / 2, h / 2), (new_w / 2, new_h / 2), (w, h), (new_w, new_h))
+    return rotated_image, transform_labels(annotations, matrix)
 
+def get_zoom_out_canvas(img_width, img_height, padding_x, padding_y):
+    # padding_x and padding_y are the canvas size relative to the image, independent for width and height
     # Calculate the size of the new canvas without maintaining aspect ratio
     canvas_width = int(img_width * padding_x)
     canvas_height = int(img_height * padding_y)
 
-    # Create a new canvas and fill it with black color
-    canvas = np.zeros((canvas_height, canvas_width, 3), dtype=np.uint8)
-
     # Calculate the position where the original image will be placed on the canvas
     x_offset = (canvas_width - img_width) // 2
     y_offset = (canvas_height - img_height) // 2
 
-    # Place the original image in the center of the canvas
-    canvas[y_offset:y_offset + img_height, x_offset:x_offset + img_width] = image
+    return canvas_width, canvas_height, x_offset, y_offset
 
-    # Adjust polygon coordinates according to the new image placement
-    adjusted_polygons = []
-    for polygon in polygons:
-        adjusted_polygon = []
-        for x, y in polygon:
-            # Denormalize coordinates to the original image size
-            denormalized_x = x * img_width
-            denormalized_y = y * img_height
+def zoom_out_image_and_labels(image, annotations, padding_x, padding_y):
+    if not annotations:
+        return image, annotations  # No action if there are no polygons
 
-            # Translate coordinates by adding the offsets
-            translated_x = denormalized_x + x_offset
-            translated_y = denormalized_y + y_offset
-
-            # Renormalize coordinates to the new canvas size
-            new_x = translated_x / canvas_width
-            new_y = translated_y / canvas_height
-
-            # Clamp the values to ensure they remain normalized
-            new_x_clamped = clamp(new_x)
-            new_y_clamped = clamp(new_y)
+    img_height, img_width = image.shape[:2]
+    canvas_width, canvas_height, x_offset, y_offset = get_zoom_out_canvas(img_width, img_height, padding_x, padding_y)
 
-            adjusted_polygon.append((new_x_clamped, new_y_clamped))
-        adjusted_polygons.append(adjusted_polygon)
+    # Create a new canvas and fill it with black color
+    canvas = np.zeros((canvas_height, canvas_width, 3), dtype=np.uint8)
 
-    return canvas, adjusted_polygons
+    # Place the original image in the center of the canvas
+    canvas[y_offset:y_offset + img_height, x_offset:x_offset + img_width] = image
 
+    # Denormalize to the original image, translate by the offsets and renormalize to the canvas
+    matrix = compose(denormalize_matrix((img_width, img_height)),
+                     scale_translate_matrix(tx=x_offset, ty=y_offset),
+                     normalize_matrix((canvas_width, canvas_height)))
 
-def zoom_in_image_and_polygons(image, polygons, min_padding=0.1, max_padding=0.8):
-    if not polygons:
-        return image, []  # Return the image as is if there are no polygons
+    return canvas, transform_labels(annotations, matrix)
 
-    img_height, img_width = image.shape[:2]
 
+def get_zoom_in_box(coords, img_width, img_height, padding):
     # Calculate the collective bounding box for all polygons
-    bbox_x_min, bbox_y_min, bbox_x_max, bbox_y_max = calculate_overall_bounding_box(polygons)
+    bbox_x_min, bbox_y_min, bbox_x_max, bbox_y_max = bounding_box(coords)
 
-    # Apply uniform random padding within specified bounds, ensuring no distortion
-    padding = random.uniform(min_padding, max_padding)
+    # Apply the same relative padding on both axes, ensuring no distortion
     padding_x = padding * (bbox_x_max - bbox_x_min)
     padding_y = padding * (bbox_y_max - bbox_y_min)
 
@@ -170,6 +127,18 @@ def zoom_in_image_and_polygons(image, polygons, min_padding=0.1, max_padding=0.8
     crop_x_max = int(padded_bbox_x_max * img_width)
     crop_y_max = int(padded_bbox_y_max * img_height)
 
+    padded_bbox = (padded_bbox_x_min, padded_bbox_y_min, padded_bbox_x_max, padded_bbox_y_max)
+    return padded_bbox, (crop_x_min, crop_y_min, crop_x_max, crop_y_max)
+
+def zoom_in_image_and_labels(image, annotations, padding):
+    if not annotations:
+        return image, annotations  # Return the image as is if there are no polygons
+
+    img_height, img_width = image.shape[:2]
+    padded_bbox, crop_box = get_zoom_in_box(annotations.coords, img_width, img_height, padding)
+    padded_bbox_x_min, padded_bbox_y_min, padded_bbox_x_max, padded_bbox_y_max = padded_bbox
+    crop_x_min, crop_y_min, crop_x_max, crop_y_max = crop_box
+
     # Crop the image according to the padded bounding box
     cropped_image = image[crop_y_min:crop_y_max, crop_x_min:crop_x_max]
 
@@ -177,348 +146,557 @@ def zoom_in_image_and_polygons(image, polygons, min_padding=0.1, max_padding=0.8
     zoomed_image = cv2.resize(cropped_image, (img_width, img_height))
 
     # Adjust polygon coordinates to match the zoomed image
-    adjusted_polygons = []
-    for polygon in polygons:
-        adjusted_polygon = [((x - padded_bbox_x_min) / (padded_bbox_x_max - padded_bbox_x_min),
-                             (y - padded_bbox_y_min) / (padded_bbox_y_max - padded_bbox_y_min))
-                            for x, y in polygon]
-        adjusted_polygons.append(adjusted_polygon)
+    scale_x = 1 / (padded_bbox_x_max - padded_bbox_x_min)
+    scale_y = 1 / (padded_bbox_y_max - padded_bbox_y_min)
+    matrix = scale_translate_matrix(scale_x, scale_y, -padded_bbox_x_min * scale_x, -padded_bbox_y_min * scale_y)
+
+    return zoomed_image, transform_labels(annotations, matrix)
+
+def get_crop(coords, img_width, img_height, crop_vertical, crop_percentage):
+    # Calculate the overall bounding box of all polygons
+    bbox_x_min, bbox_y_min, bbox_x_max, bbox_y_max = bounding_box(coords)
+
+    # crop_percentage (1% to 50%) is the part of the bounding box in front of the crop line
+    if crop_vertical:
+        # Calculate the width of the bounding box and the vertical crop width
+        bbox_width = bbox_x_max - bbox_x_min
+        crop_width = bbox_width * crop_percentage
+
+        # Determine the vertical crop line within the bounding box based on the chosen percentage
+        crop_line_x = bbox_x_min + crop_width
+        crop_line = int(crop_line_x * img_width)
+
+        # Compare areas on either side of the vertical crop line and decide which side to keep
+        if (crop_line_x - bbox_x_min) > (bbox_x_max - crop_line_x):
+            # Keep left: clip to the bounding box left of the line and stretch [0, line] to [0, 1]
+            crop_box = (0, 0, crop_line, img_height)
+            clip_box = (bbox_x_min, 0, crop_line_x, 1)
+            matrix = scale_translate_matrix(sx=1 / crop_line_x)
+        else:
+            crop_box = (crop_line, 0, img_width, img_height)
+            clip_box = (crop_line_x, 0, bbox_x_max, 1)
+            matrix = scale_translate_matrix(sx=1 / (1 - crop_line_x), tx=-crop_line_x / (1 - crop_line_x))
+
+    else:  # Horizontal crop
+        # Calculate the height of the bounding box and the horizontal crop height
+        bbox_height = bbox_y_max - bbox_y_min
+        crop_height = bbox_height * crop_percentage
+
+        # Determine the horizontal crop line within the bounding box based on the chosen percentage
+        crop_line_y = bbox_y_min + crop_height
+        crop_line = int(crop_line_y * img_height)
+
+        # Compare areas above and below the horizontal crop line and decide which side to keep
+        if (crop_line_y - bbox_y_min) > (bbox_y_max - crop_line_y):
+            crop_box = (0, 0, img_width, crop_line)
+            clip_box = (0, bbox_y_min, 1, crop_line_y)
+            matrix = scale_translate_matrix(sy=1 / crop_line_y)
+        else:
+            crop_box = (0, crop_line, img_width, img_height)
+            clip_box = (0, crop_line_y, 1, bbox_y_max)
+            matrix = scale_translate_matrix(sy=1 / (1 - crop_line_y), ty=-crop_line_y / (1 - crop_line_y))
 
-    return zoomed_image, adjusted_polygons
+    # Pixel box of the kept part of the image, the normalized box the polygons are clipped to
+    # and the matrix that maps the kept part back onto [0, 1]
+    return crop_box, clip_box, matrix
 
-def crop_image_and_polygons(image, polygons, class_ids):
+def crop_labels(annotations, clip_box, matrix):
+    return annotations.clip(clip_box).transform(matrix)
+
+def crop_image_and_labels(image, annotations, crop_vertical, crop_percentage):
     try:
         img_height, img_width = image.shape[:2]
+        (x_min, y_min, x_max, y_max), clip_box, matrix = get_crop(annotations.coords, img_width, img_height, crop_vertical, crop_percentage)
 
-        # Calculate the overall bounding box of all polygons
-        bbox_x_min, bbox_y_min, bbox_x_max, bbox_y_max = calculate_overall_bounding_box(polygons)
-        
-        # Randomly choose between vertical and horizontal crop
-        crop_orientation = random.choice(['vertical', 'horizontal'])
-
-        # Randomly determine the crop percentage (1% to 50%)
-        crop_percentage = random.uniform(0.01, 0.5)
-
-        if crop_orientation == 'vertical':
-            # Calculate the width of the bounding box and the vertical crop width
-            bbox_width = bbox_x_max - bbox_x_min
-            crop_width = bbox_width * crop_percentage
-
-            # Determine the vertical crop line within the bounding box based on the chosen percentage
-            crop_line_x = bbox_x_min + crop_width
-            crop_line = int(crop_line_x * img_width)
-
-            # Compare areas on either side of the vertical crop line and decide which side to keep
-            keep = 'left' if (crop_line_x - bbox_x_min) > (bbox_x_max - crop_line_x) else 'right'
-
-            # Crop the image vertically at the calculated line
-            cropped_image = image[:, :crop_line] if keep == 'left' else image[:, crop_line:]
-
-            # New image bounds in normalized coordinates, considering the vertical crop
-            new_image_box = box(bbox_x_min, 0, crop_line_x, 1) if keep == 'left' else box(crop_line_x, 0, bbox_x_max, 1)
-
-        else:  # Horizontal crop
-            # Calculate the height of the bounding box and the horizontal crop height
-            bbox_height = bbox_y_max - bbox_y_min
-            crop_height = bbox_height * crop_percentage
-
-            # Determine the horizontal crop line within the bounding box based on the chosen percentage
-            crop_line_y = bbox_y_min + crop_height
-            crop_line = int(crop_line_y * img_height)
-
-            # Compare areas above and below the horizontal crop line and decide which side to keep
-            keep = 'top' if (crop_line_y - bbox_y_min) > (bbox_y_max - crop_line_y) else 'bottom'
-
-            # Crop the image horizontally at the calculated line
-            cropped_image = image[:crop_line, :] if keep == 'top' else image[crop_line:, :]
-
-            # New image bounds in normalized coordinates, considering the horizontal crop
-            new_image_box = box(0, bbox_y_min, 1, crop_line_y) if keep == 'top' else box(0, crop_line_y, 1, bbox_y_max)
-
-        # Adjust polygons and retain class IDs based on the new image bounds after cropping
-        adjusted_polygons, retained_class_ids = adjust_polygons_and_class_ids(polygons, class_ids, new_image_box, crop_line_x if crop_orientation == 'vertical' else crop_line_y, keep, crop_orientation)
-
-        return cropped_image, adjusted_polygons, retained_class_ids
+        return image[y_min:y_max, x_min:x_max], crop_labels(annotations, clip_box, matrix)
     except Exception as e:
         # In case of an error during cropping, return the input image and polygons as they were
         print(f"Error during cropping: {e}. Returning original image and polygons.")
-        return image, polygons, class_ids
-
-
-def adjust_polygons_and_class_ids(polygons, class_ids, new_image_box, crop_line, keep, orientation):
-    adjusted_polygons = []
-    retained_class_ids = []  # Track class IDs for polygons retained after cropping
-    
-    for i, polygon in enumerate(polygons):
-        # Create a Shapely Polygon and attempt to clean it
-        shapely_polygon = Polygon(polygon).buffer(0)
-
-        # If the cleaning resulted in a MultiPolygon, take the union of all parts to get a single Polygon
-        if shapely_polygon.is_empty:
-            continue
-        if isinstance(shapely_polygon, MultiPolygon):
-            shapely_polygon = unary_union(shapely_polygon)
-
-        # Perform the intersection with the new image box
-        intersected_polygon = shapely_polygon.intersection(new_image_box)
-
-        if not intersected_polygon.is_empty:
-            if isinstance(intersected_polygon, MultiPolygon):
-                for poly in intersected_polygon.geoms:
-                    adjusted_polygons.append([(pt[0], pt[1]) for pt in poly.exterior.coords[:-1]])
-                    retained_class_ids.append(class_ids[i])
-            else:
-                adjusted_polygons.append([(pt[0], pt[1]) for pt in intersected_polygon.exterior.coords[:-1]])
-                retained_class_ids.append(class_ids[i])
-
-    # Adjust polygon coordinates based on crop orientation and side to keep
-    final_polygons = adjust_polygons_for_crop(adjusted_polygons, crop_line, keep, orientation)
+        return image, annotations
 
-    return final_polygons, retained_class_ids
+def get_padding(cropped_dimensions, original_dimensions):
+    # Calculate padding needed to restore original dimensions
+    pad_vertical = (original_dimensions[0] - cropped_dimensions[0]) // 2
+    pad_horizontal = (original_dimensions[1] - cropped_dimensions[1]) // 2
+    return pad_vertical, pad_horizontal
 
-def adjust_polygons_for_crop(polygons, crop_line, keep, orientation):
-    final_polygons = []
-    for polygon in polygons:
-        if (keep == 'right' and orientation == 'vertical') or (keep == 'bottom' and orientation == 'horizontal'):
-            adjusted_polygon = [((x - crop_line) / (1 - crop_line), y) if orientation == 'vertical' else (x, (y - crop_line) / (1 - crop_line)) for x, y in polygon]
-        else:
-            adjusted_polygon = polygon  # No adjustment needed if keeping left/top
-        final_polygons.append(adjusted_polygon)
-    return final_polygons
-    
-def pad_image_and_adjust_polygons(cropped_image, adjusted_polygons, original_dimensions):
-    cropped_height, cropped_width = cropped_image.shape[:2]
+def pad_labels(annotations, cropped_dimensions, original_dimensions):
+    cropped_height, cropped_width = cropped_dimensions
     original_height, original_width = original_dimensions
+    pad_vertical, pad_horizontal = get_padding(cropped_dimensions, original_dimensions)
 
-    # Calculate padding needed to restore original dimensions
-    pad_vertical = (original_height - cropped_height) // 2
-    pad_horizontal = (original_width - cropped_width) // 2
+    # Denormalize, translate by the padding and renormalize to the original dimensions
+    matrix = compose(denormalize_matrix((cropped_width, cropped_height)),
+                     scale_translate_matrix(tx=max(pad_horizontal, 0), ty=max(pad_vertical, 0)),
+                     normalize_matrix((original_width, original_height)))
+    return transform_labels(annotations, matrix)
+
+def pad_image_and_labels(cropped_image, annotations, original_dimensions):
+    cropped_dimensions = cropped_image.shape[:2]
+    pad_vertical, pad_horizontal = get_padding(cropped_dimensions, original_dimensions)
 
     # Pad the cropped image
     padded_image = cv2.copyMakeBorder(cropped_image, pad_vertical, pad_vertical, pad_horizontal, pad_horizontal, cv2.BORDER_CONSTANT, value=[0, 0, 0])
 
-    # Adjust polygon coordinates
-    shifted_polygons = []
-    for polygon in adjusted_polygons:
-        new_polygon = []
-        for x, y in polygon:
-            # Clamp, denormalize, translate, and renormalize
-            x_clamped, y_clamped = clamp(x), clamp(y)
-            abs_x, abs_y = x_clamped * cropped_width, y_clamped * cropped_height
-        
-            # Careful translation considering padding
-            translated_x = abs_x + pad_horizontal if pad_horizontal > 0 else abs_x
-            translated_y = abs_y + pad_vertical if pad_vertical > 0 else abs_y
-
-            # Renormalize to the original dimensions, considering the padding might have changed the effective area
-            new_x = translated_x / original_width
-            new_y = translated_y / original_height
-
-            new_polygon.append((clamp(new_x), clamp(new_y)))
-        shifted_polygons.append(new_polygon)
-
-    return padded_image, shifted_polygons
-
-def overlay_detections_on_coco(coco_image, image, detection_polygons, overlay_scale_choice, min_scale=0.1, max_scale=1.0):
-    adjusted_polygons = []
-    
-    # Initialize an empty mask for all detections
-    combined_mask = np.zeros(image.shape[:2], dtype=np.uint8)
-    
-    for idx, polygon in enumerate(detection_polygons):
-        
-        # Convert polygon points to integer coordinates
-        polygon_points = np.array([(int(x * image.shape[1]), int(y * image.shape[0])) for x, y in polygon], dtype=np.int32)
-        
-        # Fill the polygon in the combined mask
-        cv2.fillPoly(combined_mask, [polygon_points], 255)
-
-    # Create an RGBA image with transparency for all detections
-    b, g, r = cv2.split(image)
-    alpha_channel = np.zeros_like(b)
-    alpha_channel[combined_mask > 0] = 255
-    rgba_detection = cv2.merge((b, g, r, alpha_channel))
+    return padded_image, pad_labels(annotations, cropped_dimensions, original_dimensions)
 
-    # Find the bounding box of the combined mask
-    x, y, w, h = cv2.boundingRect(combined_mask)
-    cropped_detection = rgba_detection[y:y+h, x:x+w]
+def get_letterbox(img_width, img_height, output_size):
+    # Size of the image scaled to fit output_size (width, height) and its offset on the canvas
+    output_width, output_height = output_size
+    scale = min(output_width / img_width, output_height / img_height)
+    new_width = min(max(int(round(img_width * scale)), 1), output_width)
+    new_height = min(max(int(round(img_height * scale)), 1), output_height)
+    return new_width, new_height, (output_width - new_width) // 2, (output_height - new_height) // 2
 
-    # Scale down if the cropped detection is larger than the COCO image
-    scale_factor = min(coco_image.shape[0] / cropped_detection.shape[0], coco_image.shape[1] / cropped_detection.shape[1])
+def letterbox_matrix(img_width, img_height, output_size):
+    # Pixel-space letterbox affine, from the image to the output canvas
+    new_width, new_height, x_offset, y_offset = get_letterbox(img_width, img_height, output_size)
+    return scale_translate_matrix(new_width / img_width, new_height / img_height, x_offset, y_offset)
 
-    if scale_factor < 1.0:
-        cropped_detection = cv2.resize(cropped_detection, (int(cropped_detection.shape[1] * scale_factor), int(cropped_detection.shape[0] * scale_factor)))
-
-    # Apply a random scale factor between min_scale and max_scale
-    if overlay_scale_choice:
-        random_scale_factor = random.uniform(min_scale, max_scale)
-        new_width = int(cropped_detection.shape[1] * random_scale_factor)
-        new_height = int(cropped_detection.shape[0] * random_scale_factor)
-        cropped_detection = cv2.resize(cropped_detection, (new_width, new_height))
-
-    # Create an overlay with transparency
-    overlay = np.zeros((coco_image.shape[0], coco_image.shape[1], 4), dtype=np.uint8)
-    x_offset = random.randint(0, max(coco_image.shape[1] - cropped_detection.shape[1], 1))
-    y_offset = random.randint(0, max(coco_image.shape[0] - cropped_detection.shape[0], 1))
-
-    # Ensure the overlay fits within the bounds of the coco_image
-    overlay_height, overlay_width = cropped_detection.shape[0], cropped_detection.shape[1]
-    if x_offset + overlay_width > coco_image.shape[1]:
-        overlay_width = coco_image.shape[1] - x_offset
-    if y_offset + overlay_height > coco_image.shape[0]:
-        overlay_height = coco_image.shape[0] - y_offset
-    
-    # Resize the cropped_detection to fit within the bounds if necessary
-    cropped_detection = cropped_detection[:overlay_height, :overlay_width]
+def letterbox_image_and_labels(image, annotations, output_size):
+    img_height, img_width = image.shape[:2]
+    new_width, new_height, x_offset, y_offset = get_letterbox(img_width, img_height, output_size)
+    if (new_width, new_height) == (img_width, img_height) and tuple(output_size) == (img_width, img_height):
+        return image, annotations
 
-    
+    # Scale to fit, then pad with black bars to the output size
+    interpolation = cv2.INTER_AREA if new_width < img_width else cv2.INTER_LINEAR
+    resized = cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+    canvas = cv2.copyMakeBorder(resized, y_offset, output_size[1] - new_height - y_offset, x_offset, output_size[0] - new_width - x_offset,
+                                cv2.BORDER_CONSTANT, value=[0, 0, 0])
 
-    overlay[y_offset:y_offset + cropped_detection.shape[0], x_offset:x_offset + cropped_detection.shape[1]] = cropped_detection
+    matrix = pixel_to_normalized_matrix(letterbox_matrix(img_width, img_height, output_size), (img_width, img_height), output_size)
+    return canvas, annotations.transform(matrix)
 
-    # Combine the overlay with the original image
-    b, g, r, a = cv2.split(overlay)
-    alpha = a / 255.0
+def cover_image(image, output_size):
+    # Scale image to cover output_size (width, height) and crop the center, without bars
+    img_height, img_width = image.shape[:2]
+    output_width, output_height = output_size
+    scale = max(output_width / img_width, output_height / img_height)
+    new_width = max(int(np.ceil(img_width * scale)), output_width)
+    new_height = max(int(np.ceil(img_height * scale)), output_height)
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    resized = cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+    x_offset = (new_width - output_width) // 2
+    y_offset = (new_height - output_height) // 2
+    return resized[y_offset:y_offset + output_height, x_offset:x_offset + output_width]
+
+def blend_overlay(background, overlay, alpha):
+    # Fixed-point alpha blend of overlay into background (both uint8, same size), in place.
+    # (value + 128 + ((value + 128) >> 8)) >> 8 is an exact rounding division by 255
+    alpha = alpha.astype(np.uint16)
+    blended = overlay * alpha
+    blended += background * (255 - alpha)
+    blended += 128
+    blended += blended >> 8
+    blended >>= 8
+    background[...] = blended
+
+def overlay_detections_on_coco(coco_image, image, annotations, overlay_scale_factor=1.0, overlay_x=0.0, overlay_y=0.0):
+    # overlay_scale_factor scales the detections on top of fitting them into the background,
+    # overlay_x and overlay_y in [0, 1) place them within the free space of the background
+    img_height, img_width = image.shape[:2]
+    no_labels = annotations[:0]
+    offsets = annotations.offsets
 
-    for c in range(3):
-        coco_image[:, :, c] = (1.0 - alpha) * coco_image[:, :, c] + alpha * overlay[:, :, c]
+    # Convert polygon points to integer coordinates
+    points = (annotations.coords * (img_width, img_height)).astype(np.int32)
+    if len(points) == 0:
+        return coco_image, no_labels
 
-    # Adjust polygon labels for all detections
-    for polygon in detection_polygons:
-        adjusted_polygon = []
-        for x_poly, y_poly in polygon:
-            # Scale to original dimensions
-            x_abs = x_poly * image.shape[1]
-            y_abs = y_poly * image.shape[0]
+    # Only rasterize inside the bounding rect of the detections
+    roi_x_min, roi_y_min = np.maximum(points.min(axis=0), 0).tolist()
+    roi_x_max, roi_y_max = np.minimum(points.max(axis=0) + 1, (img_width, img_height)).tolist()
+    if roi_x_max <= roi_x_min or roi_y_max <= roi_y_min:
+        return coco_image, no_labels
 
-            # Translate to combined bounding box
-            x_abs -= x
-            y_abs -= y
+    roi_mask = np.zeros((roi_y_max - roi_y_min, roi_x_max - roi_x_min), dtype=np.uint8)
+    for i in range(len(offsets) - 1):
+        # One call per polygon, overlapping polygons in a single call would cancel out
+        cv2.fillPoly(roi_mask, [points[offsets[i]:offsets[i + 1]]], 255, offset=(-roi_x_min, -roi_y_min))
 
-            # Apply initial scale factor (resizing)
-            if scale_factor < 1.0:
-                x_abs *= scale_factor
-                y_abs *= scale_factor
+    # Find the bounding box of the combined mask
+    x, y, w, h = cv2.boundingRect(roi_mask)
+    if w == 0 or h == 0:
+        return coco_image, no_labels
+    cropped_mask = roi_mask[y:y + h, x:x + w]
+    x += roi_x_min
+    y += roi_y_min
+    cropped_detection = cv2.merge((*cv2.split(image[y:y + h, x:x + w]), cropped_mask))
 
-            # Apply random scale factor
-            if overlay_scale_choice:
-                x_abs *= random_scale_factor
-                y_abs *= random_scale_factor
+    # Scale down if the cropped detection is larger than the COCO image
+    scale_factor = min(coco_image.shape[0] / h, coco_image.shape[1] / w, 1.0)
 
-            # Translate to new position
-            x_abs += x_offset
-            y_abs += y_offset
+    scale_factor *= overlay_scale_factor
 
-            # Normalize back to the new image dimensions
-            x_norm = x_abs / coco_image.shape[1]
-            y_norm = y_abs / coco_image.shape[0]
+    # Single resize for the combined scale
+    new_width = max(int(w * scale_factor), 1)
+    new_height = max(int(h * scale_factor), 1)
+    if (new_width, new_height) != (w, h):
+        cropped_detection = cv2.resize(cropped_detection, (new_width, new_height))
 
-            adjusted_polygon.append((x_norm, y_norm))
-        adjusted_polygons.append(adjusted_polygon)
+    x_offset = uniform_index(overlay_x, max(coco_image.shape[1] - new_width, 1) + 1)
+    y_offset = uniform_index(overlay_y, max(coco_image.shape[0] - new_height, 1) + 1)
 
-    return coco_image, adjusted_polygons
+    # Ensure the overlay fits within the bounds of the coco_image
+    overlay_width = min(new_width, coco_image.shape[1] - x_offset)
+    overlay_height = min(new_height, coco_image.shape[0] - y_offset)
+    cropped_detection = cropped_detection[:overlay_height, :overlay_width]
 
-def augment_image(image, polygons, current_subfolder, class_ids, h, w, skip_augmentations, mirror_weights, crop_weights,
-                  overlay_weights, overlay_scale_weights, overlay_min_max_scale, maintain_aspect_ratio_weights, 
-                  zoom_weights, zoom_in_vs_out_weights, zoom_padding, coco_image_folder):
-    
-    if current_subfolder not in skip_augmentations['Mirror']:
-        mirror_choice = random.choices([True, False], weights=mirror_weights, k=1)[0]
-        if mirror_choice:
+    # Blend only the pasted rectangle
+    background = coco_image[y_offset:y_offset + overlay_height, x_offset:x_offset + overlay_width]
+    blend_overlay(background, cropped_detection[:, :, :3], cropped_detection[:, :, 3:])
+
+    # Adjust polygon labels for all detections: denormalize, move the combined bounding box to the
+    # origin, apply the resize, translate to the new position and normalize to the COCO image
+    matrix = compose(denormalize_matrix((img_width, img_height)),
+                     scale_translate_matrix(tx=-x, ty=-y),
+                     scale_translate_matrix(new_width / w, new_height / h, x_offset, y_offset),
+                     normalize_matrix((coco_image.shape[1], coco_image.shape[0])))
+
+    return coco_image, transform_labels(annotations, matrix)
+
+class FusedGeometry:
+    # Accumulates geometric stages as one pixel-space affine plus an output canvas size and
+    # renders them with a single cv2.warpAffine. Matrices use continuous pixel coordinates
+    # (pixel i spans [i, i + 1)), which is the convention normalized labels live in.
+    def __init__(self, width, height):
+        self.source_dims = (width, height)
+        self.matrix = identity_matrix()
+        self.width = width
+        self.height = height
+
+        # Part of the source that is still visible. Anything a stage pushes off the canvas is
+        # gone for good, even if a later pad or rotation grows the canvas again
+        self.visible_box = (0.0, 0.0, float(width), float(height))
+
+    def apply(self, matrix, width, height):
+        self.restrict_to_canvas()
+
+        # Returns the same stage expressed between the normalized label spaces
+        label_matrix = pixel_to_normalized_matrix(matrix, (self.width, self.height), (width, height))
+        self.matrix = compose(self.matrix, matrix)
+        self.width, self.height = width, height
+        return label_matrix
+
+    def restrict_to_canvas(self):
+        # Map the canvas corners back to the source. Exact while the stages are axis aligned.
+        # Rotation is the only stage that is not, and only the letterbox comes after it: its canvas
+        # holds the whole rotated image, so the box around the mapped corners still contains every
+        # source pixel that ends up on the canvas. A box that is too large only costs the warp a
+        # few extra pixels to read
+        corners = np.array([[0, 0, 1], [self.width, 0, 1], [0, self.height, 1], [self.width, self.height, 1]], dtype=np.float64)
+        source_corners = corners @ np.linalg.inv(self.matrix).T
+        x_min, y_min = source_corners[:, :2].min(axis=0)
+        x_max, y_max = source_corners[:, :2].max(axis=0)
+
+        visible_x_min, visible_y_min, visible_x_max, visible_y_max = self.visible_box
+        self.visible_box = (max(visible_x_min, x_min), max(visible_y_min, y_min),
+                            min(visible_x_max, x_max), min(visible_y_max, y_max))
+
+    def is_identity(self):
+        return (self.width, self.height) == self.source_dims and np.allclose(self.matrix, identity_matrix())
+
+    def is_mirror(self):
+        # Exactly a horizontal flip of the whole image
+        return (self.width, self.height) == self.source_dims and \
+            np.allclose(self.matrix, scale_translate_matrix(-1.0, 1.0, self.width, 0.0))
+
+    def warp(self, image, dst=None):
+        # dst is an optional (height, width, channels) buffer to render into
+        if self.is_identity():
+            if dst is None:
+                return image
+            dst[...] = image
+            return dst
+
+        # Only warp from the visible part of the source (a view, no copy)
+        self.restrict_to_canvas()
+        x_min, y_min, x_max, y_max = (int(round(value)) for value in self.visible_box)
+        x_min, y_min = max(x_min, 0), max(y_min, 0)
+        x_max, y_max = max(min(x_max, image.shape[1]), x_min + 1), max(min(y_max, image.shape[0]), y_min + 1)
+        visible = image[y_min:y_max, x_min:x_max]
+
+        # cv2.warpAffine samples at pixel centers, so shift into and out of that convention
+        matrix = compose(scale_translate_matrix(tx=0.5 + x_min, ty=0.5 + y_min), self.matrix, scale_translate_matrix(tx=-0.5, ty=-0.5))
+        return cv2.warpAffine(visible, matrix[:2], (self.width, self.height), dst=dst)
+
+def count_crop_drops(instances, annotations):
+    # Parts of a polygon the crop split in two count as instances, so this is a lower bound
+    count('crop_dropped', max(instances - len(annotations), 0))
+
+def simplify_labels(annotations, tolerance, width, height):
+    # Douglas-Peucker with a tolerance in pixels of a width x height image, counting the vertices
+    # before and after
+    with stage('simplify'):
+        simplified = annotations.simplify(tolerance, width, height)
+    count('simplify_vertices_in', len(annotations.coords))
+    count('simplify_vertices_out', len(simplified.coords))
+    return simplified
+
+def apply_geometry(image, annotations, plan, h, w, output_size=None):
+
+    if plan['mirror']:
+        with stage('mirror'):
             image = mirror_image(image)
-            polygons = [mirror_polygon(polygon) for polygon in polygons]
-
-    if current_subfolder not in skip_augmentations['Crop']:
-        crop_choice = random.choices([True, False], weights=crop_weights, k=1)[0]
-        if crop_choice and polygons:
-            image, polygons, class_ids = crop_image_and_polygons(image, polygons, class_ids)
-            maintain_aspect_ratio_choice = random.choices([True, False], weights=maintain_aspect_ratio_weights, k=1)[0]
-            if maintain_aspect_ratio_choice:
-                image, polygons = pad_image_and_adjust_polygons(image, polygons, (h, w))
-    
-    
-    if current_subfolder not in skip_augmentations['Zoom']:
-        zoom_choice = random.choices([True, False], weights=zoom_weights, k=1)[0]
-        if zoom_choice and polygons:
-            zoom_in = random.choices([True, False], weights=zoom_in_vs_out_weights, k=1)[0]
-            if zoom_in:
-                image, polygons = zoom_in_image_and_polygons(image, polygons, zoom_padding[0], zoom_padding[1])
+            annotations = annotations.transform(mirror_matrix())
+
+    if plan['crop'] and annotations:
+        instances = len(annotations)
+        with stage('crop'):
+            image, annotations = crop_image_and_labels(image, annotations, plan['crop_vertical'], plan['crop_percentage'])
+        count_crop_drops(instances, annotations)
+        if plan['pad']:
+            with stage('pad'):
+                image, annotations = pad_image_and_labels(image, annotations, (h, w))
+
+    if plan['zoom'] and annotations:
+        if plan['zoom_in']:
+            with stage('zoom_in'):
+                image, annotations = zoom_in_image_and_labels(image, annotations, plan['zoom_in_padding'])
+        else:
+            with stage('zoom_out'):
+                image, annotations = zoom_out_image_and_labels(image, annotations, plan['zoom_out_padding_x'], plan['zoom_out_padding_y'])
+
+    if plan['rotate']:
+        with stage('rotate'):
+            image, annotations = rotate_image_and_labels(image, annotations, float(plan['rotation_angle']))
+
+    if output_size:
+        with stage('letterbox'):
+            image, annotations = letterbox_image_and_labels(image, annotations, output_size)
+
+    return image, annotations
+
+def apply_fused_geometry(image, annotations, plan, h, w, output_size=None):
+    # Same plan as apply_geometry, but every stage only updates the fused matrix and the
+    # labels, and the image is resampled once at the end
+    geometry, annotations = plan_fused_geometry(image.shape[1], image.shape[0], annotations, plan, h, w, output_size)
+    with stage('warp'):
+        image = geometry.warp(image)
+    return image, annotations
+
+def plan_fused_geometry(image_width, image_height, annotations, plan, h, w, output_size=None):
+    # Label half of apply_fused_geometry: runs every stage on the labels and returns them with the
+    # FusedGeometry that renders the image. The stage timers only cover this label work
+    geometry = FusedGeometry(image_width, image_height)
+
+    if plan['mirror']:
+        with stage('mirror'):
+            label_matrix = geometry.apply(scale_translate_matrix(-1.0, 1.0, geometry.width, 0.0), geometry.width, geometry.height)
+            annotations = annotations.transform(label_matrix)
+
+    if plan['crop'] and annotations:
+        instances = len(annotations)
+        with stage('crop'):
+            try:
+                crop_box, clip_box, matrix = get_crop(annotations.coords, geometry.width, geometry.height, plan['crop_vertical'], plan['crop_percentage'])
+                annotations = crop_labels(annotations, clip_box, matrix)
+                x_min, y_min, x_max, y_max = crop_box
+                geometry.apply(scale_translate_matrix(tx=-x_min, ty=-y_min), x_max - x_min, y_max - y_min)
+            except Exception as e:
+                print(f"Error during cropping: {e}. Returning original image and polygons.")
+        count_crop_drops(instances, annotations)
+
+        if plan['pad']:
+            with stage('pad'):
+                cropped_dimensions = (geometry.height, geometry.width)
+                pad_vertical, pad_horizontal = get_padding(cropped_dimensions, (h, w))
+                annotations = pad_labels(annotations, cropped_dimensions, (h, w))
+                geometry.apply(scale_translate_matrix(tx=pad_horizontal, ty=pad_vertical),
+                               geometry.width + 2 * pad_horizontal, geometry.height + 2 * pad_vertical)
+
+    if plan['zoom'] and annotations:
+        with stage('zoom_in' if plan['zoom_in'] else 'zoom_out'):
+            if plan['zoom_in']:
+                _, crop_box = get_zoom_in_box(annotations.coords, geometry.width, geometry.height, plan['zoom_in_padding'])
+                x_min, y_min, x_max, y_max = crop_box
+                matrix = compose(scale_translate_matrix(tx=-x_min, ty=-y_min),
+                                 scale_translate_matrix(geometry.width / (x_max - x_min), geometry.height / (y_max - y_min)))
+                label_matrix = geometry.apply(matrix, geometry.width, geometry.height)
             else:
-                image, polygons = zoom_out_image_and_polygons(image, polygons, zoom_padding[2], zoom_padding[3])
+                canvas_width, canvas_height, x_offset, y_offset = get_zoom_out_canvas(geometry.width, geometry.height,
+                                                                                      plan['zoom_out_padding_x'], plan['zoom_out_padding_y'])
+                label_matrix = geometry.apply(scale_translate_matrix(tx=x_offset, ty=y_offset), canvas_width, canvas_height)
+            annotations = transform_labels(annotations, label_matrix)
+
+    if plan['rotate']:
+        with stage('rotate'):
+            rotation_degree = float(plan['rotation_angle'])
+            _, new_w, new_h = get_rotation_canvas(geometry.width, geometry.height, rotation_degree)
+            matrix = pixel_rotation_matrix(rotation_degree, (geometry.width / 2, geometry.height / 2), (new_w / 2, new_h / 2))
+            label_matrix = geometry.apply(matrix, new_w, new_h)
+            annotations = transform_labels(annotations, label_matrix)
+
+    if output_size:
+        # The letterbox is just one more affine, so it costs nothing on top of the single warp
+        with stage('letterbox'):
+            label_matrix = geometry.apply(letterbox_matrix(geometry.width, geometry.height, output_size), output_size[0], output_size[1])
+            annotations = annotations.transform(label_matrix)
+
+    return geometry, annotations
+
+def augment_image(image, polygons, current_subfolder, class_ids, h, w, skip_augmentations, mirror_weights, crop_weights,
+                  overlay_weights, overlay_scale_weights, overlay_min_max_scale, maintain_aspect_ratio_weights,
+                  zoom_weights, zoom_in_vs_out_weights, zoom_padding, coco_image_folder, fused_geometry=False, plan=None,
+                  output_size=None, photometric=None, simplify_tolerance=None, simplify_after_clip=False):
+    # polygons is an Annotations (class_ids is then ignored) or a list of [(x, y), ...] polygons
+    # with a class id each. Returns the augmented image and its Annotations. simplify_tolerance
+    # (pixels) simplifies the polygons before the augmentation, and with simplify_after_clip
+    # again after it
+
+    # plan (see augmentation_plan) holds every random decision. Without one, a plan is sampled
+    # from the random module so random.seed still makes runs reproducible
+    if plan is None:
+        plan = sample_plan(current_subfolder, random.getrandbits(64), skip_augmentations=skip_augmentations,
+                           mirror_weights=mirror_weights, crop_weights=crop_weights, overlay_weights=overlay_weights,
+                           overlay_scale_weights=overlay_scale_weights, overlay_min_max_scale=overlay_min_max_scale,
+                           maintain_aspect_ratio_weights=maintain_aspect_ratio_weights, zoom_weights=zoom_weights,
+                           zoom_in_vs_out_weights=zoom_in_vs_out_weights, zoom_padding=zoom_padding,
+                           photometric=photometric)
+
+    # Pack the labels once, every stage works on the packed arrays
+    annotations = polygons if isinstance(polygons, Annotations) else Annotations.from_polygons(polygons, class_ids)
+    if simplify_tolerance:
+        annotations = simplify_labels(annotations, simplify_tolerance, image.shape[1], image.shape[0])
+    return augment_labels(image, annotations, plan, h, w, coco_image_folder, fused_geometry, output_size,
+                          simplify_tolerance if simplify_after_clip else None)
+
+class BufferPool:
+    # Scratch space for images that are only needed until the next sample, like the warped
+    # detections an overlay copies from. One flat buffer grows to the largest request and is
+    # handed out as a view of any shape, so only one view is valid at a time
+    def __init__(self):
+        self.buffer = np.empty(0, dtype=np.uint8)
+
+    def get(self, shape):
+        size = int(np.prod(shape))
+        if size > self.buffer.size:
+            self.buffer = np.empty(size, dtype=np.uint8)
+        return self.buffer[:size].reshape(shape)
+
+def augment_batch(images, annotations, plans, coco_image_folder='', output_size=None, buffers=None, simplify_after=None):
+    # Augments a batch with one plan per sample, the same as augment_labels with fused_geometry
+    # on every sample. images is a list or a (B, H, W, 3) array, annotations a list of Annotations.
+    # The labels and geometry of every sample are worked out first. Samples that come down to a
+    # plain mirror are then flipped with one NumPy copy per image shape, the others are warped
+    # into preallocated buffers: with output_size (width, height) straight into a single
+    # (B, height, width, 3) output array, and through buffers (a BufferPool, which a caller can
+    # keep across batches) when they get overlaid. Photometric ops also write into the output
+    # array, in place where a sample is already there. simplify_after is as for augment_labels. Returns the images (that array, or a list
+    # without output_size) and a list of their Annotations
+    buffers = BufferPool() if buffers is None else buffers
+    if output_size:
+        outputs = np.empty((len(plans), output_size[1], output_size[0], 3), dtype=np.uint8)
+    else:
+        outputs = [None] * len(plans)
 
-    if current_subfolder not in skip_augmentations['Rotate']:
+    geometries = []
+    results = []
+    for image, sample_annotations, plan in zip(images, annotations, plans):
         (h, w) = image.shape[:2]
-        center = (w / 2, h / 2)
-        rotation_degree = get_rotation_angle()
-        image = rotate_image(image, rotation_degree)
-        new_w, new_h = image.shape[1], image.shape[0]
-        new_center = (new_w / 2, new_h / 2)
-        polygons = [rotate_polygon(polygon, rotation_degree, center, new_center, (w, h), (new_w, new_h)) for polygon in polygons]
-
-    if current_subfolder not in skip_augmentations['Overlay']:
-        overlay_choice = random.choices([True, False], weights=overlay_weights, k=1)[0]
-        if overlay_choice and polygons:
-            overlay_scale_choice = random.choices([True, False], weights=overlay_scale_weights, k=1)[0]
-            coco_images = [os.path.join(coco_image_folder, f) for f in os.listdir(coco_image_folder) if os.path.isfile(os.path.join(coco_image_folder, f))]
-            coco_image_path = random.choice(coco_images)
-            coco_image = cv2.imread(coco_image_path)
-            image, polygons = overlay_detections_on_coco(coco_image, image, polygons, overlay_scale_choice, overlay_min_max_scale[0], overlay_min_max_scale[1])
-    
-    
-    formatted_polygons = [['{}'.format(class_id), *polygon] for class_id, polygon in zip(class_ids, polygons)]
-    return image, formatted_polygons
-
-def process_images_and_labels(image_dir, label_dir, augmented_image_dir, augmented_label_dir, skip_augmentations, 
-                              mirror_weights, crop_weights, overlay_weights, overlay_scale_weights, overlay_min_max_scale, 
-                              maintain_aspect_ratio_weights, zoom_weights, zoom_in_vs_out_weights, zoom_padding, coco_images):
-    
-    for root, dirs, files in os.walk(image_dir):
-        print(f"Processing folder: {root}")
-        relative_path = os.path.relpath(root, image_dir)
-        current_subfolder = os.path.basename(relative_path)
-        current_augmented_image_dir = os.path.join(augmented_image_dir, relative_path)
-        current_augmented_label_dir = os.path.join(augmented_label_dir, relative_path)
-
-        os.makedirs(current_augmented_image_dir, exist_ok=True)
-        os.makedirs(current_augmented_label_dir, exist_ok=True)
-
-        for file in files:
-            if file.endswith((".jpg", ".png")):
-                img_path = os.path.join(root, file)
-                lbl_path = img_path.replace(image_dir, label_dir).replace('.jpg', '.txt').replace('.png', '.txt')
-                augmented_img_path = os.path.join(current_augmented_image_dir, file)
-                augmented_lbl_path = os.path.join(current_augmented_label_dir, file.replace('.jpg', '.txt').replace('.png', '.txt'))
-
-                image = cv2.imread(img_path)
-                (h, w) = image.shape[:2]
-
-                if os.path.exists(lbl_path):
-                    with open(lbl_path, 'r') as file:
-                        lines = file.readlines()
-                        polygons = []
-                        class_ids = []
-                        for line in lines:
-                            parts = line.strip().split()
-                            class_id = parts[0]
-                            class_ids.append(class_id)
-                            polygon = [(float(parts[i]), float(parts[i + 1])) for i in range(1, len(parts), 2)]
-                            polygons.append(polygon)
-                else:
-                    break
-                
-
-                image, polygons, class_ids = augment_image(image, polygons, class_ids, h, w, skip_augmentations, 
-                                                           mirror_weights, crop_weights, overlay_weights, 
-                                                           overlay_scale_weights, overlay_min_max_scale, 
-                                                           maintain_aspect_ratio_weights, zoom_weights, 
-                                                           zoom_in_vs_out_weights, zoom_padding, coco_images)
-
-                augmented_polygons = []
-                for i, polygon in enumerate(polygons):
-                    class_id = class_ids[i]
-                    augmented_line = class_id + ' ' + ' '.join(f'{x:.6f} {y:.6f}' for x, y in polygon)
-                    augmented_polygons.append(augmented_line)
-
-                cv2.imwrite(augmented_img_path, image)
-
-                with open(augmented_lbl_path, 'w') as file:
-                    file.write('\n'.join(augmented_polygons))
+        count('variants')
+        count('instances_in', len(sample_annotations))
+        geometry, sample_annotations = plan_fused_geometry(w, h, sample_annotations, plan, h, w, output_size)
+        geometries.append(geometry)
+        results.append(sample_annotations)
+
+    # Flips of every image shape in one copy, read straight from reversed views of the sources
+    flipped = {}
+    flips = {}
+    for index, geometry in enumerate(geometries):
+        if geometry.is_mirror():
+            flips.setdefault(images[index].shape, []).append(index)
+    for indices in flips.values():
+        with stage('mirror_batch'):
+            if isinstance(images, np.ndarray):
+                stack = images[indices, :, ::-1]
+            else:
+                stack = np.stack([images[index][:, ::-1] for index in indices])
+        flipped.update(zip(indices, stack))
+
+    for index, (plan, geometry) in enumerate(zip(plans, geometries)):
+        overlay = plan['overlay'] and results[index]
+        written = False
+        if index in flipped:
+            image = flipped[index]
+        elif geometry.is_identity():
+            # The overlay only reads the source, otherwise a copy, so no two outputs (or an output
+            # and its source) are the same array
+            if overlay:
+                image = images[index]
+            elif output_size:
+                image = outputs[index]
+                image[...] = images[index]
+                written = True
+            else:
+                image = images[index].copy()
+        else:
+            if overlay:
+                dst = buffers.get((geometry.height, geometry.width, 3))
+            else:
+                dst = outputs[index] if output_size else None
+                written = dst is not None
+            with stage('warp'):
+                image = geometry.warp(images[index], dst)
+
+        if overlay:
+            with stage('overlay_background'):
+                coco_image = get_overlay_pool(coco_image_folder).pick(plan['overlay_pick'])
+                if output_size:
+                    coco_image = cover_image(coco_image, output_size)
+            overlay_scale_factor = float(plan['overlay_scale_factor']) if plan['overlay_scale'] else 1.0
+            with stage('overlay_blend'):
+                image, results[index] = overlay_detections_on_coco(coco_image, image, results[index], overlay_scale_factor,
+                                                                   plan['overlay_x'], plan['overlay_y'])
+
+        if has_photometric(plan):
+            # Straight into the output array, in place for samples already warped into it
+            with stage('photometric'):
+                image = apply_photometric(image, plan, outputs[index] if output_size else None)
+            written = bool(output_size)
+
+        if simplify_after:
+            results[index] = simplify_labels(results[index], simplify_after, image.shape[1], image.shape[0])
+
+        if not written:
+            outputs[index] = image
+        count('instances_out', len(results[index]))
+
+    return outputs, results
+
+def augment_labels(image, annotations, plan, h, w, coco_image_folder, fused_geometry=False, output_size=None,
+                   simplify_after=None):
+    # Executes a plan on the Annotations of an image. The inputs are never modified in place, so
+    # one decoded image and its labels can be augmented several times. With output_size
+    # (width, height) every output is letterboxed to exactly that size. simplify_after is a
+    # tolerance in pixels of the output to simplify the output polygons with, which mostly takes
+    # out the vertices clipping put along the image border
+
+    # fused_geometry folds mirror/crop/pad/zoom/rotate into a single warp of the source image
+    count('variants')
+    count('instances_in', len(annotations))
+    geometry_stages = apply_fused_geometry if fused_geometry else apply_geometry
+    image, annotations = geometry_stages(image, annotations, plan, h, w, output_size)
+
+    if plan['overlay'] and annotations:
+        # coco_image_folder can be a directory path or an OverlayBackgroundPool
+        with stage('overlay_background'):
+            coco_image = get_overlay_pool(coco_image_folder).pick(plan['overlay_pick'])
+            if output_size:
+                coco_image = cover_image(coco_image, output_size)
+        overlay_scale_factor = float(plan['overlay_scale_factor']) if plan['overlay_scale'] else 1.0
+        with stage('overlay_blend'):
+            image, annotations = overlay_detections_on_coco(coco_image, image, annotations, overlay_scale_factor,
+                                                            plan['overlay_x'], plan['overlay_y'])
+
+    # Last, so an overlay background gets the same look as the detections on it
+    if has_photometric(plan):
+        with stage('photometric'):
+            image = apply_photometric(image, plan)
+
+    if simplify_after:
+        annotations = simplify_labels(annotations, simplify_after, image.shape[1], image.shape[0])
+
+    count('instances_out', len(annotations))
+    return image, annotations
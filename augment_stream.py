@@ -0,0 +1,122 @@
+import os
+import multiprocessing
+from collections import deque
+import numpy as np
+import batch_augment
+from augment_data import augment_labels, augment_batch
+from augmentation_plan import SAMPLING_SETTINGS, sample_plans
+from dataset_manifest import open_manifest
+
+# Augments a dataset on the fly for a training loop instead of writing _Augmented copies to disk.
+# Every pass over an AugmentationStream is an epoch with its own plans (and shuffle order),
+# derived from the stream seed and the epoch number, so epoch n is the same on every run.
+
+def augment_sample(task):
+    # Runs in a worker: decode and parse one source, augment it once per plan
+    image_path, label_path, plans, target_size = task
+    settings = batch_augment.worker_settings
+    source, problem = batch_augment.load_source(image_path, label_path, target_size)
+    if source is None:
+        return []
+
+    image, annotations = source
+    (h, w) = image.shape[:2]
+    samples = []
+    try:
+        annotations, simplify_after = batch_augment.prepare_labels(annotations, settings, w, h)
+        if settings.get('fused_geometry', False):
+            # All variants of the source as one batch, see augment_data.augment_batch
+            images, results = augment_batch([image] * len(plans), [annotations] * len(plans), plans,
+                                            settings.get('coco_image_folder'), settings.get('output_size'),
+                                            simplify_after=simplify_after)
+            samples = list(zip(images, results))
+        else:
+            for plan in plans:
+                augmented, results = augment_labels(image, annotations, plan, h, w, settings.get('coco_image_folder'),
+                                                    False, settings.get('output_size'), simplify_after)
+                # A plan that leaves the image as it is (or only crops it) returns the source or a
+                # view of it. Copy those, like augment_batch, so no two samples are the same array
+                if np.shares_memory(augmented, image):
+                    augmented = augmented.copy()
+                samples.append((augmented, results))
+    except Exception as e:
+        # Like the batch engine, one broken image must not stop the epoch
+        print(f"Error augmenting {image_path}: {type(e).__name__}: {e}. Skipping it.")
+    return samples
+
+class AugmentationStream:
+    # Iterable of (image_array, annotations.Annotations) samples over dataset_root/images/<split>.
+    # settings are the augment_image keyword arguments, as for batch_augment.run_jobs. At most
+    # prefetch sources are in flight at once, which bounds memory no matter how fast the consumer is.
+    # workers=0 augments in the calling process. target_size decodes sources at a reduced
+    # resolution, as for batch_augment.run_jobs
+    def __init__(self, dataset_root, settings, splits=('train',), workers=None, prefetch=32, seed=None,
+                 shuffle=True, variants_per_image=1, target_size=None):
+        self.settings = settings
+        self.sources = []
+        manifest = open_manifest(dataset_root, splits)
+        for split in splits:
+            self.sources.extend(batch_augment.collect_manifest_sources(manifest, split))
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.prefetch = max(prefetch, 1)
+        self.seed = int(np.random.SeedSequence().entropy % (2 ** 63)) if seed is None else seed
+        self.shuffle = shuffle
+        self.variants_per_image = variants_per_image
+        self.target_size = target_size
+        self.epoch = 0
+        self.pool = None
+
+    def __len__(self):
+        # Upper bound, sources without labels are skipped
+        return len(self.sources) * self.variants_per_image
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def epoch_tasks(self, epoch):
+        rng = np.random.default_rng([self.seed, epoch])
+        order = rng.permutation(len(self.sources)) if self.shuffle else np.arange(len(self.sources))
+        subfolders = [self.sources[i][3] for i in order for _ in range(self.variants_per_image)]
+        plans = sample_plans(len(subfolders), subfolders, *(self.settings[name] for name in SAMPLING_SETTINGS),
+                             seed=int(rng.integers(2 ** 63)), photometric=self.settings.get('photometric'))
+
+        k = self.variants_per_image
+        for position, index in enumerate(order.tolist()):
+            image_path, label_path = self.sources[index][:2]
+            yield image_path, label_path, plans[position * k:(position + 1) * k], self.target_size
+
+    def __iter__(self):
+        # Each pass is the next epoch, unless set_epoch picked one
+        epoch = self.epoch
+        self.epoch += 1
+
+        if self.workers == 0:
+            batch_augment.worker_settings = batch_augment.resolve_settings(self.settings, self.target_size)
+            for task in self.epoch_tasks(epoch):
+                yield from augment_sample(task)
+            return
+
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, initializer=batch_augment.init_worker,
+                                             initargs=(self.settings, 0, 0, 'default', self.target_size))
+
+        # Sliding window of in-flight sources, handed out in order
+        pending = deque()
+        for task in self.epoch_tasks(epoch):
+            pending.append(self.pool.apply_async(augment_sample, (task,)))
+            if len(pending) >= self.prefetch:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -12,8 +12,13 @@ from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor, QBrush, QImage
 import cv2
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-import numpy as np
 from augment_data import augment_image
+from overlay_pool import OverlayBackgroundPool
+from pipelined_io import read_image
+from annotations import Annotations
+from label_store import open_label_store
+from dataset_manifest import open_manifest
+from stage_profiler import collect, stage, format_profile
 
 class ClickFilter(QObject):
     def __init__(self, parent=None):
@@ -36,6 +41,7 @@ class AugmentDatasetGUI(QWidget):
 
         self.dataset_root = ""
         self.overlay_image_dir = ""
+        self.overlay_pool = None
         self.output_dir = ""
         self.skip_augmentations = {
             'Zoom': [],
@@ -52,8 +58,7 @@ class AugmentDatasetGUI(QWidget):
         self.folder_name = ""
         self.class_colors = {}  # Dictionary to store class colors
         self.augmented_image = None
-        self.augmented_polygons = None
-        self.augmented_image_original_dims = None
+        self.augmented_annotations = None
 
         self.rotation_random_vs_90 = [25, 75]
         self.zoom_in_vs_out_weights = [40, 60]
@@ -70,6 +75,7 @@ class AugmentDatasetGUI(QWidget):
         self.show_polygons = True 
         self.show_bounding_boxes = False 
         self.show_points = False 
+        self.show_stage_timings = False
 
         self.output_dir_set = False  # Flag to track if output directory has been set
 
@@ -156,6 +162,15 @@ class AugmentDatasetGUI(QWidget):
         self.overlay_scale_slider, self.overlay_scale_value = self.create_slider()
         self.add_slider_to_layout(weights_layout, "Overlay Scale % Probability: ", self.overlay_scale_slider, self.overlay_scale_value, 8)
 
+        # Longer side the images are decoded at, 0 keeps the full resolution
+        self.target_size_spinbox = QSpinBox()
+        self.target_size_spinbox.setRange(0, 8192)
+        self.target_size_spinbox.setSingleStep(32)
+        self.target_size_spinbox.setSpecialValueText("Full")
+        self.target_size_spinbox.valueChanged.connect(self.target_size_changed)
+        weights_layout.addWidget(QLabel("Target Resolution (px):"), 9, 0)
+        weights_layout.addWidget(self.target_size_spinbox, 9, 1)
+
         weights_group.setLayout(weights_layout)
 
         scroll_area = QScrollArea()
@@ -261,6 +276,11 @@ class AugmentDatasetGUI(QWidget):
         self.points_checkbox.stateChanged.connect(self.toggle_points)
         checkboxes_button_layout.addWidget(self.points_checkbox)
 
+        self.stage_timings_checkbox = QCheckBox("Show Stage Timings")
+        self.stage_timings_checkbox.setChecked(False)
+        self.stage_timings_checkbox.stateChanged.connect(self.toggle_stage_timings)
+        checkboxes_button_layout.addWidget(self.stage_timings_checkbox)
+
         self.augment_single_btn = QPushButton("Preview Augmentation")
         self.augment_single_btn.clicked.connect(self.augment_current_image)
         checkboxes_button_layout.addWidget(self.augment_single_btn)
@@ -287,6 +307,12 @@ class AugmentDatasetGUI(QWidget):
         self.image_label.setMinimumHeight(150)
         self.image_viewer_layout.addWidget(self.image_label)
 
+        # Per-stage timings and counters of the last preview
+        self.stage_timings_label = QLabel("")
+        self.stage_timings_label.setStyleSheet("font-family: monospace;")
+        self.stage_timings_label.setVisible(False)
+        self.image_viewer_layout.addWidget(self.stage_timings_label)
+
         # Navigation controls
         self.image_navigation_layout = QHBoxLayout()
         self.prev_button = QPushButton("Previous")
@@ -379,19 +405,11 @@ class AugmentDatasetGUI(QWidget):
 
         self.clear_layout(self.stats_layout)
 
-        class_counter = Counter()
-        image_counter = 0
-        instance_counter = 0
-
-        for label_path in self.label_paths.values():
-            if os.path.exists(label_path):
-                image_counter += 1
-                with open(label_path, 'r') as file:
-                    lines = file.readlines()
-                    for line in lines:
-                        class_id = line.strip().split()[0]
-                        class_counter[class_id] += 1
-                        instance_counter += 1
+        # Counts come from the label store, which is only rebuilt when labels changed
+        store = open_label_store(self.dataset_root)
+        class_counter = Counter({str(class_id): count for class_id, count in store.class_counts().items()})
+        image_counter = store.image_count
+        instance_counter = len(store)
 
         total_classes = len(class_counter)
         total_instances = instance_counter
@@ -492,9 +510,21 @@ class AugmentDatasetGUI(QWidget):
         dir_name = QFileDialog.getExistingDirectory(self, "Select Overlay Image Directory")
         if dir_name:
             self.overlay_image_dir = dir_name
+            if self.overlay_pool:
+                self.overlay_pool.close()
+            self.overlay_pool = OverlayBackgroundPool(dir_name, target_size=self.get_target_size())  # Index the directory once
             self.overlay_label.setText(dir_name)
             self.update_sliders_state()
 
+    def get_target_size(self):
+        return self.target_size_spinbox.value() or None
+
+    def target_size_changed(self, value):
+        # Backgrounds are cached at the old resolution, start a fresh pool
+        if self.overlay_pool:
+            self.overlay_pool.close()
+            self.overlay_pool = OverlayBackgroundPool(self.overlay_image_dir, target_size=self.get_target_size())
+
     def select_output_dir(self):
         dir_name = QFileDialog.getExistingDirectory(self, "Select Output Directory")
         if dir_name:
@@ -527,25 +557,16 @@ class AugmentDatasetGUI(QWidget):
         for key in self.skip_augmentations.keys():
             self.skip_augmentations[key] = []
 
-        # Scan dataset for folders and images
-        folders = set()
+        # Images and folders come from the dataset manifest, which only rescans directories that changed
+        manifest = open_manifest(self.dataset_root)
+        folders = manifest.folder_names()
         self.image_paths = []  # Reset image paths
         self.label_paths = {}  # Reset label paths
 
-        for root, dirs, files in os.walk(self.dataset_root):
-            if os.path.basename(root).lower() not in ['images', 'labels']:
-                for name in dirs:
-                    if name.lower() not in ['train', 'val', 'labels', 'images']:
-                        folders.add(name)
-                for file in files:
-                    if file.endswith(('.png', '.jpg', '.jpeg')):
-                        image_path = os.path.join(root, file)
-                        self.image_paths.append(image_path)
-                        label_path = os.path.join(self.dataset_root, 'labels', os.path.relpath(image_path, os.path.join(self.dataset_root, 'images')).replace('.jpg', '.txt').replace('.jpeg', '.txt').replace('.png', '.txt'))
-                        self.label_paths[image_path] = label_path
-
-        folders = list(folders)
-        folders.sort()
+        for directory in manifest.directory_names():
+            for image_path, label_path, _, _, _ in manifest.sources(directory):
+                self.image_paths.append(image_path)
+                self.label_paths[image_path] = label_path
 
         self.skip_table.setRowCount(len(folders))
 
@@ -592,7 +613,7 @@ class AugmentDatasetGUI(QWidget):
         if self.augmented_image is not None:
             # Display the augmented image
             self.image_name_label.setText(f"(Preview) {os.path.basename(self.current_image_path)}")
-            self.display_image_and_polygons(self.augmented_image, self.augmented_polygons)
+            self.display_image_and_polygons(self.augmented_image, self.augmented_annotations)
             self.show_original_btn.setText("Show Original Image")
         elif self.folder_images:
             self.current_image_path = self.folder_images[self.current_image_index]
@@ -618,11 +639,11 @@ class AugmentDatasetGUI(QWidget):
             augmented_label_path = os.path.join(self.output_dir, relative_label_path)
 
             if os.path.exists(augmented_label_path):
-                polygons, labels = self.load_polygons_and_labels(augmented_label_path, image.shape)
+                annotations = self.load_annotations(augmented_label_path)
             else:
-                polygons, labels = self.load_polygons_and_labels(label_path, image.shape)
+                annotations = self.load_annotations(label_path)
 
-            self.display_image_and_polygons(image, polygons)
+            self.display_image_and_polygons(image, annotations)
             self.update_navigation_buttons()
 
     def show_original_image(self):
@@ -630,8 +651,8 @@ class AugmentDatasetGUI(QWidget):
             if self.show_original_btn.text() == "Show Original Image":
                 self.image_name_label.setText(f"(Original) {os.path.basename(self.current_image_path)}")
                 original_image = cv2.imread(self.current_image_path)
-                polygons, _ = self.load_polygons_and_labels(self.label_paths.get(self.current_image_path), original_image.shape)
-                self.display_image_and_polygons(original_image, polygons)
+                annotations = self.load_annotations(self.label_paths.get(self.current_image_path))
+                self.display_image_and_polygons(original_image, annotations)
                 self.show_original_btn.setText("Show Augmented Image")
             else:
                 self.show_image()
@@ -682,7 +703,11 @@ class AugmentDatasetGUI(QWidget):
         self.show_points = state == Qt.Checked
         self.show_image()
 
-    def display_image_and_polygons(self, image, polygons):
+    def toggle_stage_timings(self, state):
+        self.show_stage_timings = state == Qt.Checked
+        self.stage_timings_label.setVisible(self.show_stage_timings)
+
+    def display_image_and_polygons(self, image, annotations):
         height, width, _ = image.shape
         image_bytes = image.tobytes()
         qimage = QImage(image_bytes, width, height, width * 3, QImage.Format_RGB888)
@@ -698,13 +723,14 @@ class AugmentDatasetGUI(QWidget):
 
         labels = []  # To store labels and positions for later drawing
 
-        if self.augmented_image is not None and self.augmented_image_original_dims is not None:
-            orig_h, orig_w = self.augmented_image_original_dims
-        else:
-            orig_h, orig_w = height, width
+        # Normalized labels scale straight to the pixmap, whatever the size of the image
+        pixel_coords = annotations.denormalized(scaled_pixmap.width(), scaled_pixmap.height())
+        bounds = annotations.offsets.tolist()
 
-        for polygon in polygons:
-            class_id = polygon[0]
+        for i, class_id in enumerate(annotations.class_ids.tolist()):
+            if bounds[i + 1] - bounds[i] < 2:
+                continue  # Ensure there are enough coordinates for a polygon
+            class_id = str(class_id)
             if class_id not in self.class_colors:
                 self.class_colors[class_id] = QColor(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
 
@@ -718,7 +744,7 @@ class AugmentDatasetGUI(QWidget):
             brush = QBrush(brush_color)
             brush.setStyle(Qt.SolidPattern)
 
-            points = [QPointF(pt[0] * scaled_pixmap.width() / orig_w, pt[1] * scaled_pixmap.height() / orig_h) for pt in polygon[1:]]
+            points = [QPointF(x, y) for x, y in pixel_coords[bounds[i]:bounds[i + 1]].tolist()]
 
             if self.show_polygons:
                 painter.setPen(pen)
@@ -775,65 +801,11 @@ class AugmentDatasetGUI(QWidget):
 
         self.image_label.setPixmap(scaled_pixmap)
 
-    def convert_bbox_to_polygon(self, bbox):
-        class_id = bbox[0]
-        x_center, y_center, width, height = map(float, bbox[1:])
-        half_w = width / 2
-        half_h = height / 2
-        points = [
-            x_center - half_w, y_center - half_h,
-            x_center + half_w, y_center - half_h,
-            x_center + half_w, y_center + half_h,
-            x_center - half_w, y_center + half_h
-        ]
-        return [class_id] + points
-
-    def load_polygons_and_labels(self, label_path, target_size):
-        polygons = []
-
-        if (label_path and os.path.exists(label_path)):
-            with open(label_path, 'r') as f:
-                label_data = f.readlines()
-
-            for line in label_data:
-
-                line_data = line.strip().split()
-                annotation_type = self.identify_annotation_type(line_data)
-                if (annotation_type == 'bbox'):
-                    polygon_data = self.convert_bbox_to_polygon(line_data)
-                else:
-                    polygon_data = line_data
-
-                if len(polygon_data) < 5:
-                    continue  # Ensure there are enough coordinates for a polygon
-
-                class_id = polygon_data[0]
-                if class_id not in self.class_colors:
-                    self.class_colors[class_id] = QColor(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-                
-                pen = QPen(self.class_colors[class_id], 2)
-                brush_color = QColor(self.class_colors[class_id].red(), self.class_colors[class_id].green(), self.class_colors[class_id].blue(), 100)  # Set opacity here (0-255)
-                brush = QBrush(brush_color)
-                brush.setStyle(Qt.SolidPattern)
-
-                # Extract normalized coordinates
-                coords = list(map(float, polygon_data[1:]))
-                points = [(coords[i] * target_size[1], coords[i+1] * target_size[0]) for i in range(0, len(coords), 2)]
-
-                polygons.append([class_id] + points)
-
-        return polygons, []
-
-    def identify_annotation_type(self, parts):
-        
-        if len(parts) < 5:
-            return "unknown"
-        if len(parts) % 2 == 1 and len(parts) > 5:
-            return "polygon"
-        elif len(parts) == 5:
-            return "bbox"
-        else:
-            return "unknown"
+    def load_annotations(self, label_path):
+        # Boxes become rectangles, so everything draws as a polygon
+        if label_path and os.path.exists(label_path):
+            return Annotations.read(label_path).boxes_to_polygons()
+        return Annotations()
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
@@ -892,62 +864,42 @@ class AugmentDatasetGUI(QWidget):
         maintain_aspect_ratio_weights = [self.maintain_aspect_ratio_slider.value(), 100 - self.maintain_aspect_ratio_slider.value()]
         zoom_in_vs_out_weights = [self.zoom_in_vs_out_slider.value(), 100 - self.zoom_in_vs_out_slider.value()]
 
-        # Load the image
-        image = cv2.imread(self.current_image_path)
-        (h, w) = image.shape[:2]
-
-        # Load the label file if it exists
-        label_path = self.label_paths.get(self.current_image_path)
-        if label_path and os.path.exists(label_path):
-            with open(label_path, 'r') as file:
-                lines = file.readlines()
-                polygons = []
-                class_ids = []
-                for line in lines:
-                    parts = line.strip().split()
-                    if self.identify_annotation_type(parts) == 'bbox':
-                        parts = self.convert_bbox_to_polygon(parts)
-                    
-                    class_id = parts[0]
-                    class_ids.append(class_id)
-                    polygon = [(float(parts[i]), float(parts[i + 1])) for i in range(1, len(parts), 2)]
-                    polygons.append(polygon)
-        else:
-            polygons = []
-            class_ids = []
-
-        # Run the augment_image function
-        augmented_image, augmented_polygons = augment_image(
-            image,
-            polygons,
-            self.folder_name,
-            class_ids,
-            h,
-            w,
-            self.skip_augmentations, 
-            mirror_weights, 
-            crop_weights,
-            overlay_weights, 
-            overlay_scale_weights, 
-            self.overlay_min_max_scale,
-            maintain_aspect_ratio_weights, 
-            zoom_weights, 
-            zoom_in_vs_out_weights,
-            self.zoom_padding,
-            self.overlay_image_dir if self.overlay_image_dir else ""
-        )
-
-        (new_h, new_w) = augmented_image.shape[:2]
-
-        denormalized_polygons = []
-        for polygon in augmented_polygons:
-            class_id = polygon[0]
-            denormalized_polygon = [class_id] + [(int(x * new_w), int(y * new_h)) for (x, y) in polygon[1:]]
-            denormalized_polygons.append(denormalized_polygon)
-
+        # One preview is cheap to profile, so its stage timings are always collected
+        with collect() as profiler:
+            # Load the image, reduced to the target resolution if one is set
+            with stage('decode'):
+                image = read_image(self.current_image_path, target_size=self.get_target_size())
+            (h, w) = image.shape[:2]
+
+            # Load the label file if it exists
+            with stage('read_labels'):
+                annotations = self.load_annotations(self.label_paths.get(self.current_image_path))
+
+            # Run the augment_image function
+            augmented_image, augmented_annotations = augment_image(
+                image,
+                annotations,
+                self.folder_name,
+                annotations.class_ids,
+                h,
+                w,
+                self.skip_augmentations, 
+                mirror_weights, 
+                crop_weights,
+                overlay_weights, 
+                overlay_scale_weights, 
+                self.overlay_min_max_scale,
+                maintain_aspect_ratio_weights, 
+                zoom_weights, 
+                zoom_in_vs_out_weights,
+                self.zoom_padding,
+                self.overlay_pool if self.overlay_pool else ""
+            )
+        self.stage_timings_label.setText('\n'.join(format_profile(profiler.take())))
+
+        # The labels stay normalized, so they are drawn and saved without rounding to pixels
         self.augmented_image = augmented_image
-        self.augmented_polygons = denormalized_polygons
-        self.augmented_image_original_dims = (new_h, new_w)
+        self.augmented_annotations = augmented_annotations
         self.show_image()
 
     def augment_and_save_current_image(self):
@@ -974,11 +926,7 @@ class AugmentDatasetGUI(QWidget):
             augmented_label_path = os.path.join(self.output_dir, relative_label_path)
 
             os.makedirs(os.path.dirname(augmented_label_path), exist_ok=True)
-            with open(augmented_label_path, 'w') as f:
-                for polygon in self.augmented_polygons:
-                    class_id = polygon[0]
-                    coords = [f"{x / self.augmented_image_original_dims[1]} {y / self.augmented_image_original_dims[0]}" for x, y in polygon[1:]]
-                    f.write(f"{class_id} {' '.join(coords)}\n")
+            self.augmented_annotations.write(augmented_label_path)
 
     def atoi(self, text):
         return int(text) if text.isdigit() else text
@@ -0,0 +1,176 @@
+import numpy as np
+
+# An augmentation plan holds every random decision augment_image makes for one image, so sampling
+# is separate from execution. Plans are rows of a structured array: a whole dataset is drawn with
+# one call from a seed, saved with np.save, and any row can be replayed exactly with
+# augment_image(..., plan=plans[i]).
+PLAN_DTYPE = np.dtype([
+    ('mirror', '?'),
+    ('crop', '?'),
+    ('crop_vertical', '?'),
+    ('crop_percentage', 'f4'),
+    ('pad', '?'),  # Pad back to the original aspect ratio after the crop
+    ('zoom', '?'),
+    ('zoom_in', '?'),
+    ('zoom_in_padding', 'f4'),
+    ('zoom_out_padding_x', 'f4'),  # Canvas size relative to the image, >= 1
+    ('zoom_out_padding_y', 'f4'),
+    ('rotate', '?'),
+    ('rotation_angle', 'f4'),
+    ('overlay', '?'),
+    ('overlay_scale', '?'),
+    ('overlay_scale_factor', 'f4'),
+    ('overlay_pick', 'f4'),  # Uniform [0, 1) pick from the overlay backgrounds
+    ('overlay_x', 'f4'),  # Uniform [0, 1) position within the free space of the background
+    ('overlay_y', 'f4'),
+    # Photometric stage, see photometric.py
+    ('tint', '?'),
+    ('tint_color', 'f4', (3,)),  # BGR
+    ('tint_strength', 'f4'),
+    ('contrast', '?'),
+    ('contrast_factor', 'f4'),
+    ('brightness', '?'),
+    ('brightness_shift', 'f4'),
+    ('hsv', '?'),
+    ('hue_shift', 'f4'),
+    ('saturation_factor', 'f4'),
+    ('value_factor', 'f4'),
+    ('blur', '?'),
+    ('blur_sigma', 'f4'),
+    ('murk', '?'),
+    ('noise_seed', 'u4'),
+    ('noise', '?'),
+    ('noise_sigma', 'f4'),
+])
+
+# Settings (augment_image keyword arguments) the sampler needs
+SAMPLING_SETTINGS = ('skip_augmentations', 'mirror_weights', 'crop_weights', 'overlay_weights', 'overlay_scale_weights',
+                     'overlay_min_max_scale', 'maintain_aspect_ratio_weights', 'zoom_weights', 'zoom_in_vs_out_weights',
+                     'zoom_padding')
+
+# Optional 'photometric' setting: the probability of every photometric op and the ranges its
+# values are drawn from. Ops left out of the setting keep these values, so they are off
+PHOTOMETRIC_DEFAULTS = {
+    'tint': 0.0, 'tint_color': (0, 50, 0), 'tint_strength': (0.1, 0.3),  # BGR color blended into the image
+    'contrast': 0.0, 'contrast_range': (0.7, 1.3),  # Scale around mid gray
+    'brightness': 0.0, 'brightness_range': (-30, 30),
+    'hsv': 0.0, 'hue_shift': 8, 'saturation_range': (0.7, 1.3), 'value_range': (0.8, 1.2),  # hue_shift in OpenCV units (of 180)
+    'blur': 0.0, 'blur_sigma': (0.5, 2.0),
+    'murk': 0.0,  # The murky water look of tools/murkify.py
+    'noise': 0.0, 'noise_sigma': (3, 12),  # Gaussian sensor noise, in levels of 255
+}
+
+class KeyedGenerator:
+    # Stand-in for the np.random.Generator methods sample_plans uses, where row i of every draw
+    # only depends on keys[i] (a uint64 per row) and how many draws came before. Lets a plan be
+    # tied to one image instead of to its position in the job list
+    def __init__(self, keys):
+        self.keys = np.asarray(keys, dtype=np.uint64)
+        self.draws = 0
+
+    def bits(self, count):
+        # splitmix64 of key + draw * golden ratio
+        self.draws += 1
+        with np.errstate(over='ignore'):
+            z = self.keys[:count] + np.uint64(self.draws) * np.uint64(0x9E3779B97F4A7C15)
+            z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+    def random(self, count):
+        return (self.bits(count) >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+    def uniform(self, low, high, count):
+        return low + (high - low) * self.random(count)
+
+    def integers(self, low, high, count):
+        return low + (self.random(count) * (high - low)).astype(np.int64)
+
+def sample_plans(count, subfolders, skip_augmentations, mirror_weights, crop_weights, overlay_weights, overlay_scale_weights,
+                 overlay_min_max_scale, maintain_aspect_ratio_weights, zoom_weights, zoom_in_vs_out_weights, zoom_padding, seed=None,
+                 keys=None, photometric=None):
+    # subfolders is the folder name of every image (or one name for all of them), used for skip_augmentations.
+    # Every field is drawn for every image, so row i only depends on the seed and count. With keys
+    # (one uint64 per row) row i only depends on keys[i] instead. photometric is the optional
+    # setting described at PHOTOMETRIC_DEFAULTS
+    rng = np.random.default_rng(seed) if keys is None else KeyedGenerator(keys)
+    subfolders = np.broadcast_to(np.asarray(subfolders, dtype=object), (count,))
+    plans = np.zeros(count, dtype=PLAN_DTYPE)
+
+    def choose(weights):
+        # Same odds as random.choices([True, False], weights=weights)
+        total = weights[0] + weights[1]
+        return rng.random(count) < (weights[0] / total if total else 0.0)
+
+    def allowed(stage):
+        return ~np.isin(subfolders, list(skip_augmentations.get(stage, [])))
+
+    plans['mirror'] = choose(mirror_weights) & allowed('Mirror')
+
+    plans['crop'] = choose(crop_weights) & allowed('Crop')
+    plans['crop_vertical'] = rng.random(count) < 0.5
+    plans['crop_percentage'] = rng.uniform(0.01, 0.5, count)
+    plans['pad'] = choose(maintain_aspect_ratio_weights)
+
+    plans['zoom'] = choose(zoom_weights) & allowed('Zoom')
+    plans['zoom_in'] = choose(zoom_in_vs_out_weights)
+    plans['zoom_in_padding'] = rng.uniform(zoom_padding[0], zoom_padding[1], count)
+    plans['zoom_out_padding_x'] = rng.uniform(zoom_padding[2], zoom_padding[3], count) + 1
+    plans['zoom_out_padding_y'] = rng.uniform(zoom_padding[2], zoom_padding[3], count) + 1
+
+    # 25% chance to rotate randomly, 75% chance to rotate by 0, 90, 180, or 270 degrees
+    plans['rotate'] = allowed('Rotate')
+    random_rotation = rng.random(count) < 0.25
+    plans['rotation_angle'] = np.where(random_rotation, rng.uniform(0, 360, count), 90 * rng.integers(0, 4, count))
+
+    plans['overlay'] = choose(overlay_weights) & allowed('Overlay')
+    plans['overlay_scale'] = choose(overlay_scale_weights)
+    plans['overlay_scale_factor'] = rng.uniform(overlay_min_max_scale[0], overlay_min_max_scale[1], count)
+    plans['overlay_pick'] = rng.random(count)
+    plans['overlay_x'] = rng.random(count)
+    plans['overlay_y'] = rng.random(count)
+
+    # Drawn after everything else, so the fields above don't change with the photometric setting
+    photometric = {**PHOTOMETRIC_DEFAULTS, **(photometric or {})}
+    photometric_allowed = allowed('Photometric')
+
+    def maybe(op):
+        return (rng.random(count) < photometric[op]) & photometric_allowed
+
+    plans['tint'] = maybe('tint')
+    plans['tint_color'] = photometric['tint_color']
+    plans['tint_strength'] = rng.uniform(*photometric['tint_strength'], count)
+    plans['contrast'] = maybe('contrast')
+    plans['contrast_factor'] = rng.uniform(*photometric['contrast_range'], count)
+    plans['brightness'] = maybe('brightness')
+    plans['brightness_shift'] = rng.uniform(*photometric['brightness_range'], count)
+    plans['hsv'] = maybe('hsv')
+    plans['hue_shift'] = rng.uniform(-photometric['hue_shift'], photometric['hue_shift'], count)
+    plans['saturation_factor'] = rng.uniform(*photometric['saturation_range'], count)
+    plans['value_factor'] = rng.uniform(*photometric['value_range'], count)
+    plans['blur'] = maybe('blur')
+    plans['blur_sigma'] = rng.uniform(*photometric['blur_sigma'], count)
+    plans['murk'] = maybe('murk')
+    plans['noise_seed'] = rng.integers(0, 2 ** 32, count)
+    plans['noise'] = maybe('noise')
+    plans['noise_sigma'] = rng.uniform(*photometric['noise_sigma'], count)
+
+    return plans
+
+def sample_plan(subfolder, seed=None, **settings):
+    # Single plan for one image, settings are the augment_image keyword arguments
+    return sample_plans(1, subfolder, *(settings[name] for name in SAMPLING_SETTINGS), seed=seed,
+                        photometric=settings.get('photometric'))[0]
+
+def upgrade_plans(plans):
+    # Plans saved before fields were added to PLAN_DTYPE, with the new fields zero (their stages off)
+    if plans.dtype == PLAN_DTYPE:
+        return plans
+    upgraded = np.zeros(plans.shape, dtype=PLAN_DTYPE)
+    for name in plans.dtype.names:
+        upgraded[name] = plans[name]
+    return upgraded
+
+def uniform_index(value, count):
+    # Map a uniform [0, 1) plan value to an index in range(count)
+    return min(int(value * count), count - 1)
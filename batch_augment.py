@@ -0,0 +1,348 @@
+import os
+import json
+import multiprocessing
+import cv2
+import numpy as np
+from augment_data import augment_labels, simplify_labels
+from annotations import Annotations
+from dataset_manifest import open_manifest
+from label_store import CACHE_DIR
+from run_journal import RunJournal, run_fingerprint
+from augmentation_plan import SAMPLING_SETTINGS, sample_plans, upgrade_plans
+from overlay_pool import IMAGE_EXTENSIONS, get_overlay_pool
+from pipelined_io import read_image, PrefetchingReader, AsyncWriter
+from output_encoding import EncodeStats, get_profile, output_path, encode_image, merge_stats
+import stage_profiler
+import noise_bank
+from stage_profiler import StageProfiler, stage, count, empty_profile, merge_profiles, format_profile
+
+# Batch augmentation of a whole dataset. Every image/label pair is a job, jobs of all splits go
+# into one list that is cut into chunks, and the chunks are spread over a process pool. The
+# augmentation plans of all jobs are sampled up front from the run seed, so a run gives the same
+# output for the same seed no matter how many workers there are or which worker picks up which chunk.
+
+# Inside a worker, each chunk runs as a three-stage pipeline: reader threads decode the next
+# sources while the worker thread augments, and writer threads encode and write the results.
+
+PLANS_FILE = 'augmentation_plans.npy'
+QUARANTINE_FILE = 'quarantine_report.json'
+IO_QUEUE_DEPTH = 8  # Sources read ahead and outputs queued for writing per worker
+PROFILE_MODES = (None, 'summary', 'trace')  # 'trace' also keeps every timed stage, see stage_profiler.write_trace
+
+# Per-process state, set by init_worker
+worker_settings = None
+worker_io = None
+
+def collect_sources(image_dir, label_dir):
+    # (image, label, relative path, subfolder) for every image, in a stable order
+    sources = []
+    for root, dirs, files in os.walk(image_dir):
+        dirs.sort()
+        relative_path = os.path.relpath(root, image_dir)
+        current_subfolder = os.path.basename(relative_path)
+
+        for file in sorted(files):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                label_file = os.path.splitext(file)[0] + '.txt'
+                sources.append((os.path.join(root, file),
+                                os.path.join(label_dir, relative_path, label_file),
+                                os.path.join(relative_path, file),
+                                current_subfolder))
+    return sources
+
+def collect_manifest_sources(manifest, split):
+    # Same as collect_sources for dataset_root/images/<split>, from a dataset manifest instead of a walk
+    sources = []
+    for directory in manifest.directory_names(split):
+        relative_path = os.path.join(*directory.split('/')[1:]) if '/' in directory else '.'
+        current_subfolder = os.path.basename(relative_path)
+        for image_path, label_path, _, _, _ in manifest.sources(directory):
+            sources.append((image_path, label_path, os.path.join(relative_path, os.path.basename(image_path)), current_subfolder))
+    return sources
+
+def collect_jobs(image_dir, label_dir, augmented_image_dir, augmented_label_dir, sources=None):
+    # One (image, label, augmented image, augmented label, subfolder) job per image
+    if sources is None:
+        sources = collect_sources(image_dir, label_dir)
+    jobs = []
+    for image_path, label_path, relative_image_path, current_subfolder in sources:
+        relative_label_path = os.path.splitext(relative_image_path)[0] + '.txt'
+        jobs.append((image_path,
+                     label_path,
+                     os.path.join(augmented_image_dir, relative_image_path),
+                     os.path.join(augmented_label_dir, relative_label_path),
+                     current_subfolder))
+    return jobs
+
+def collect_dataset_jobs(dataset_root, augmented_root, splits=('train', 'val')):
+    # All splits in one job list, so the pool never drains between train and val. The images
+    # come from the dataset manifest, which only rescans directories that changed
+    manifest = open_manifest(dataset_root, splits)
+    jobs = []
+    for split in splits:
+        jobs.extend(collect_jobs(os.path.join(dataset_root, 'images', split),
+                                 os.path.join(dataset_root, 'labels', split),
+                                 os.path.join(augmented_root, 'images', split),
+                                 os.path.join(augmented_root, 'labels', split),
+                                 collect_manifest_sources(manifest, split)))
+    return jobs
+
+def resolve_settings(settings, target_size=None):
+    # Settings with the overlay folder replaced by this process' background pool. Also points
+    # this process' noise bank at the 'noise_cache' file, if there is one
+    settings = dict(settings)
+    noise_bank.cache_file = settings.get('noise_cache')
+    if settings.get('coco_image_folder'):
+        settings['coco_image_folder'] = get_overlay_pool(settings['coco_image_folder'], target_size)
+    return settings
+
+def init_worker(settings, reader_threads=0, writer_threads=0, encoding='default', target_size=None, profile=None):
+    global worker_settings, worker_io
+    # The pool already runs one process per core, keep OpenCV from adding its own threads
+    cv2.setNumThreads(1)
+    stage_profiler.active = StageProfiler(trace=profile == 'trace') if profile else None
+    worker_settings = resolve_settings(settings, target_size)
+    worker_io = {
+        'reader_threads': reader_threads,
+        'target_size': target_size,
+        'writer': AsyncWriter(writer_threads, IO_QUEUE_DEPTH),
+        'profile': get_profile(encoding),
+        'stats': EncodeStats(),
+    }
+
+def variant_path(path, variant):
+    # The first variant keeps the source name, the others get a _<variant> suffix
+    if variant == 0:
+        return path
+    stem, extension = os.path.splitext(path)
+    return f'{stem}_{variant}{extension}'
+
+def load_source(image_path, label_path, target_size=None):
+    # Decoded image and Annotations of a source, or the status and reason it can't be used.
+    # target_size decodes at a reduced resolution, labels are normalized so they don't change
+    if not os.path.exists(label_path):
+        return None, ('skipped', 'no label file')
+
+    with stage('decode'):
+        image = read_image(image_path, target_size=target_size)
+    if image is None:
+        return None, ('failed', 'unreadable image')
+
+    with stage('read_labels'):
+        annotations = Annotations.read(label_path)
+    if stage_profiler.enabled():
+        count('bytes_read', os.path.getsize(image_path) + os.path.getsize(label_path))
+    return (image, annotations), None
+
+def load_job(job):
+    # Reader stage, runs on a reader thread
+    try:
+        return load_source(job[0], job[1], worker_io['target_size'])
+    except Exception as e:
+        return None, ('failed', f'{type(e).__name__}: {e}')
+
+def write_variant(image_path, image, label_path, annotations, profile, stats):
+    # Writer stage, runs on a writer thread
+    if not encode_image(image_path, image, profile, stats):
+        return False
+    with stage('write_labels'):
+        annotations.write(label_path)
+    if stage_profiler.enabled():
+        count('bytes_written', os.path.getsize(label_path))
+
+def prepare_labels(annotations, settings, w, h):
+    # Simplifies the labels of a source once with the 'simplify_tolerance' setting (pixels), and
+    # returns them with the tolerance to simplify every output with ('simplify_after_clip')
+    tolerance = settings.get('simplify_tolerance')
+    if not tolerance:
+        return annotations, None
+    return simplify_labels(annotations, tolerance, w, h), tolerance if settings.get('simplify_after_clip') else None
+
+def augment_job(job, source, plans, settings, io, key):
+    # One job uses its decoded image and parsed labels for every plan and queues each variant
+    # for writing. Write errors come back from writer.flush under key
+    image_path, label_path, augmented_image_path, augmented_label_path, current_subfolder = job
+    writer, profile, stats = io['writer'], io['profile'], io['stats']
+    image, annotations = source
+    (h, w) = image.shape[:2]
+    annotations, simplify_after = prepare_labels(annotations, settings, w, h)
+
+    for variant, plan in enumerate(plans):
+        augmented, augmented_annotations = augment_labels(
+            image, annotations, plan, h, w, settings.get('coco_image_folder'), settings.get('fused_geometry', False),
+            settings.get('output_size'), simplify_after)
+
+        writer.submit(key, write_variant, output_path(variant_path(augmented_image_path, variant), profile), augmented,
+                      variant_path(augmented_label_path, variant), augmented_annotations, profile, stats)
+
+    return 'augmented', None
+
+def process_chunk(task):
+    chunk_index, jobs, plans = task
+    variants_per_image = len(plans) // max(len(jobs), 1)
+
+    # The plans already know which backgrounds this chunk will overlay on
+    overlay_pool = worker_settings.get('coco_image_folder')
+    if overlay_pool:
+        overlay_pool.prefetch_picks(plans['overlay_pick'][plans['overlay']].tolist())
+
+    results = []
+    for index, (job, (source, problem)) in enumerate(PrefetchingReader(load_job, jobs, worker_io['reader_threads'], IO_QUEUE_DEPTH)):
+        if source is None:
+            results.append(problem)
+            continue
+        try:
+            job_plans = plans[index * variants_per_image:(index + 1) * variants_per_image]
+            results.append(augment_job(job, source, job_plans, worker_settings, worker_io, index))
+        except Exception as e:
+            # One broken image must not take the rest of the chunk with it
+            results.append(('failed', f'{type(e).__name__}: {e}'))
+
+    # A job only counts as augmented once all of its variants are on disk
+    for index, error in worker_io['writer'].flush().items():
+        if results[index][0] == 'augmented':
+            results[index] = ('failed', f'write error: {error}')
+    profile = stage_profiler.active.take() if stage_profiler.active is not None else None
+    return chunk_index, results, worker_io['stats'].take(), profile
+
+def run_jobs(jobs, settings, workers=None, chunk_size=16, seed=None, progress=None, plans=None, variants_per_image=1,
+             reader_threads=2, writer_threads=2, encoding='default', target_size=None, journal=None, profile=None):
+    # settings holds the augment_image keyword arguments (skip_augmentations, mirror_weights, ...).
+    # Every job writes variants_per_image independently sampled augmentations of its source.
+    # reader_threads and writer_threads are per worker process (0 reads/writes inline).
+    # encoding is an output_encoding profile name or dict. target_size (longer side in pixels)
+    # decodes sources at a reduced resolution when they are larger, which shrinks every later step.
+    # Pass the plans of an earlier run to replay it. With a run_journal.RunJournal, finished chunks
+    # are checkpointed and an interrupted run with the same arguments resumes where it stopped.
+    # profile ('summary' or 'trace') times every stage in the workers, the merged totals are the
+    # report's 'profile' (chunks a resumed run finished earlier are not in it).
+    # Returns a report with a status per job and the plans of all variants, in job order
+    workers = workers or os.cpu_count() or 1
+    get_profile(encoding)  # Fail here on an unknown profile, not inside the workers
+    if profile not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode {profile!r}, expected one of {', '.join(map(str, PROFILE_MODES))}")
+
+    if plans is not None:
+        plans = upgrade_plans(plans)
+
+    done = {}
+    if journal is not None:
+        fingerprint = run_fingerprint([job[:2] for job in jobs], settings, chunk_size, variants_per_image, encoding, target_size, seed,
+                                      plans)
+        resumed = journal.resume(fingerprint)
+        if resumed is not None:
+            seed, plans, done = resumed
+
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % (2 ** 63))
+
+    # Plans of the variants of job i are plans[i * variants_per_image:(i + 1) * variants_per_image]
+    if plans is None:
+        subfolders = [job[4] for job in jobs for _ in range(variants_per_image)]
+        plans = sample_plans(len(subfolders), subfolders, *(settings[name] for name in SAMPLING_SETTINGS), seed=seed,
+                             photometric=settings.get('photometric'))
+    elif len(plans) != len(jobs) * variants_per_image:
+        raise ValueError(f"Got {len(plans)} plans for {len(jobs)} jobs with {variants_per_image} variants each")
+    if journal is not None and not done:
+        journal.start(fingerprint, seed, plans)
+
+    for job in jobs:
+        os.makedirs(os.path.dirname(job[2]), exist_ok=True)
+        os.makedirs(os.path.dirname(job[3]), exist_ok=True)
+
+    # Chunks a resumed run already finished are not handed out again
+    tasks = [(chunk_index, jobs[start:start + chunk_size], plans[start * variants_per_image:(start + chunk_size) * variants_per_image])
+             for chunk_index, start in enumerate(range(0, len(jobs), chunk_size)) if chunk_index not in done]
+
+    statuses = [None] * len(jobs)
+    counts = {'augmented': 0, 'skipped': 0, 'failed': 0}
+    failures = []
+    encode_totals = {}
+    profile_totals = empty_profile() if profile else None
+    finished = 0
+
+    def collect(chunk_index, results):
+        nonlocal finished
+        start = chunk_index * chunk_size
+        for offset, (status, message) in enumerate(results):
+            statuses[start + offset] = status
+            counts[status] += 1
+            if status != 'augmented':
+                failures.append((jobs[start + offset][0], status, message))
+        finished += len(results)
+        if progress:
+            progress(finished, len(jobs))
+
+    for chunk_index, results in sorted(done.items()):
+        collect(chunk_index, results)
+
+    with multiprocessing.Pool(workers, initializer=init_worker,
+                              initargs=(settings, reader_threads, writer_threads, encoding, target_size, profile)) as pool:
+        # imap hands results back in chunk order, whatever order the workers finish in
+        for chunk_index, results, chunk_encode_totals, chunk_profile in pool.imap(process_chunk, tasks):
+            merge_stats(encode_totals, chunk_encode_totals)
+            if chunk_profile is not None:
+                merge_profiles(profile_totals, chunk_profile)
+            if journal is not None:
+                journal.record(chunk_index, results)
+            collect(chunk_index, results)
+
+    # Every job has to be accounted for exactly once
+    if sum(counts.values()) != len(jobs) or None in statuses:
+        raise RuntimeError("Batch augmentation lost track of some jobs")
+    if journal is not None:
+        journal.finish()
+
+    return {'seed': seed, 'total': len(jobs), 'counts': counts, 'statuses': statuses, 'failures': failures, 'plans': plans,
+            'encoding': encoding if isinstance(encoding, str) else 'custom', 'encode_totals': encode_totals, 'profile': profile_totals}
+
+def augment_dataset(dataset_root, augmented_root, settings, splits=('train', 'val'), workers=None, chunk_size=16, seed=None, progress=None,
+                    plans=None, variants_per_image=1, reader_threads=2, writer_threads=2, encoding='default', target_size=None,
+                    resume=True, profile=None):
+    # With resume, progress is journaled in augmented_root and a run that was interrupted
+    # continues from its last finished chunk when it is started again with the same arguments
+    jobs = collect_dataset_jobs(dataset_root, augmented_root, splits)
+    journal = RunJournal(os.path.join(augmented_root, CACHE_DIR)) if resume else None
+    try:
+        report = run_jobs(jobs, settings, workers, chunk_size, seed, progress, plans, variants_per_image, reader_threads, writer_threads,
+                          encoding, target_size, journal, profile)
+    finally:
+        if journal is not None:
+            journal.close()
+
+    # Plans are in job order, which is stable for an unchanged dataset, so a run can be
+    # replayed with plans=np.load(os.path.join(augmented_root, PLANS_FILE))
+    np.save(os.path.join(augmented_root, PLANS_FILE), report['plans'])
+    write_quarantine_report(os.path.join(augmented_root, QUARANTINE_FILE), jobs, report)
+    return report
+
+def write_quarantine_report(path, jobs, report):
+    # Every source that could not be augmented, with the reason, for a look in the morning
+    labels = {job[0]: job[1] for job in jobs}
+    quarantine = [{'image': image_path, 'label': labels.get(image_path), 'status': status, 'reason': message}
+                  for image_path, status, message in report['failures']]
+    with open(path, 'w') as file:
+        json.dump({'seed': report['seed'], 'total': report['total'], 'quarantined': quarantine}, file, indent=1)
+
+def print_report(report):
+    counts = report['counts']
+    incremental = ''.join(f", {counts[name]} {name}" for name in ('unchanged', 'removed') if name in counts)
+    print(f"Augmented {counts['augmented']} of {report['total']} images "
+          f"({counts['skipped']} skipped, {counts['failed']} failed{incremental}), seed {report['seed']}")
+    for image_path, status, message in report['failures']:
+        print(f"  {status}: {image_path} ({message})")
+
+    print(f"Encoding profile {report['encoding']}:")
+    for extension, (images, size, seconds) in sorted(report['encode_totals'].items()):
+        print(f"  {extension}: {images} images, {size / 1024 / 1024:.1f} MB, {seconds:.2f} s encoding "
+              f"({size / max(images, 1) / 1024:.0f} KB, {1000 * seconds / max(images, 1):.1f} ms per image)")
+
+    counters = report['profile']['counters'] if report.get('profile') else {}
+    if counters.get('simplify_vertices_in'):
+        before, after = counters['simplify_vertices_in'], counters['simplify_vertices_out']
+        print(f"Simplified polygons: {before} -> {after} vertices ({100 * (after - before) / before:+.0f}%)")
+
+    if report.get('profile'):
+        print("Stages:")
+        for line in format_profile(report['profile']):
+            print(line)
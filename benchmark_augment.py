@@ -0,0 +1,155 @@
+import sys
+import json
+import time
+import platform
+import tracemalloc
+import cv2
+import numpy as np
+from augment_data import (mirror_image, crop_image_and_labels, pad_image_and_labels, zoom_in_image_and_labels,
+                          zoom_out_image_and_labels, rotate_image_and_labels, overlay_detections_on_coco,
+                          apply_geometry, apply_fused_geometry)
+from augmentation_plan import PLAN_DTYPE
+from photometric import apply_photometric
+from polygon_engine import mirror_matrix
+from annotations import Annotations
+
+# Micro-benchmarks of the augment_data operations on synthetic images and labels. Every op runs
+# at every resolution and label load; the median and p95 latency, throughput and peak memory of
+# each case go to a JSON file. With a baseline file the run is compared against it and exits
+# with status 1 when a case got slower than regression_threshold allows.
+
+resolutions = {'480p': (854, 480), '1080p': (1920, 1080), '4k': (3840, 2160)}
+label_loads = [(1, 4), (10, 50), (50, 500)]  # (instances, vertices per instance)
+repeats = 15
+output_file = 'benchmark_results.json'
+baseline_file = None  # Path of an earlier results file to compare against
+regression_threshold = 0.10  # Relative median slowdown that counts as a regression
+regression_min_ms = 0.05  # Slowdowns below this are timer noise
+seed = 0
+
+def synthetic_labels(instances, vertices, rng):
+    # Star shaped (so simple) polygons scattered over the image
+    centers = rng.uniform(0.2, 0.8, (instances, 1, 2))
+    radii = rng.uniform(0.02, 0.1, (instances, 1, 1)) * rng.uniform(0.6, 1.0, (instances, vertices, 1))
+    angles = np.sort(rng.uniform(0, 2 * np.pi, (instances, vertices)), axis=1)[..., None]
+    points = centers + radii * np.concatenate([np.cos(angles), np.sin(angles)], axis=2)
+    coords = np.clip(points, 0, 1).reshape(-1, 2).astype(np.float32)
+    offsets = np.arange(0, instances * vertices + 1, vertices, dtype=np.int32)
+    return Annotations(coords, offsets, np.arange(instances) % 8)
+
+def full_plan():
+    # Every geometric stage on, so the staged and fused pipelines do the same amount of work, and
+    # every photometric op (only the 'photometric' case runs those)
+    plan = np.zeros(1, dtype=PLAN_DTYPE)[0]
+    plan['mirror'] = plan['crop'] = plan['pad'] = plan['zoom'] = plan['zoom_in'] = plan['rotate'] = True
+    plan['crop_percentage'] = 0.25
+    plan['zoom_in_padding'] = 0.2
+    plan['rotation_angle'] = 33.0
+    plan['tint'] = plan['contrast'] = plan['brightness'] = plan['hsv'] = plan['blur'] = plan['murk'] = plan['noise'] = True
+    plan['tint_color'] = (0, 50, 0)
+    plan['tint_strength'] = 0.2
+    plan['contrast_factor'] = 1.2
+    plan['brightness_shift'] = 10.0
+    plan['hue_shift'] = 5.0
+    plan['saturation_factor'] = plan['value_factor'] = 1.1
+    plan['blur_sigma'] = 1.5
+    plan['noise_sigma'] = 8.0
+    return plan
+
+def benchmark_ops(image, background, annotations):
+    # Name -> zero argument callable of one operation on this case
+    (h, w) = image.shape[:2]
+    cropped = crop_image_and_labels(image, annotations, False, 0.25)
+    plan = full_plan()
+    return {
+        'mirror': lambda: (mirror_image(image), annotations.transform(mirror_matrix())),
+        'crop': lambda: crop_image_and_labels(image, annotations, False, 0.25),
+        'pad': lambda: pad_image_and_labels(*cropped, (h, w)),
+        'zoom_in': lambda: zoom_in_image_and_labels(image, annotations, 0.2),
+        'zoom_out': lambda: zoom_out_image_and_labels(image, annotations, 1.4, 1.4),
+        'rotate_90': lambda: rotate_image_and_labels(image, annotations, 90.0),
+        'rotate': lambda: rotate_image_and_labels(image, annotations, 33.0),
+        # The background is blended in place, so its copy is part of the measured cost
+        'overlay': lambda: overlay_detections_on_coco(background.copy(), image, annotations, 0.6, 0.3, 0.7),
+        'geometry': lambda: apply_geometry(image, annotations, plan, h, w),
+        'fused_geometry': lambda: apply_fused_geometry(image, annotations, plan, h, w),
+        'photometric': lambda: apply_photometric(image, plan),
+        'simplify': lambda: annotations.simplify(1.0, w, h),
+    }
+
+def measure(operation, repeats):
+    operation()  # Warm up caches and lazy OpenCV initialization
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+
+    # Separate pass for memory, tracing slows down the timed runs. Only allocations that go
+    # through Python/NumPy are seen, which includes every array OpenCV returns
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    operation()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return np.array(timings), peak
+
+def run_benchmarks(resolutions=resolutions, label_loads=label_loads, repeats=repeats, seed=seed, progress=print):
+    rng = np.random.default_rng(seed)
+    results = {}
+    for resolution, (width, height) in resolutions.items():
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        for instances, vertices in label_loads:
+            load = f'{instances}x{vertices}'
+            annotations = synthetic_labels(instances, vertices, rng)
+            for name, operation in benchmark_ops(image, background, annotations).items():
+                timings, peak = measure(operation, repeats)
+                median = float(np.median(timings))
+                results[f'{name}/{resolution}/{load}'] = {
+                    'op': name, 'resolution': resolution, 'load': load,
+                    'median_ms': 1000 * median,
+                    'p95_ms': 1000 * float(np.percentile(timings, 95)),
+                    'per_second': 1 / median if median else float('inf'),
+                    'megapixels_per_second': width * height / 1e6 / median if median else float('inf'),
+                    'peak_memory_mb': peak / 1024 / 1024,
+                }
+                if progress:
+                    progress(format_result(f'{name}/{resolution}/{load}', results[f'{name}/{resolution}/{load}']))
+    return {'meta': environment(repeats, seed), 'results': results}
+
+def environment(repeats, seed):
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'opencv_threads': cv2.getNumThreads(),
+            'repeats': repeats, 'seed': seed}
+
+def format_result(key, result):
+    return (f"{key:<34} median {result['median_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  "
+            f"{result['per_second']:9.1f}/s  peak {result['peak_memory_mb']:7.1f} MB")
+
+def compare(results, baseline, threshold=regression_threshold, min_ms=regression_min_ms):
+    # (key, baseline median, median, ratio) of every case slower than the baseline allows
+    regressions = []
+    for key, result in results['results'].items():
+        before = baseline['results'].get(key)
+        if before is None:
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        if ratio > 1 + threshold and result['median_ms'] - before['median_ms'] > min_ms:
+            regressions.append((key, before['median_ms'], result['median_ms'], ratio))
+    return regressions
+
+if __name__ == '__main__':
+    results = run_benchmarks()
+    with open(output_file, 'w') as file:
+        json.dump(results, file, indent=1)
+    print(f"Results written to {output_file}")
+
+    if baseline_file:
+        with open(baseline_file) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline)
+        for key, before, after, ratio in regressions:
+            print(f"  REGRESSION {key}: {before:.3f} ms -> {after:.3f} ms ({(ratio - 1) * 100:+.0f}%)")
+        print(f"{len(regressions)} regressions against {baseline_file}")
+        sys.exit(1 if regressions else 0)
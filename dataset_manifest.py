@@ -0,0 +1,155 @@
+import os
+import json
+from overlay_pool import IMAGE_EXTENSIONS
+from pipelined_io import read_image_size
+from label_codec import split_lines
+from label_store import CACHE_DIR
+
+# Cached listing of dataset_root/images/<split> and the matching labels/<split> tree, kept in
+# dataset_root/.dataset_cache/manifest.json. Per directory it records every image (size, mtime
+# and width/height read from the file header) and every label file (size, mtime, instance count).
+# refresh only lists directories whose own mtime, or the mtime of their label directory, changed
+# since the last refresh; unchanged directories are not even opened. Editing a file in place does
+# not change its directory's mtime, refresh(full=True) re-stats every file for that.
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+def manifest_path(dataset_root):
+    return os.path.join(dataset_root, CACHE_DIR, MANIFEST_FILE)
+
+def directory_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def open_manifest(dataset_root, splits=('train', 'val'), refresh=True):
+    # Loads the manifest of dataset_root (a fresh one if there is none yet), refreshes and saves it
+    manifest = DatasetManifest(dataset_root, splits)
+    manifest.load()
+    if refresh and manifest.refresh():
+        manifest.save()
+    return manifest
+
+class DatasetManifest:
+    def __init__(self, dataset_root, splits=('train', 'val')):
+        self.dataset_root = dataset_root
+        self.splits = list(splits)
+
+        # Directory relative to images/ ('train/video1') -> {'mtimes': [image dir, label dir],
+        # 'subdirectories': [names], 'images': [[name, size, mtime, width, height]],
+        # 'labels': {stem: [name, size, mtime, instances]}}
+        self.directories = {}
+
+    def load(self):
+        try:
+            with open(manifest_path(self.dataset_root)) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != MANIFEST_VERSION or data.get('splits') != self.splits:
+            return False
+        self.directories = data['directories']
+        return True
+
+    def save(self):
+        # A read-only dataset just doesn't get a cache
+        path = manifest_path(self.dataset_root)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as file:
+                json.dump({'version': MANIFEST_VERSION, 'splits': self.splits, 'directories': self.directories}, file)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Could not save the dataset manifest: {e}")
+
+    def refresh(self, full=False):
+        # Brings the manifest up to date, returns the number of directories that were rescanned
+        # (or dropped because they are gone)
+        directories = {}
+        changed = 0
+        pending = list(reversed(self.splits))
+        while pending:
+            directory = pending.pop()
+            image_dir = os.path.join(self.dataset_root, 'images', directory)
+            mtimes = [directory_mtime(image_dir), directory_mtime(os.path.join(self.dataset_root, 'labels', directory))]
+            if mtimes[0] is None:
+                continue
+
+            record = self.directories.get(directory)
+            if full or record is None or record['mtimes'] != mtimes:
+                record = self.scan_directory(directory, mtimes, record)
+                changed += 1
+            directories[directory] = record
+            pending.extend(f'{directory}/{name}' for name in reversed(record['subdirectories']))
+
+        changed += len(self.directories.keys() - directories.keys())
+        self.directories = directories
+        return changed
+
+    def scan_directory(self, directory, mtimes, previous):
+        # Lists one image directory and its label directory. Files whose size and mtime didn't
+        # change keep their recorded header size and instance count
+        previous_images = {entry[0]: entry for entry in previous['images']} if previous else {}
+        previous_labels = previous['labels'] if previous else {}
+
+        subdirectories = []
+        images = []
+        with os.scandir(os.path.join(self.dataset_root, 'images', directory)) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirectories.append(entry.name)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    known = previous_images.get(entry.name)
+                    if known and known[1:3] == [stat.st_size, stat.st_mtime_ns]:
+                        images.append(known)
+                        continue
+                    size = read_image_size(entry.path) or (None, None)
+                    images.append([entry.name, stat.st_size, stat.st_mtime_ns, size[0], size[1]])
+
+        labels = {}
+        if mtimes[1] is not None:
+            with os.scandir(os.path.join(self.dataset_root, 'labels', directory)) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.txt') or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    stem = os.path.splitext(entry.name)[0]
+                    known = previous_labels.get(stem)
+                    if known and known[0] == entry.name and known[1:3] == [stat.st_size, stat.st_mtime_ns]:
+                        labels[stem] = known
+                        continue
+                    with open(entry.path, 'rb') as file:
+                        instances = len(split_lines(file.read()))
+                    labels[stem] = [entry.name, stat.st_size, stat.st_mtime_ns, instances]
+
+        return {'mtimes': mtimes, 'subdirectories': sorted(subdirectories),
+                'images': sorted(images), 'labels': labels}
+
+    def directory_names(self, split=None):
+        # Directories relative to images/, parents before their subdirectories, in a stable order
+        names = [name for name in self.directories if split is None or name.split('/')[0] == split]
+        return sorted(names, key=lambda name: name.split('/'))
+
+    def sources(self, directory):
+        # (image path, label path, width, height, instances) for every image of one directory.
+        # The label path is where the label file belongs, instances is None when it doesn't exist
+        record = self.directories.get(directory)
+        if record is None:
+            return []
+        image_dir = os.path.join(self.dataset_root, 'images', *directory.split('/'))
+        label_dir = os.path.join(self.dataset_root, 'labels', *directory.split('/'))
+
+        sources = []
+        for name, _, _, width, height in record['images']:
+            stem = os.path.splitext(name)[0]
+            label = record['labels'].get(stem)
+            sources.append((os.path.join(image_dir, name), os.path.join(label_dir, stem + '.txt'),
+                            width, height, None if label is None else label[3]))
+        return sources
+
+    def folder_names(self):
+        # Names of all directories below the splits, e.g. the video folders
+        return sorted({part for name in self.directories for part in name.split('/')[1:]})
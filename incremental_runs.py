@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import numpy as np
+from augmentation_plan import PLAN_DTYPE, SAMPLING_SETTINGS, sample_plans
+from batch_augment import PLANS_FILE, collect_dataset_jobs, run_jobs, variant_path
+from output_encoding import get_profile, output_path
+from label_store import CACHE_DIR
+
+# Incremental batch augmentation. Every source is keyed by a hash of its image, its label file,
+# the effective augmentation config and the run seed. The key and the outputs it produced are
+# recorded in augmented_root/.dataset_cache/incremental_index.json, so a rerun only augments
+# sources whose key changed and removes the outputs of sources that are gone.
+
+# Plans are tied to the source path (augmentation_plan.KeyedGenerator) rather than to the job
+# position, so adding a folder doesn't change the plans of every other image. A seeded
+# incremental run therefore gives different (but just as reproducible) output than run_jobs.
+
+INDEX_FILE = 'incremental_index.json'
+INDEX_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def index_path(augmented_root):
+    return os.path.join(augmented_root, CACHE_DIR, INDEX_FILE)
+
+def load_index(augmented_root):
+    try:
+        with open(index_path(augmented_root)) as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return {'seed': None, 'entries': {}}
+    if index.get('version') != INDEX_VERSION:
+        return {'seed': None, 'entries': {}}
+    return index
+
+def save_index(augmented_root, index):
+    path = index_path(augmented_root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as file:
+        json.dump({**index, 'version': INDEX_VERSION}, file)
+    os.replace(path + '.tmp', path)
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_state(path, known):
+    # [size, mtime_ns, digest] of a file, None if it doesn't exist. The digest of a file whose size
+    # and mtime didn't change since known is reused instead of reading the file again
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known
+    return [stat.st_size, stat.st_mtime_ns, file_digest(path)]
+
+def config_digest(settings, variants_per_image, encoding, target_size):
+    # Everything besides the sources and the seed that changes the outputs
+    # The plan layout is in it because the index stores plans as raw PLAN_DTYPE rows
+    config = {'settings': settings, 'variants_per_image': variants_per_image, 'encoding': get_profile(encoding),
+              'target_size': target_size, 'plan_dtype': PLAN_DTYPE.descr}
+    return hashlib.blake2b(json.dumps(config, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+def plan_keys(seed, source, variants_per_image):
+    # uint64 plan key of every variant of one source
+    return [int.from_bytes(hashlib.blake2b(f'{seed}:{source}:{variant}'.encode(), digest_size=8).digest(), 'little')
+            for variant in range(variants_per_image)]
+
+def job_outputs(job, variants_per_image, profile):
+    outputs = []
+    for variant in range(variants_per_image):
+        outputs.append(output_path(variant_path(job[2], variant), profile))
+        outputs.append(variant_path(job[3], variant))
+    return outputs
+
+def remove_outputs(augmented_root, outputs):
+    for output in outputs:
+        try:
+            os.remove(os.path.join(augmented_root, output))
+        except FileNotFoundError:
+            pass
+
+def augment_dataset_incremental(dataset_root, augmented_root, settings, splits=('train', 'val'), workers=None, chunk_size=16,
+                                seed=None, progress=None, variants_per_image=1, reader_threads=2, writer_threads=2,
+                                encoding='default', target_size=None, profile=None):
+    # Same arguments as batch_augment.augment_dataset. seed=None keeps the seed of the previous
+    # incremental run into augmented_root. The report counts the sources that were up to date
+    # ('unchanged') and whose outputs were removed because they are gone ('removed')
+    index = load_index(augmented_root)
+    if seed is None:
+        seed = index['seed'] if index['seed'] is not None else int(np.random.SeedSequence().entropy % (2 ** 63))
+    entries = index['entries'] if index['seed'] == seed else {}
+    stale = {} if index['seed'] == seed else index['entries']
+
+    jobs = collect_dataset_jobs(dataset_root, augmented_root, splits)
+    encoding_profile = get_profile(encoding)
+    config = config_digest(settings, variants_per_image, encoding, target_size)
+
+    # Key every source, the run only gets the ones that changed
+    sources = []
+    pending = []
+    for job in jobs:
+        source = os.path.relpath(job[0], dataset_root).replace(os.sep, '/')
+        entry = entries.get(source) or stale.get(source) or {}
+        image_state = file_state(job[0], entry.get('image'))
+        label_state = file_state(job[1], entry.get('label'))
+        key = hashlib.blake2b(json.dumps([config, seed, source, image_state and image_state[2],
+                                          label_state and label_state[2]]).encode(), digest_size=16).hexdigest()
+        outputs = [os.path.relpath(output, augmented_root).replace(os.sep, '/') for output in job_outputs(job, variants_per_image, encoding_profile)]
+
+        sources.append(source)
+        up_to_date = source in entries and entries[source]['key'] == key and \
+            all(os.path.exists(os.path.join(augmented_root, output)) for output in entries[source]['outputs'])
+        if not up_to_date:
+            pending.append((job, source, key, image_state, label_state, outputs))
+
+    keys = [plan_key for _, source, *_ in pending for plan_key in plan_keys(seed, source, variants_per_image)]
+    subfolders = [job[4] for job, *_ in pending for _ in range(variants_per_image)]
+    plans = sample_plans(len(keys), subfolders, *(settings[name] for name in SAMPLING_SETTINGS), keys=keys,
+                         photometric=settings.get('photometric'))
+
+    pending_jobs = [job for job, *_ in pending]
+    if pending_jobs:
+        report = run_jobs(pending_jobs, settings, workers, chunk_size, seed, progress, plans, variants_per_image,
+                          reader_threads, writer_threads, encoding, target_size, profile=profile)
+    else:
+        report = {'counts': {'augmented': 0, 'skipped': 0, 'failed': 0}, 'statuses': [], 'failures': [],
+                  'encoding': encoding if isinstance(encoding, str) else 'custom', 'encode_totals': {}, 'profile': None}
+
+    # Record what was written. Outputs of an earlier run that this run didn't write again go.
+    # Skipped sources are recorded without outputs, failed ones are tried again next run
+    for position, ((job, source, key, image_state, label_state, outputs), status) in enumerate(zip(pending, report['statuses'])):
+        if status != 'augmented':
+            outputs = []
+        previous = entries.pop(source, None) or stale.pop(source, None)
+        if previous:
+            remove_outputs(augmented_root, set(previous['outputs']) - set(outputs))
+        if status != 'failed':
+            job_plans = plans[position * variants_per_image:(position + 1) * variants_per_image]
+            entries[source] = {'key': key, 'image': image_state, 'label': label_state, 'outputs': outputs,
+                               'plans': job_plans.tobytes().hex()}
+
+    # Sources that are gone, or outputs of a run with another seed
+    current = set(sources)
+    removed = [source for source in entries if source not in current] + list(stale)
+    for source in removed:
+        entry = entries.pop(source, None) or stale.pop(source)
+        remove_outputs(augmented_root, entry['outputs'])
+
+    save_index(augmented_root, {'seed': seed, 'entries': entries})
+
+    # Plans of every source in job order, so a full run can still be replayed with run_jobs
+    all_plans = np.zeros(len(jobs) * variants_per_image, dtype=PLAN_DTYPE)
+    for position, source in enumerate(sources):
+        if source in entries:
+            all_plans[position * variants_per_image:(position + 1) * variants_per_image] = \
+                np.frombuffer(bytes.fromhex(entries[source]['plans']), dtype=PLAN_DTYPE)
+    np.save(os.path.join(augmented_root, PLANS_FILE), all_plans)
+
+    counts = dict(report['counts'])
+    counts['unchanged'] = len(jobs) - len(pending)
+    counts['removed'] = len(removed)
+    return {**report, 'seed': seed, 'total': len(jobs), 'counts': counts, 'plans': all_plans}
@@ -0,0 +1,147 @@
+import warnings
+import numpy as np
+from pipelined_io import replace_file
+
+# Reads and writes YOLO label files ('class_id x1 y1 x2 y2 ...' per line) straight to and from
+# packed labels (see polygon_engine): float32 (N, 2) coords, int32 offsets of length P + 1 and a
+# list of class id strings. Parsing converts every number of a file (or of many files) with one
+# NumPy call instead of a float() per value, and formatting fills one printf template per file.
+
+# Box lines ('class_id x_center y_center width height') parse as a polygon of two "points",
+# box_mask finds them and boxes_to_polygons turns them into rectangles
+
+def parse_labels(data):
+    # data is the content of a label file, as bytes or str
+    if isinstance(data, str):
+        data = data.encode()
+    return pack_lines(split_lines(data), data)
+
+def read_labels(label_path):
+    with open(label_path, 'rb') as file:
+        return parse_labels(file.read())
+
+def read_label_files(label_paths):
+    # Parses many label files in one go. Polygons of file i are
+    # offsets[file_offsets[i]]:offsets[file_offsets[i + 1]]
+    contents = []
+    lines = []
+    file_offsets = np.zeros(len(label_paths) + 1, dtype=np.int32)
+    for index, label_path in enumerate(label_paths):
+        with open(label_path, 'rb') as file:
+            contents.append(file.read())
+        lines.extend(split_lines(contents[-1]))
+        file_offsets[index + 1] = len(lines)
+
+    # Every file starts on its own line, so the coordinates of all files are parsed as one buffer
+    coords, offsets, class_ids = pack_lines(lines, b'\n'.join(contents))
+    return coords, offsets, class_ids, file_offsets
+
+def split_lines(data):
+    # Tokens of every non-empty line
+    return [line for line in map(bytes.split, data.splitlines()) if line]
+
+def pack_lines(lines, data):
+    counts = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    class_ids = [line[0].decode() for line in lines]
+    values = parse_values(data, int(counts.sum()), lines)
+
+    # values holds the class ids too, keep the coordinate pairs of every line. A trailing
+    # unpaired value on a line is dropped
+    pairs = (counts - 1) // 2
+    firsts = np.zeros(len(lines), dtype=np.int64)
+    np.cumsum(counts[:-1], out=firsts[1:])
+    positions = np.arange(len(values)) - np.repeat(firsts, counts)
+    keep = (positions >= 1) & (positions <= np.repeat(2 * pairs, counts))
+
+    offsets = np.zeros(len(lines) + 1, dtype=np.int32)
+    np.cumsum(pairs, out=offsets[1:])
+    return values[keep].astype(np.float32).reshape(-1, 2), offsets, class_ids
+
+def parse_values(data, count, lines):
+    # Every whitespace separated number in data, parsed in one call
+    if count == 0:
+        return np.zeros(0, dtype=np.float64)
+    try:
+        with warnings.catch_warnings():
+            # Older NumPy warns and stops early on bad input instead of raising
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(data, dtype=np.float64, sep=' ')
+    except ValueError:
+        values = None
+    if values is not None and len(values) == count:
+        return values
+
+    for number, line in enumerate(lines, 1):
+        for token in line:
+            try:
+                float(token)
+            except ValueError:
+                raise ValueError(f"Invalid label value {token.decode(errors='replace')!r} on label line {number}") from None
+    raise ValueError("Could not parse label values")
+
+def format_labels(coords, offsets, class_ids, precision=6):
+    # One template for the whole file, filled by a single % with every coordinate
+    pair = f' %.{precision}f %.{precision}f'
+    template = '\n'.join(f'{class_id}'.replace('%', '%%') + pair * count
+                         for class_id, count in zip(class_ids, np.diff(offsets).tolist()))
+    return template % tuple(coords.ravel().tolist())
+
+def write_labels(label_path, coords, offsets, class_ids, precision=6):
+    # Written to a temporary file and renamed into place, so a crash never leaves a partial label file
+    text = format_labels(coords, offsets, class_ids, precision)
+
+    def write(path):
+        with open(path, 'w') as file:
+            file.write(text)
+    replace_file(label_path, write)
+
+def box_mask(offsets):
+    # Lines with exactly four values are boxes, longer ones are polygons
+    return np.diff(offsets) == 2
+
+def boxes_to_polygons(coords, offsets, mask=None):
+    # Replaces every box line with its four corners, so every line can be treated as a polygon
+    mask = box_mask(offsets) if mask is None else mask
+    if not mask.any():
+        return coords, offsets
+
+    counts = np.diff(offsets)
+    new_counts = np.where(mask, 4, counts)
+    new_offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+    np.cumsum(new_counts, out=new_offsets[1:])
+
+    new_coords = np.empty((int(new_offsets[-1]), 2), dtype=np.float32)
+    polygon_vertices = np.repeat(~mask, counts)
+    new_coords[np.repeat(~mask, new_counts)] = coords[polygon_vertices]
+
+    boxes = coords[~polygon_vertices].reshape(-1, 2, 2)
+    centers, half_sizes = boxes[:, 0], boxes[:, 1] / 2
+    corners = np.stack([centers - half_sizes, centers + half_sizes * (1, -1), centers + half_sizes, centers - half_sizes * (1, -1)], axis=1)
+    new_coords[np.repeat(mask, new_counts)] = corners.reshape(-1, 2)
+    return new_coords, new_offsets
+
+def polygon_bounds(coords, offsets):
+    # (P, 4) x_min, y_min, x_max, y_max per polygon, NaN for polygons without vertices
+    bounds = np.full((len(offsets) - 1, 4), np.nan, dtype=np.float32)
+    filled = np.diff(offsets) > 0
+    if filled.any():
+        starts = offsets[:-1][filled]
+        bounds[filled, :2] = np.minimum.reduceat(coords, starts, axis=0)
+        bounds[filled, 2:] = np.maximum.reduceat(coords, starts, axis=0)
+    return bounds
+
+def polygon_areas(coords, offsets):
+    # Shoelace area per polygon
+    counts = np.diff(offsets)
+    areas = np.zeros(len(counts), dtype=np.float64)
+    filled = counts > 0
+    if not filled.any():
+        return areas
+
+    # Index of the next vertex, wrapping around within each polygon
+    following = np.arange(1, len(coords) + 1)
+    following[offsets[1:][filled] - 1] = offsets[:-1][filled]
+    x, y = coords[:, 0].astype(np.float64), coords[:, 1].astype(np.float64)
+    cross = x * y[following] - x[following] * y
+    areas[filled] = 0.5 * np.abs(np.add.reduceat(cross, offsets[:-1][filled]))
+    return areas
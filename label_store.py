@@ -0,0 +1,223 @@
+import os
+import json
+import numpy as np
+from label_codec import read_label_files, boxes_to_polygons, polygon_bounds, polygon_areas
+
+# Columnar on-disk copy of every label of a dataset, so analysis tools can query all instances
+# without walking and parsing the label tree again. Each column is a .npy file that is memory
+# mapped on open:
+#   class_ids (P,) int32, offsets (P + 1,) int64 into coords, coords (N, 2) float32 or uint16
+#   fixed point, bboxes (P, 4) x_min, y_min, x_max, y_max, areas (P,) float32,
+#   instance_images (P,) index into the label files, image_folders (I,) index into the folders,
+#   image_mtimes and image_sizes (I,) of the label files, to tell whether the store is current.
+# Box lines are stored as their four corners, so every instance is a polygon.
+
+CACHE_DIR = '.dataset_cache'
+STORE_DIR = os.path.join(CACHE_DIR, 'label_store')
+STORE_VERSION = 1
+INDEX_FILE = 'index.json'
+COLUMNS = ('class_ids', 'offsets', 'coords', 'bboxes', 'areas', 'instance_images', 'image_folders', 'image_mtimes', 'image_sizes')
+COORDINATE_FORMATS = ('float32', 'uint16')
+FIXED_POINT_SCALE = 65535
+
+def store_path(dataset_root):
+    return os.path.join(dataset_root, STORE_DIR)
+
+def scan_label_files(dataset_root, splits):
+    # (path relative to labels/, mtime_ns, size) of every label file, in a stable order
+    labels_root = os.path.join(dataset_root, 'labels')
+    label_files = []
+    for split in splits:
+        pending = [os.path.join(labels_root, split)]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+            except FileNotFoundError:
+                continue
+            subdirectories = []
+            for entry in entries:
+                if entry.is_dir():
+                    subdirectories.append(entry.path)
+                elif entry.name.endswith('.txt'):
+                    stat = entry.stat()
+                    label_files.append((os.path.relpath(entry.path, labels_root).replace(os.sep, '/'), stat.st_mtime_ns, stat.st_size))
+            pending.extend(reversed(subdirectories))
+    return label_files
+
+def build_label_store(dataset_root, splits=('train', 'val'), coordinate_format='float32'):
+    # Parses every label file under dataset_root/labels/<split> and writes the store. Returns the
+    # store, from memory if it could not be written
+    if coordinate_format not in COORDINATE_FORMATS:
+        raise ValueError(f"Unknown coordinate format {coordinate_format!r}, expected one of {', '.join(COORDINATE_FORMATS)}")
+
+    label_files = scan_label_files(dataset_root, splits)
+    label_paths = [label_path for label_path, _, _ in label_files]
+    coords, offsets, class_ids, file_offsets = read_label_files(
+        [os.path.join(dataset_root, 'labels', label_path) for label_path in label_paths])
+    coords, offsets = boxes_to_polygons(coords, offsets)
+
+    folders = sorted({os.path.dirname(label_path) for label_path in label_paths})
+    folder_indices = {folder: index for index, folder in enumerate(folders)}
+
+    if coordinate_format == 'uint16':
+        stored_coords = np.round(np.clip(coords, 0.0, 1.0) * FIXED_POINT_SCALE).astype(np.uint16)
+    else:
+        stored_coords = coords
+
+    columns = {
+        'class_ids': np.array(class_ids, dtype=np.str_).astype(np.int32) if class_ids else np.zeros(0, dtype=np.int32),
+        'offsets': offsets.astype(np.int64),
+        'coords': stored_coords,
+        'bboxes': polygon_bounds(coords, offsets),
+        'areas': polygon_areas(coords, offsets).astype(np.float32),
+        'instance_images': np.repeat(np.arange(len(label_paths), dtype=np.int32), np.diff(file_offsets)),
+        'image_folders': np.array([folder_indices[os.path.dirname(label_path)] for label_path in label_paths], dtype=np.int32),
+        'image_mtimes': np.array([mtime for _, mtime, _ in label_files], dtype=np.int64),
+        'image_sizes': np.array([size for _, _, size in label_files], dtype=np.int64),
+    }
+
+    index = {'version': STORE_VERSION, 'splits': list(splits), 'coordinate_format': coordinate_format,
+             'label_paths': label_paths, 'folders': folders}
+    try:
+        save_label_store(dataset_root, index, columns)
+    except OSError as e:
+        # A read-only dataset just doesn't get a store, the columns are used from memory
+        print(f"Could not save the label store: {e}")
+        return LabelStore(dataset_root, index, columns)
+    return LabelStore(dataset_root)
+
+def save_label_store(dataset_root, index, columns):
+    # Columns first, the index last, so a store is only picked up once it is complete
+    directory = store_path(dataset_root)
+    os.makedirs(directory, exist_ok=True)
+    index_path = os.path.join(directory, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    for name, column in columns.items():
+        temporary_path = os.path.join(directory, name + '.tmp.npy')
+        np.save(temporary_path, column)
+        os.replace(temporary_path, os.path.join(directory, name + '.npy'))
+
+    with open(index_path + '.tmp', 'w') as file:
+        json.dump(index, file)
+    os.replace(index_path + '.tmp', index_path)
+
+def open_label_store(dataset_root, splits=('train', 'val'), coordinate_format='float32', rebuild=False, check=True):
+    # Opens the store of dataset_root, (re)building it when it is missing, was built for other
+    # splits, or (with check) any label file was added, removed or changed since
+    if not rebuild:
+        try:
+            store = LabelStore(dataset_root)
+        except (OSError, ValueError, KeyError):
+            store = None
+        if store is not None and store.splits == list(splits) and (not check or store.is_current()):
+            return store
+    return build_label_store(dataset_root, splits, coordinate_format)
+
+class LabelStore:
+    # Read-only view of a built store. Instance masks (boolean arrays over all instances) from
+    # select can be combined with & and | and passed to the other queries. Opens the store on
+    # disk, unless given the index and columns of one that could not be saved
+    def __init__(self, dataset_root, index=None, columns=None):
+        self.dataset_root = dataset_root
+        directory = store_path(dataset_root)
+        if index is None:
+            with open(os.path.join(directory, INDEX_FILE)) as file:
+                index = json.load(file)
+        if index['version'] != STORE_VERSION:
+            raise ValueError(f"Label store version {index['version']} is not supported")
+
+        self.splits = index['splits']
+        self.coordinate_format = index['coordinate_format']
+        self.label_paths = index['label_paths']
+        self.folders = index['folders']
+        for name in COLUMNS:
+            column = columns[name] if columns is not None else np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+            setattr(self, name, column)
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    @property
+    def image_count(self):
+        return len(self.label_paths)
+
+    def is_current(self):
+        # Compares the label files on disk with the ones the store was built from
+        label_files = scan_label_files(self.dataset_root, self.splits)
+        if [label_path for label_path, _, _ in label_files] != self.label_paths:
+            return False
+        mtimes = np.array([mtime for _, mtime, _ in label_files], dtype=np.int64)
+        sizes = np.array([size for _, _, size in label_files], dtype=np.int64)
+        return bool(np.array_equal(mtimes, self.image_mtimes) and np.array_equal(sizes, self.image_sizes))
+
+    def polygon(self, instance):
+        # Normalized (n, 2) float32 vertices of one instance
+        start, end = self.offsets[instance], self.offsets[instance + 1]
+        coords = np.asarray(self.coords[start:end])
+        if self.coordinate_format == 'uint16':
+            return coords.astype(np.float32) / FIXED_POINT_SCALE
+        return coords
+
+    def instance_folders(self):
+        return self.image_folders[self.instance_images]
+
+    def select(self, classes=None, min_area=None, max_area=None, folders=None, bbox_within=None):
+        # Mask of the instances matching every given condition. classes and folders are
+        # iterables, bbox_within is an x_min, y_min, x_max, y_max region of the image
+        mask = np.ones(len(self), dtype=bool)
+        if classes is not None:
+            mask &= np.isin(self.class_ids, list(classes))
+        if min_area is not None:
+            mask &= self.areas >= min_area
+        if max_area is not None:
+            mask &= self.areas < max_area
+        if folders is not None:
+            wanted = [index for index, folder in enumerate(self.folders) if folder in set(folders)]
+            mask &= np.isin(self.instance_folders(), wanted)
+        if bbox_within is not None:
+            x_min, y_min, x_max, y_max = bbox_within
+            bboxes = self.bboxes
+            mask &= (bboxes[:, 0] >= x_min) & (bboxes[:, 1] >= y_min) & (bboxes[:, 2] <= x_max) & (bboxes[:, 3] <= y_max)
+        return mask
+
+    def images(self, mask=None):
+        # Label paths (relative to dataset_root/labels) of the images with at least one instance in mask
+        images = self.instance_images if mask is None else self.instance_images[mask]
+        return [self.label_paths[index] for index in np.unique(images).tolist()]
+
+    def class_counts(self, mask=None):
+        class_ids = self.class_ids if mask is None else self.class_ids[mask]
+        classes, counts = np.unique(class_ids, return_counts=True)
+        return dict(zip(classes.tolist(), counts.tolist()))
+
+    def class_histogram(self, mask=None):
+        # {folder: {class_id: instances}}
+        folders = self.instance_folders()
+        class_ids = self.class_ids
+        if mask is not None:
+            folders, class_ids = folders[mask], class_ids[mask]
+        if len(class_ids) == 0:
+            return {}
+
+        # One np.unique over combined (folder, class) keys instead of a loop over instances
+        class_offset = int(class_ids.min())
+        class_span = int(class_ids.max()) - class_offset + 1
+        keys, counts = np.unique(folders.astype(np.int64) * class_span + (class_ids - class_offset), return_counts=True)
+
+        histogram = {}
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            folder, class_id = divmod(key, class_span)
+            histogram.setdefault(self.folders[folder], {})[class_id + class_offset] = count
+        return histogram
+
+    def cooccurrence(self, mask=None):
+        # (classes, matrix), matrix[i, j] is the number of images holding both classes[i] and classes[j]
+        images = self.instance_images if mask is None else self.instance_images[mask]
+        class_ids = self.class_ids if mask is None else self.class_ids[mask]
+        classes, class_indices = np.unique(class_ids, return_inverse=True)
+
+        presence = np.zeros((self.image_count, len(classes)), dtype=np.int64)
+        presence[images, class_indices] = 1
+        return classes, presence.T @ presence
@@ -0,0 +1,75 @@
+import os
+import cv2
+import numpy as np
+
+# Bank of Gaussian noise tiles for the noise and murk ops of the photometric stage. Filling a
+# full image with fresh normals costs far more than adding them, so a few dozen int8 tiles are
+# generated once per process (or memory-mapped from a cache file every process shares) and an
+# image gets noise block by block, each block a randomly offset and flipped window of a random
+# tile. The blocks are added with one saturating, scaled cv2.addWeighted each, which keeps
+# negative noise negative and writes straight into the output.
+
+TILE_COUNT = 32
+TILE_SIZE = 320
+BLOCK_SIZE = 256  # Windows of a tile that blocks take, so every block has TILE_SIZE - BLOCK_SIZE + 1 offsets per axis
+TILE_SIGMA = 32.0  # Standard deviation of the stored tiles, clipped to the int8 range (about 4 sigma)
+BANK_SEED = 0
+
+# Path of a .npy file to memory-map the tiles from (written by the first process that needs them),
+# None generates them in every process. Set from the 'noise_cache' setting by batch_augment
+cache_file = None
+
+class NoiseBank:
+    def __init__(self, tiles):
+        self.tiles = tiles
+
+    @classmethod
+    def generate(cls, count=TILE_COUNT, size=TILE_SIZE, seed=BANK_SEED):
+        normals = np.random.default_rng(seed).standard_normal((count, size, size, 3), dtype=np.float32)
+        return cls(np.clip(np.rint(normals * TILE_SIGMA), -127, 127).astype(np.int8))
+
+    @classmethod
+    def load(cls, cache_path):
+        # Memory-maps the tiles of an earlier process, or generates them and saves them there
+        if not os.path.exists(cache_path):
+            bank = cls.generate()
+            os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+            temporary_path = f'{cache_path}.{os.getpid()}.tmp.npy'
+            np.save(temporary_path, bank.tiles)
+            os.replace(temporary_path, cache_path)
+        return cls(np.load(cache_path, mmap_mode='r'))
+
+    def add(self, image, sigma, seed, dst=None):
+        # image plus Gaussian noise with standard deviation sigma, saturated to uint8. seed picks
+        # the tile, offset and flips of every block, so the same seed gives the same noise.
+        # dst (same shape as image, may be image itself) receives the result
+        output = np.empty_like(image) if dst is None else dst
+        (h, w) = image.shape[:2]
+        rows = range(0, h, BLOCK_SIZE)
+        columns = range(0, w, BLOCK_SIZE)
+        count, size = self.tiles.shape[:2]
+
+        rng = np.random.default_rng(seed)
+        picks = rng.integers(0, count, (len(rows), len(columns)))
+        offsets = rng.integers(0, size - BLOCK_SIZE + 1, (len(rows), len(columns), 2))
+        flips = rng.random((len(rows), len(columns), 2)) < 0.5
+        amplitude = sigma / TILE_SIGMA
+
+        for i, y in enumerate(rows):
+            for j, x in enumerate(columns):
+                block = image[y:y + BLOCK_SIZE, x:x + BLOCK_SIZE]
+                (bh, bw) = block.shape[:2]
+                oy, ox = offsets[i, j]
+                noise = self.tiles[picks[i, j], oy:oy + BLOCK_SIZE, ox:ox + BLOCK_SIZE]
+                noise = noise[::-1 if flips[i, j, 0] else 1, ::-1 if flips[i, j, 1] else 1][:bh, :bw, :block.shape[2]]
+                cv2.addWeighted(block, 1.0, noise, amplitude, 0, dst=output[y:y + bh, x:x + bw], dtype=cv2.CV_8U)
+        return output
+
+noise_banks = {}
+
+def get_noise_bank(cache_path=None):
+    # One bank per process and cache file (cache_file by default), generated in memory without one
+    cache_path = cache_path or cache_file
+    if cache_path not in noise_banks:
+        noise_banks[cache_path] = NoiseBank.load(cache_path) if cache_path else NoiseBank.generate()
+    return noise_banks[cache_path]
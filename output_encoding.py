@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+import cv2
+from pipelined_io import replace_file
+from stage_profiler import stage, count, add
+
+# Output encoding profiles for augmented images. A profile can change the output format
+# ('format' for every image, 'force_jpeg' only for PNG sources) and sets the encoder options
+# of each format. Options that are left out keep the OpenCV defaults.
+ENCODING_PROFILES = {
+    'default': {},  # Source format, OpenCV defaults
+    'png_fast': {'png_compression': 1},
+    'jpeg': {'force_jpeg': True, 'jpeg_quality': 95},
+    'jpeg_small': {'force_jpeg': True, 'jpeg_quality': 85, 'jpeg_optimize': True},
+    'webp': {'format': '.webp', 'webp_quality': 90},
+}
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+def get_profile(profile):
+    # Accepts a profile name or a profile dict
+    if isinstance(profile, dict):
+        return profile
+    if profile not in ENCODING_PROFILES:
+        raise ValueError(f"Unknown encoding profile {profile!r}, expected one of {', '.join(ENCODING_PROFILES)}")
+    return ENCODING_PROFILES[profile]
+
+def output_extension(path, profile):
+    extension = os.path.splitext(path)[1].lower()
+    if profile.get('format'):
+        return profile['format']
+    if profile.get('force_jpeg') and extension == '.png':
+        return '.jpg'
+    return extension
+
+def output_path(path, profile):
+    return os.path.splitext(path)[0] + output_extension(path, profile)
+
+def encode_params(profile, extension):
+    params = []
+    if extension in JPEG_EXTENSIONS:
+        if 'jpeg_quality' in profile:
+            params += [cv2.IMWRITE_JPEG_QUALITY, int(profile['jpeg_quality'])]
+        if profile.get('jpeg_optimize'):
+            params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    elif extension == '.png':
+        if 'png_compression' in profile:
+            params += [cv2.IMWRITE_PNG_COMPRESSION, int(profile['png_compression'])]
+    elif extension == '.webp':
+        if 'webp_quality' in profile:
+            params += [cv2.IMWRITE_WEBP_QUALITY, int(profile['webp_quality'])]
+    return params
+
+class EncodeStats:
+    # Images, bytes and encode seconds per output format, safe to update from writer threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def add(self, extension, size, seconds):
+        with self.lock:
+            images, total_size, total_seconds = self.totals.get(extension, (0, 0, 0.0))
+            self.totals[extension] = (images + 1, total_size + size, total_seconds + seconds)
+
+    def take(self):
+        # Returns the totals so far and starts over
+        with self.lock:
+            totals, self.totals = self.totals, {}
+        return totals
+
+def merge_stats(totals, part):
+    for extension, (images, size, seconds) in part.items():
+        total_images, total_size, total_seconds = totals.get(extension, (0, 0, 0.0))
+        totals[extension] = (total_images + images, total_size + size, total_seconds + seconds)
+    return totals
+
+def encode_image(path, image, profile, stats=None):
+    # Encodes image for path (whose extension is already the output format) and writes it
+    extension = os.path.splitext(path)[1].lower()
+    start = time.perf_counter()
+    success, encoded = cv2.imencode(extension, image, encode_params(profile, extension))
+    seconds = time.perf_counter() - start
+    add('encode', seconds)
+    if not success:
+        return False
+
+    with stage('write_image'):
+        replace_file(path, encoded.tofile)
+    count('bytes_written', encoded.nbytes)
+    if stats is not None:
+        stats.add(extension, encoded.nbytes, seconds)
+    return True
@@ -0,0 +1,137 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+from pipelined_io import read_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+class PendingLoad:
+    # A background one thread is decoding. Its waiters get the image (None if unreadable) or the
+    # error from here, whether or not the cache kept it
+    def __init__(self):
+        self.done = threading.Event()
+        self.image = None
+        self.error = None
+
+class OverlayBackgroundPool:
+    # Indexes an overlay background directory once, keeps recently decoded backgrounds in an
+    # LRU cache bounded by memory_budget_mb and decodes the picks of upcoming plans on a background thread.
+    # target_size decodes backgrounds at a reduced resolution (see pipelined_io.read_image)
+    def __init__(self, directory, memory_budget_mb=512, prefetch=4, target_size=None):
+        self.directory = directory
+        self.target_size = target_size
+        self.paths = sorted(entry.path for entry in os.scandir(directory)
+                            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.prefetch = prefetch
+
+        self.cache = OrderedDict()  # index -> decoded image, least recently used first
+        self.cache_bytes = 0
+        self.loading = {}  # index -> PendingLoad of a decode in progress
+        self.lock = threading.Lock()
+
+        self.requests = queue.Queue()
+        self.worker = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def pick(self, value):
+        # Background for a uniform [0, 1) value, e.g. from an augmentation plan. Unreadable
+        # files fall through to the next background, so the same value always gives the same image
+        if not self.paths:
+            raise ValueError(f"No overlay images found in {self.directory}")
+
+        start = min(int(value * len(self.paths)), len(self.paths) - 1)
+        for step in range(len(self.paths)):
+            image = self.get((start + step) % len(self.paths))
+            if image is not None:
+                return image
+
+        raise ValueError(f"No readable overlay images found in {self.directory}")
+
+    def prefetch_picks(self, values):
+        # Start decoding the backgrounds that upcoming plans will pick
+        if self.prefetch <= 0 or not self.paths:
+            return
+        self.start_prefetch()
+        for value in values:
+            self.requests.put(min(int(value * len(self.paths)), len(self.paths) - 1))
+
+    def get(self, index):
+        # Returns a copy, since the overlay is blended into the background in place
+        image = self.load(index)
+        return None if image is None else image.copy()
+
+    def load(self, index):
+        with self.lock:
+            if index in self.cache:
+                self.cache.move_to_end(index)
+                return self.cache[index]
+            pending = self.loading.get(index)
+            decoding = pending is None
+            if decoding:
+                pending = self.loading[index] = PendingLoad()
+
+        if not decoding:
+            # Another thread is already decoding this background
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.image
+
+        try:
+            pending.image = read_image(self.paths[index], target_size=self.target_size)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self.lock:
+                if pending.image is not None:
+                    self.store(index, pending.image)
+                del self.loading[index]
+            pending.done.set()
+
+        return pending.image
+
+    def store(self, index, image):
+        if image.nbytes > self.memory_budget:
+            return
+
+        self.cache[index] = image
+        self.cache_bytes += image.nbytes
+        while self.cache_bytes > self.memory_budget:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted.nbytes
+
+    def start_prefetch(self):
+        if self.prefetch > 0 and self.worker is None:
+            self.worker = threading.Thread(target=self.prefetch_loop, daemon=True)
+            self.worker.start()
+
+    def prefetch_loop(self):
+        while True:
+            index = self.requests.get()
+            if index is None:
+                break
+            try:
+                self.load(index)
+            except Exception:
+                pass  # Waiting pickers got the error, later ones decode again and get it themselves
+
+    def close(self):
+        if self.worker is not None:
+            self.requests.put(None)
+            self.worker.join()
+            self.worker = None
+
+overlay_pools = {}
+
+def get_overlay_pool(directory, target_size=None):
+    # One shared pool per directory, so callers that only pass a folder path still index it once
+    if isinstance(directory, OverlayBackgroundPool):
+        return directory
+    if (directory, target_size) not in overlay_pools:
+        overlay_pools[directory, target_size] = OverlayBackgroundPool(directory, target_size=target_size)
+    return overlay_pools[directory, target_size]
@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+from noise_bank import get_noise_bank
+
+# Photometric stage of the augmentation: tint, contrast, brightness, HSV jitter, blur, murk and noise,
+# each on with the probability the plan was sampled with (augmentation_plan.PHOTOMETRIC_DEFAULTS).
+# All per-channel ops of an image are composed into a single 256-entry lookup table, so they cost
+# one pass over the pixels together. Only hue/saturation jitter, blur and noise need passes of
+# their own, and the noise comes from the tiles of noise_bank instead of fresh normals.
+
+# Murk is the murky water look of tools/murkify.py: blend in a green tint, blur, add noise and
+# halve the contrast. Halving commutes with the blur, so it is folded into the lookup table and
+# the noise is halved instead
+MURK_COLOR = (0, 50, 0)
+MURK_TINT = 0.3
+MURK_SIGMA = 2.6  # What the 15x15 GaussianBlur kernel of murkify comes to
+MURK_NOISE = 25.0
+MURK_CONTRAST = 0.5
+
+DOWNSAMPLE_SIGMA = 2.0  # Sigmas of at least twice this blur a downsampled copy
+
+LEVELS = np.arange(256, dtype=np.float32)[:, None]
+
+def has_photometric(plan):
+    return bool(plan['tint'] or plan['contrast'] or plan['brightness'] or plan['hsv'] or plan['blur'] or plan['murk'] or
+                plan['noise'])
+
+def channel_lut(plan):
+    # (256, 3) float table of every per-channel op, in the order tint, murk, contrast, brightness,
+    # value. None when none of them is on
+    if not (plan['tint'] or plan['murk'] or plan['contrast'] or plan['brightness'] or plan['hsv']):
+        return None
+    table = np.repeat(LEVELS, 3, axis=1)
+    if plan['tint']:
+        table = table * (1 - plan['tint_strength']) + plan['tint_color'] * plan['tint_strength']
+    if plan['murk']:
+        table = (table * (1 - MURK_TINT) + np.array(MURK_COLOR, dtype=np.float32) * MURK_TINT) * MURK_CONTRAST
+    if plan['contrast']:
+        table = (table - 128) * plan['contrast_factor'] + 128
+    if plan['brightness']:
+        table = table + plan['brightness_shift']
+    if plan['hsv']:
+        # Scaling V is scaling B, G and R alike
+        table = table * plan['value_factor']
+    return table
+
+def to_lut(table):
+    return np.clip(np.rint(table), 0, 255).astype(np.uint8).reshape(1, 256, -1)
+
+def hue_saturation_lut(plan):
+    # HSV table that shifts the hue (0-179, wrapping around) and scales the saturation
+    hue = np.mod(np.rint(LEVELS[:, 0] + plan['hue_shift']), 180)
+    saturation = LEVELS[:, 0] * plan['saturation_factor']
+    return to_lut(np.stack([hue, saturation, LEVELS[:, 0]], axis=1))
+
+def gaussian_blur(image, sigma, dst=None):
+    # GaussianBlur is separable already, but its kernel grows with sigma. Large sigmas blur a
+    # downsampled copy instead and scale it back up, with the smoothing of the two resizes
+    # (about factor^2 / 4 of variance) taken off the sigma
+    factor = int(sigma // DOWNSAMPLE_SIGMA)
+    if factor < 2:
+        return cv2.GaussianBlur(image, (0, 0), sigma, dst=dst)
+    (h, w) = image.shape[:2]
+    small = cv2.resize(image, (max(w // factor, 1), max(h // factor, 1)), interpolation=cv2.INTER_AREA)
+    small = cv2.GaussianBlur(small, (0, 0), np.sqrt(sigma * sigma - factor * factor / 4) / factor)
+    return cv2.resize(small, (w, h), dst=dst, interpolation=cv2.INTER_LINEAR)
+
+def apply_photometric(image, plan, dst=None):
+    # Returns a new image, or dst (same shape as image, may be image itself) filled with it.
+    # image itself when no photometric op is on
+    passes = []
+    table = channel_lut(plan)
+    if table is not None:
+        lut = to_lut(table)
+        passes.append(lambda image, dst: cv2.LUT(image, lut, dst=dst))
+    if plan['hsv'] and (np.rint(plan['hue_shift']) % 180 or plan['saturation_factor'] != 1):
+        hsv_lut = hue_saturation_lut(plan)
+        passes.append(lambda image, dst: cv2.cvtColor(cv2.LUT(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), hsv_lut),
+                                                      cv2.COLOR_HSV2BGR, dst=dst))
+
+    # One blur for both, Gaussian sigmas add in quadrature
+    sigma = np.hypot(plan['blur_sigma'] if plan['blur'] else 0.0, MURK_SIGMA if plan['murk'] else 0.0)
+    if sigma > 0:
+        passes.append(lambda image, dst: gaussian_blur(image, sigma, dst))
+    # Signed noise added with saturation (murkify cast it to uint8, which wrapped the negative
+    # half around to bright speckles). Murk and sensor noise are one pass, like the blurs
+    noise_sigma = np.hypot(plan['noise_sigma'] if plan['noise'] else 0.0, MURK_NOISE * MURK_CONTRAST if plan['murk'] else 0.0)
+    if noise_sigma > 0:
+        passes.append(lambda image, dst: get_noise_bank().add(image, noise_sigma, int(plan['noise_seed']), dst))
+
+    for index, run in enumerate(passes):
+        image = run(image, dst if index == len(passes) - 1 else None)
+    return image
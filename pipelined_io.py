@@ -0,0 +1,177 @@
+import os
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# Thread pools that overlap disk I/O and image coding with the augmentation compute. OpenCV
+# releases the GIL while decoding and encoding, so a few threads keep a process busy even
+# when the dataset sits on a slow network share.
+
+# Decode flags that let the decoder downscale by 2, 4 or 8 (JPEG does it in the DCT, which is
+# much cheaper than a full decode)
+REDUCED_COLOR_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                       4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# JPEG start-of-frame markers, which hold the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def read_image(path, flags=cv2.IMREAD_COLOR, target_size=None):
+    # np.fromfile + imdecode instead of imread: one plain sequential read, and it works with
+    # non-ASCII paths on Windows. With target_size, color images are decoded (and resized)
+    # so their longer side is target_size, unless they are smaller already
+    try:
+        data = np.fromfile(path, dtype=np.uint8)
+    except OSError:
+        return None
+    if data.size == 0:
+        return None
+
+    if not target_size or flags != cv2.IMREAD_COLOR:
+        return cv2.imdecode(data, flags)
+
+    # Only JPEG really decodes at the reduced size, other formats are resized after the decode anyway
+    size = image_size(data)
+    factor = reduction_factor(size[0], size[1], target_size) if size and data[0] == 0xFF else 1
+    image = cv2.imdecode(data, REDUCED_COLOR_FLAGS[factor])
+    return None if image is None else fit_to_size(image, target_size)
+
+def reduction_factor(width, height, target_size):
+    # Largest decoder reduction that keeps the longer side at or above target_size
+    for factor in (8, 4, 2):
+        if max(width, height) / factor >= target_size:
+            return factor
+    return 1
+
+def fit_to_size(image, target_size):
+    height, width = image.shape[:2]
+    scale = target_size / max(width, height)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)), interpolation=cv2.INTER_AREA)
+
+def image_size(data):
+    # (width, height) from a PNG or JPEG header without decoding, None for anything else
+    header = data[:32].tobytes()
+    if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+
+    if not header.startswith(b'\xff\xd8'):
+        return None
+    buffer = memoryview(data)
+    position = 2
+    while position + 9 < len(buffer):
+        if buffer[position] != 0xFF:
+            return None
+        marker = buffer[position + 1]
+        if marker == 0xFF:  # Fill byte
+            position += 1
+            continue
+        if marker in (0x01, *range(0xD0, 0xD8)):  # Markers without a length
+            position += 2
+            continue
+        length = (buffer[position + 2] << 8) | buffer[position + 3]
+        if marker in JPEG_SOF_MARKERS:
+            height = (buffer[position + 5] << 8) | buffer[position + 6]
+            width = (buffer[position + 7] << 8) | buffer[position + 8]
+            return width, height
+        position += 2 + length
+    return None
+
+def read_image_size(path, header_bytes=65536):
+    # (width, height) of an image file without decoding it, None if the header can't be parsed.
+    # Only the start of the file is read, unless a JPEG has its size after a large EXIF block
+    try:
+        data = np.fromfile(path, dtype=np.uint8, count=header_bytes)
+        size = image_size(data)
+        if size is None and len(data) == header_bytes:
+            size = image_size(np.fromfile(path, dtype=np.uint8))
+    except OSError:
+        return None
+    return None if size is None else tuple(int(value) for value in size)
+
+def temporary_path(path):
+    # Unique per process and thread, next to path so the rename stays on one file system
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+def replace_file(path, write):
+    # write(temporary path), then rename it over path, so a crash never leaves a truncated file behind
+    temporary = temporary_path(path)
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+class PrefetchingReader:
+    # Iterates (item, load(item)) in order while up to depth loads run ahead on worker threads
+    def __init__(self, load, items, threads=2, depth=8):
+        self.load = load
+        self.items = iter(items)
+        self.threads = threads
+        self.depth = max(depth, 1)
+
+    def __iter__(self):
+        if self.threads <= 0:
+            for item in self.items:
+                yield item, self.load(item)
+            return
+
+        with ThreadPoolExecutor(self.threads) as executor:
+            pending = deque()
+            for item in self.items:
+                pending.append((item, executor.submit(self.load, item)))
+                if len(pending) >= self.depth:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+
+class AsyncWriter:
+    # Runs write tasks on worker threads. submit blocks once depth writes are queued, so a fast
+    # producer can't pile up encoded images in memory. flush waits for everything and returns
+    # the errors per key
+    def __init__(self, threads=2, depth=8):
+        self.executor = ThreadPoolExecutor(threads) if threads > 0 else None
+        self.slots = threading.BoundedSemaphore(max(depth, 1))
+        self.futures = []
+
+    def submit(self, key, write, *args):
+        if self.executor is None:
+            self.futures.append((key, run_write(write, args)))
+            return
+
+        self.slots.acquire()
+        future = self.executor.submit(run_write, write, args)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append((key, future))
+
+    def flush(self):
+        errors = {}
+        for key, future in self.futures:
+            error = future if self.executor is None else future.result()
+            if error is not None and key not in errors:
+                errors[key] = error
+        self.futures = []
+        return errors
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+def run_write(write, args):
+    # Returns None on success or a description of what went wrong
+    try:
+        if write(*args) is False:
+            return 'write failed'
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    return None
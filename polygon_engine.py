@@ -0,0 +1,375 @@
+import math
+from itertools import chain
+import numpy as np
+
+# Polygons are stored as one contiguous (N, 2) float32 array of vertices plus an
+# int32 offsets array of length P + 1, so polygon i is coords[offsets[i]:offsets[i + 1]].
+# Every geometric op is expressed as a 3x3 homogeneous affine matrix and applied to all
+# vertices of an image at once.
+
+def pack_polygons(polygons):
+    counts = np.fromiter((len(polygon) for polygon in polygons), dtype=np.int32, count=len(polygons))
+    offsets = np.zeros(len(polygons) + 1, dtype=np.int32)
+    np.cumsum(counts, out=offsets[1:])
+
+    if offsets[-1] == 0:
+        return np.zeros((0, 2), dtype=np.float32), offsets
+
+    flat = np.fromiter(chain.from_iterable(chain.from_iterable(polygons)), dtype=np.float32, count=2 * int(offsets[-1]))
+    return flat.reshape(-1, 2), offsets
+
+def unpack_polygons(coords, offsets):
+    # Convert once to Python floats, then slice per polygon
+    points = list(map(tuple, coords.tolist()))
+    bounds = offsets.tolist()
+    return [points[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+def identity_matrix():
+    return np.eye(3, dtype=np.float64)
+
+def compose(*matrices):
+    # compose(A, B, C) applies A first, then B, then C
+    result = identity_matrix()
+    for matrix in matrices:
+        result = to_homogeneous(matrix) @ result
+    return result
+
+def to_homogeneous(matrix):
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.shape == (3, 3):
+        return matrix
+    return np.vstack([matrix, [0.0, 0.0, 1.0]])
+
+def scale_translate_matrix(sx=1.0, sy=1.0, tx=0.0, ty=0.0):
+    return np.array([[sx, 0.0, tx],
+                     [0.0, sy, ty],
+                     [0.0, 0.0, 1.0]], dtype=np.float64)
+
+def mirror_matrix():
+    # Horizontal mirror in normalized coordinates: x -> 1 - x
+    return scale_translate_matrix(-1.0, 1.0, 1.0, 0.0)
+
+def normalize_matrix(dims):
+    # Pixel coordinates -> normalized coordinates for an image of (width, height)
+    return scale_translate_matrix(1.0 / dims[0], 1.0 / dims[1])
+
+def denormalize_matrix(dims):
+    # Normalized coordinates -> pixel coordinates for an image of (width, height)
+    return scale_translate_matrix(dims[0], dims[1])
+
+def pixel_rotation_matrix(angle, original_center, new_center):
+    # Same convention as cv2.getRotationMatrix2D: rotate by -angle around original_center
+    # and move the result to new_center, in pixel coordinates
+    angle_rad = math.radians(-angle)
+    cos_angle = math.cos(angle_rad)
+    sin_angle = math.sin(angle_rad)
+    rotate = np.array([[cos_angle, -sin_angle, 0.0],
+                       [sin_angle, cos_angle, 0.0],
+                       [0.0, 0.0, 1.0]], dtype=np.float64)
+
+    return compose(scale_translate_matrix(tx=-original_center[0], ty=-original_center[1]),
+                   rotate,
+                   scale_translate_matrix(tx=new_center[0], ty=new_center[1]))
+
+def rotation_matrix(angle, original_center, new_center, original_dims, new_dims):
+    # pixel_rotation_matrix between normalized coordinates of the original and rotated images
+    return pixel_to_normalized_matrix(pixel_rotation_matrix(angle, original_center, new_center), original_dims, new_dims)
+
+def pixel_to_normalized_matrix(matrix, original_dims, new_dims):
+    # Convert a pixel-space affine (as used by cv2.warpAffine) into the equivalent
+    # normalized-space affine for labels
+    return compose(denormalize_matrix(original_dims), matrix, normalize_matrix(new_dims))
+
+def transform_coords(coords, matrix, clip=True, min_value=0.0, max_value=1.0):
+    if len(coords) == 0:
+        return coords
+
+    matrix = to_homogeneous(matrix)
+    linear = matrix[:2, :2].T.astype(np.float32)
+    translation = matrix[:2, 2].astype(np.float32)
+
+    transformed = coords @ linear
+    transformed += translation
+
+    if clip:
+        np.clip(transformed, min_value, max_value, out=transformed)
+
+    return transformed
+
+def transform_polygons(polygons, matrix, clip=True):
+    coords, offsets = pack_polygons(polygons)
+    return unpack_polygons(transform_coords(coords, matrix, clip), offsets)
+
+def bounding_box(coords):
+    if len(coords) == 0:
+        return None
+
+    min_x, min_y = coords.min(axis=0).tolist()
+    max_x, max_y = coords.max(axis=0).tolist()
+    return min_x, min_y, max_x, max_y
+
+UNIT_BOX = (0.0, 0.0, 1.0, 1.0)
+
+def clip_polygons(coords, offsets, class_ids, rect=UNIT_BOX):
+    # Clip every polygon of an image against the axis-aligned rect (x_min, y_min, x_max, y_max)
+    # with Sutherland-Hodgman, one half-plane at a time. Polygons that cross an edge more than
+    # twice are split into their separate parts. Returns coords, offsets and the class id of each
+    # part (an array if class_ids is one, else a list)
+    parents = np.arange(len(offsets) - 1)
+    x_min, y_min, x_max, y_max = rect
+
+    for axis, value, sign in ((0, x_min, 1.0), (0, x_max, -1.0), (1, y_min, 1.0), (1, y_max, -1.0)):
+        coords, offsets, parents = clip_half_plane(coords, offsets, parents, axis, value, sign)
+
+    if isinstance(class_ids, np.ndarray):
+        return coords, offsets, class_ids[parents]
+    return coords, offsets, [class_ids[i] for i in parents.tolist()]
+
+def clip_half_plane(coords, offsets, parents, axis, value, sign):
+    # Keeps the part of each polygon where sign * (coordinate - value) >= 0
+    distance = sign * (coords[:, axis] - np.float32(value))
+    inside = distance >= 0
+    if inside.all():
+        return coords, offsets, parents
+
+    counts = np.diff(offsets)
+    starts = offsets[:-1]
+    polygon_index = np.repeat(np.arange(len(counts)), counts)
+
+    # Previous vertex of every vertex, wrapping around within its own polygon
+    previous = np.arange(len(coords)) - 1
+    non_empty = counts > 0
+    previous[starts[non_empty]] = offsets[1:][non_empty] - 1
+
+    # Edge previous -> vertex crosses the line, emit the intersection point
+    crossing = inside != inside[previous]
+    crossings_per_polygon = np.bincount(polygon_index[crossing], minlength=len(counts))
+
+    # Vectorized Sutherland-Hodgman: each vertex emits its crossing point (if any), then itself (if inside)
+    emitted = inside.astype(np.int32) + crossing
+    positions = np.cumsum(emitted) - emitted
+    clipped = np.empty((int(emitted.sum()), 2), dtype=np.float32)
+
+    crossing_index = np.nonzero(crossing)[0]
+    if len(crossing_index):
+        before = previous[crossing_index]
+        t = distance[before] / (distance[before] - distance[crossing_index])
+        intersections = coords[before] + t[:, None] * (coords[crossing_index] - coords[before])
+        intersections[:, axis] = value  # exactly on the line
+        clipped[positions[crossing_index]] = intersections
+
+    clipped[(positions + crossing)[inside]] = coords[inside]
+
+    clipped_counts = np.bincount(polygon_index, weights=emitted, minlength=len(counts)).astype(np.int32)
+    clipped_offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+    np.cumsum(clipped_counts, out=clipped_offsets[1:])
+
+    if (crossings_per_polygon <= 2).all():
+        keep = clipped_counts >= 3
+        if keep.all():
+            return clipped, clipped_offsets, parents
+        return select_polygons(clipped, clipped_offsets, keep, parents)
+
+    # Rare case: a polygon leaves and re-enters the half-plane and has to be split into parts
+    parts = []
+    part_parents = []
+    for i in range(len(counts)):
+        if crossings_per_polygon[i] <= 2:
+            if clipped_counts[i] >= 3:
+                parts.append(clipped[clipped_offsets[i]:clipped_offsets[i + 1]])
+                part_parents.append(parents[i])
+            continue
+
+        polygon = coords[offsets[i]:offsets[i + 1]]
+        split = split_half_plane(polygon, axis, value, sign)
+        if split is None:
+            split = shapely_half_plane(polygon, axis, value, sign)
+        if split is None:
+            # No way to split this one, keep the unsplit Sutherland-Hodgman result
+            split = [clipped[clipped_offsets[i]:clipped_offsets[i + 1]]]
+
+        for part in split:
+            if len(part) >= 3:
+                parts.append(part)
+                part_parents.append(parents[i])
+
+    coords, offsets = concatenate_polygons(parts)
+    return coords, offsets, np.asarray(part_parents, dtype=parents.dtype)
+
+def split_half_plane(polygon, axis, value, sign):
+    # Splits a simple polygon by a line into the separate parts on the kept side. The crossings,
+    # sorted along the line, pair up into the segments of the line inside the polygon; each exit
+    # continues at the entry it is paired with. Returns None if the pairing is inconsistent,
+    # which happens for self-intersecting input
+    distance = sign * (polygon[:, axis] - np.float32(value))
+    inside = distance >= 0
+    n = len(polygon)
+    crossing_index = np.nonzero(inside != np.roll(inside, 1))[0]
+    if len(crossing_index) % 2:
+        return None
+
+    before = (crossing_index - 1) % n
+    t = distance[before] / (distance[before] - distance[crossing_index])
+    points = polygon[before] + t[:, None] * (polygon[crossing_index] - polygon[before])
+    points[:, axis] = value
+    is_entry = inside[crossing_index]
+
+    # Pair the crossings along the line and map every exit to its partner entry
+    order = np.argsort(points[:, 1 - axis], kind='stable')
+    partner = {}
+    for a, b in order.reshape(-1, 2).tolist():
+        if is_entry[a] == is_entry[b]:
+            return None
+        exit_crossing, entry_crossing = (b, a) if is_entry[a] else (a, b)
+        partner[exit_crossing] = entry_crossing
+
+    # Each entry starts a run of inside vertices that ends at the next crossing, which is an exit
+    count = len(crossing_index)
+    runs = {}
+    for k in range(count):
+        if is_entry[k]:
+            start = crossing_index[k]
+            stop = crossing_index[(k + 1) % count]
+            vertices = np.arange(start, stop if stop > start else stop + n) % n
+            runs[k] = ((k + 1) % count, np.vstack([points[k:k + 1], polygon[vertices], points[(k + 1) % count:(k + 1) % count + 1]]))
+
+    parts = []
+    visited = set()
+    for first in runs:
+        if first in visited:
+            continue
+        chain = []
+        entry = first
+        while entry not in visited:
+            visited.add(entry)
+            exit_crossing, run = runs[entry]
+            chain.append(run)
+            entry = partner[exit_crossing]
+        if entry != first:
+            return None
+        parts.append(np.vstack(chain).astype(np.float32))
+
+    return parts
+
+try:
+    from shapely.geometry import Polygon, box
+except ImportError:
+    Polygon = None
+
+def shapely_half_plane(polygon, axis, value, sign):
+    # Optional fallback for self-intersecting input: repair with buffer(0) and intersect
+    if Polygon is None:
+        return None
+
+    x_min, y_min = polygon.min(axis=0).tolist()
+    x_max, y_max = polygon.max(axis=0).tolist()
+    bounds = [x_min - 1, y_min - 1, x_max + 1, y_max + 1]
+    if sign > 0:
+        bounds[axis] = value
+    else:
+        bounds[axis + 2] = value
+
+    intersected = Polygon(polygon.tolist()).buffer(0).intersection(box(*bounds))
+    geometries = getattr(intersected, 'geoms', [intersected])
+    return [np.asarray(geometry.exterior.coords[:-1], dtype=np.float32)
+            for geometry in geometries if not geometry.is_empty and geometry.geom_type == 'Polygon']
+
+def simplify_polygons(coords, offsets, tolerance, scale=(1.0, 1.0)):
+    # Douglas-Peucker on every polygon at once: each round splits all segments that still have a
+    # vertex farther than tolerance from them at that vertex. Distances are measured after
+    # multiplying by scale, (width, height) of the image for a tolerance in pixels. A ring is
+    # first cut at its first vertex and the vertex farthest from it. Kept vertices are the original
+    # ones; polygons of 3 or fewer vertices (and two point boxes) are left alone, and polygons
+    # that would end up with fewer than 3 keep a triangle: the start, the farthest vertex and the
+    # vertex farthest from the chord between those two
+    counts = np.diff(offsets)
+    simplified = counts > 3
+    if tolerance <= 0 or not simplified.any():
+        return coords, offsets
+
+    x = coords[:, 0].astype(np.float64) * scale[0]
+    y = coords[:, 1].astype(np.float64) * scale[1]
+    keep = ~np.repeat(simplified, counts)
+    starts = offsets[:-1][simplified].astype(np.int64)
+    ends = offsets[1:][simplified].astype(np.int64)
+    keep[starts] = True
+
+    # Segments are (first, last) vertex indices. The closing segment of a ring ends at its first
+    # vertex again, so its last is the start index, and its vertices run up to the polygon end
+    far = farthest_vertices(x, y, starts + 1, ends, starts, starts)[0]
+    keep[far] = True
+    first = np.concatenate([starts, far])
+    last = np.concatenate([far, starts])
+    stop = np.concatenate([far, ends])
+
+    squared_tolerance = tolerance * tolerance
+    while len(first):
+        split, squared_distance = farthest_vertices(x, y, first + 1, stop, first, last)
+        cut = squared_distance > squared_tolerance
+        split = split[cut]
+        keep[split] = True
+        first, last, stop = np.concatenate([first[cut], split]), np.concatenate([split, last[cut]]), \
+            np.concatenate([split, stop[cut]])
+
+    polygon_index = np.repeat(np.arange(len(counts)), counts)
+    kept_counts = np.bincount(polygon_index[keep], minlength=len(counts))
+    too_few = kept_counts[simplified] < 3
+    if too_few.any():
+        # Only the start and the farthest vertex are left. Both sides of the chord between them
+        # have vertices to pick the third from, as these polygons have more than 3
+        starts, ends, far = starts[too_few], ends[too_few], far[too_few]
+        before, before_distance = farthest_vertices(x, y, starts + 1, far, starts, far)
+        after, after_distance = farthest_vertices(x, y, far + 1, ends, far, starts)
+        keep[np.where(after_distance > before_distance, after, before)] = True
+        kept_counts = np.bincount(polygon_index[keep], minlength=len(counts))
+
+    new_offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+    np.cumsum(kept_counts, out=new_offsets[1:])
+    return coords[keep], new_offsets
+
+def farthest_vertices(x, y, begin, stop, first, last):
+    # Per segment, the vertex in [begin, stop) farthest from the line segment first -> last and
+    # the squared distance. Segments without vertices there get -1
+    lengths = np.maximum(stop - begin, 0)
+    split = first.copy()
+    squared_distance = np.full(len(lengths), -1.0)
+    filled = lengths > 0
+    if not filled.any():
+        return split, squared_distance
+
+    lengths = lengths[filled]
+    first, last = first[filled], last[filled]
+    positions = np.cumsum(lengths) - lengths
+    vertices = np.repeat(begin[filled] - positions, lengths) + np.arange(int(positions[-1] + lengths[-1]))
+
+    # Segment values repeated per vertex, cheaper than gathering them by segment index
+    dx, dy = x[last] - x[first], y[last] - y[first]
+    inverse = 1.0 / np.maximum(dx * dx + dy * dy, np.finfo(np.float64).tiny)
+    ox = x[vertices] - np.repeat(x[first], lengths)
+    oy = y[vertices] - np.repeat(y[first], lengths)
+    dx, dy = np.repeat(dx, lengths), np.repeat(dy, lengths)
+    t = np.clip((ox * dx + oy * dy) * np.repeat(inverse, lengths), 0.0, 1.0)
+    ox -= t * dx
+    oy -= t * dy
+    vertex_distance = ox * ox + oy * oy
+
+    # First vertex with the largest distance of each segment
+    largest = np.maximum.reduceat(vertex_distance, positions)
+    candidates = np.where(vertex_distance == np.repeat(largest, lengths), vertices, np.iinfo(np.int64).max)
+    split[filled] = np.minimum.reduceat(candidates, positions)
+    squared_distance[filled] = largest
+    return split, squared_distance
+
+def select_polygons(coords, offsets, keep, parents):
+    counts = np.diff(offsets)
+    vertex_keep = np.repeat(keep, counts)
+    new_offsets = np.zeros(int(keep.sum()) + 1, dtype=np.int32)
+    np.cumsum(counts[keep], out=new_offsets[1:])
+    return coords[vertex_keep], new_offsets, parents[keep]
+
+def concatenate_polygons(parts):
+    offsets = np.zeros(len(parts) + 1, dtype=np.int32)
+    np.cumsum([len(part) for part in parts], out=offsets[1:])
+    if not parts:
+        return np.zeros((0, 2), dtype=np.float32), offsets
+    return np.concatenate(parts).astype(np.float32, copy=False), offsets
@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# Journal of a batch run, so a run that dies halfway (power cut, killed process, a worker that
+# brings the pool down) can pick up where it stopped. Starting a run writes its fingerprint, seed
+# and plans; every finished chunk then appends its results as one JSON line and is flushed to
+# disk before the next one is recorded. Resuming reloads the plans, so the remaining chunks get
+# exactly the random decisions they would have had in one go, and only runs the missing chunks.
+
+JOURNAL_FILE = 'run_journal.jsonl'
+JOURNAL_PLANS_FILE = 'run_journal_plans.npy'
+
+def run_fingerprint(*parts):
+    # Hash of everything that has to match for a journal to be resumed (jobs, settings, plans, ...)
+    def encode(value):
+        if isinstance(value, np.ndarray):
+            return hashlib.blake2b(value.tobytes(), digest_size=16).hexdigest()
+        return str(value)
+    return hashlib.blake2b(json.dumps(parts, sort_keys=True, default=encode).encode(), digest_size=16).hexdigest()
+
+class RunJournal:
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, JOURNAL_FILE)
+        self.plans_path = os.path.join(directory, JOURNAL_PLANS_FILE)
+        self.file = None
+
+    def resume(self, fingerprint):
+        # (seed, plans, {chunk index: results}) of an unfinished journal with this fingerprint, else None
+        try:
+            with open(self.path) as file:
+                lines = file.read().splitlines()
+            header = json.loads(lines[0])
+            plans = np.load(self.plans_path)
+        except (OSError, ValueError, IndexError):
+            return None
+        if header.get('fingerprint') != fingerprint:
+            return None
+
+        done = {}
+        kept = lines[:1]
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # The line the run died while writing
+            if record.get('complete'):
+                return None
+            done[record['chunk']] = [tuple(result) for result in record['results']]
+            kept.append(line)
+
+        # Drop a torn last line before appending to the journal again
+        self.file = open(self.path, 'w')
+        self.file.write(''.join(line + '\n' for line in kept))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return header['seed'], plans, done
+
+    def start(self, fingerprint, seed, plans):
+        os.makedirs(self.directory, exist_ok=True)
+        np.save(self.plans_path + '.tmp.npy', plans)
+        os.replace(self.plans_path + '.tmp.npy', self.plans_path)
+        self.close()  # resume may have opened the journal already
+        self.file = open(self.path, 'w')
+        self.write({'fingerprint': fingerprint, 'seed': seed})
+
+    def record(self, chunk_index, results):
+        self.write({'chunk': chunk_index, 'results': results})
+
+    def finish(self):
+        self.write({'complete': True})
+        self.close()
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,129 @@
+import os
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+# Per-stage timers and counters of the augmentation pipeline (decode, each augmentation op,
+# overlay background and blend, encode, writes) to see which one dominates a slow run. Code
+# marks its stages with `with stage('crop'):` and its counts with count('crop_dropped', n).
+# Both go to the profiler of the current process, and are a shared no-op when there is none,
+# so instrumented code costs next to nothing unless a run asks for a profile.
+
+# Profiler of this process, None when profiling is off. Set by collect or batch_augment.init_worker
+active = None
+
+NULL_STAGE = nullcontext()
+TRACE_FIELDS = ('stage', 'pid', 'thread', 'start', 'seconds')
+
+class StageTimer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, time.perf_counter() - self.start, self.start)
+        return False
+
+class StageProfiler:
+    # Calls and seconds per stage plus named counters, safe to update from reader and writer
+    # threads. With trace, every timed stage is also kept as an event with its wall clock start
+    def __init__(self, trace=False):
+        self.lock = threading.Lock()
+        self.trace = trace
+        self.clock_offset = time.time() - time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def add(self, name, seconds, start=None):
+        with self.lock:
+            calls, total = self.stages.get(name, (0, 0.0))
+            self.stages[name] = (calls + 1, total + seconds)
+            if self.trace:
+                start = time.perf_counter() - seconds if start is None else start
+                self.events.append((name, os.getpid(), threading.get_ident(), start + self.clock_offset, seconds))
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def take(self):
+        # Returns the totals so far and starts over
+        with self.lock:
+            totals = {'stages': self.stages, 'counters': self.counters, 'events': self.events}
+            self.stages, self.counters, self.events = {}, {}, []
+        return totals
+
+def stage(name):
+    return NULL_STAGE if active is None else active.stage(name)
+
+def count(name, value=1):
+    if active is not None:
+        active.count(name, value)
+
+def add(name, seconds):
+    # For stages that are timed anyway, like the encode in output_encoding
+    if active is not None:
+        active.add(name, seconds)
+
+def enabled():
+    # Guard for counts that cost something to compute, like file sizes
+    return active is not None
+
+@contextmanager
+def collect(trace=False):
+    # Profiles everything this process runs inside the block
+    global active
+    previous, active = active, StageProfiler(trace)
+    try:
+        yield active
+    finally:
+        active = previous
+
+def merge_profiles(totals, part):
+    for name, (calls, seconds) in part['stages'].items():
+        total_calls, total_seconds = totals['stages'].get(name, (0, 0.0))
+        totals['stages'][name] = (total_calls + calls, total_seconds + seconds)
+    for name, value in part['counters'].items():
+        totals['counters'][name] = totals['counters'].get(name, 0) + value
+    totals['events'].extend(part['events'])
+    return totals
+
+def empty_profile():
+    return {'stages': {}, 'counters': {}, 'events': []}
+
+def format_profile(totals):
+    # Summary table lines, slowest stage first. Reader and writer threads run stages at the same
+    # time as the augmentation, so the share is of all stage time, not of the wall time of the run
+    lines = []
+    stage_seconds = sum(seconds for _, seconds in totals['stages'].values()) or 1.0
+    lines.append(f"  {'stage':<20} {'calls':>9} {'total s':>10} {'mean ms':>9} {'share':>7}")
+    for name, (calls, seconds) in sorted(totals['stages'].items(), key=lambda item: -item[1][1]):
+        lines.append(f"  {name:<20} {calls:>9} {seconds:>10.2f} {1000 * seconds / max(calls, 1):>9.2f} "
+                     f"{100 * seconds / stage_seconds:>6.1f}%")
+    for name, value in sorted(totals['counters'].items()):
+        lines.append(f"  {name:<20} {value:>9}")
+    return lines
+
+def write_trace(path, totals):
+    # .csv gets one row per timed stage, anything else a JSON file with the totals and the events
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(TRACE_FIELDS)
+            writer.writerows(totals['events'])
+        return
+
+    with open(path, 'w') as file:
+        json.dump({'stages': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in totals['stages'].items()},
+                   'counters': totals['counters'],
+                   'events': [dict(zip(TRACE_FIELDS, event)) for event in totals['events']]}, file)
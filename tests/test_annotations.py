@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from annotations import Annotations
+from polygon_engine import mirror_matrix
+
+POLYGONS = [[(0.1, 0.1), (0.3, 0.1), (0.3, 0.3)], [(0.5, 0.5), (0.2, 0.2)], [(0.6, 0.6), (0.9, 0.6), (0.9, 0.9), (0.6, 0.9)]]
+
+def test_indexing_gives_views():
+    annotations = Annotations.from_polygons(POLYGONS, ['0', '4', '2'])
+    assert len(annotations) == 3 and annotations.class_ids.dtype == np.int16
+    assert np.shares_memory(annotations[2], annotations.coords)
+    assert np.allclose(annotations[-1], POLYGONS[2])
+
+    tail = annotations[1:]
+    assert np.shares_memory(tail.coords, annotations.coords)
+    assert tail.offsets.tolist() == [0, 2, 6] and tail.class_ids.tolist() == [4, 2]
+    assert len(annotations[2:1]) == 0
+
+    selected = annotations[np.array([True, False, True])]
+    assert selected.class_ids.tolist() == [0, 2] and np.allclose(selected[1], POLYGONS[2])
+    assert annotations[::2].class_ids.tolist() == [0, 2]
+    assert [class_id for class_id, _ in annotations] == [0, 4, 2]
+
+def test_transforms_share_what_they_keep():
+    annotations = Annotations.from_polygons(POLYGONS, [0, 4, 2])
+    mirrored = annotations.transform(mirror_matrix())
+    assert mirrored.offsets is annotations.offsets and mirrored.class_ids is annotations.class_ids
+    assert np.allclose(mirrored[0], [(0.9, 0.1), (0.7, 0.1), (0.7, 0.3)])
+
+    boxes = annotations.boxes_to_polygons()
+    assert boxes.vertex_counts().tolist() == [3, 4, 4]
+    assert boxes.areas() == pytest.approx([0.02, 0.04, 0.09])
+    assert annotations.bounds() == pytest.approx((0.1, 0.1, 0.9, 0.9))
+    assert np.allclose(annotations.denormalized(100, 50)[0], [10, 5])
+
+def test_read_write_round_trip(tmp_path):
+    annotations = Annotations.from_polygons(POLYGONS, [0, 4, 2])
+    annotations.write(str(tmp_path / 'a.txt'))
+    read = Annotations.read(str(tmp_path / 'a.txt'))
+    assert np.array_equal(read.offsets, annotations.offsets) and np.array_equal(read.class_ids, annotations.class_ids)
+    assert np.allclose(read.coords, annotations.coords, atol=1e-6)
+
+def test_class_ids_have_to_be_small_integers():
+    for class_ids in (['a'], [40000], ['2.5']):
+        with pytest.raises(ValueError):
+            Annotations.from_polygons(POLYGONS[:1], class_ids)
@@ -0,0 +1,33 @@
+import numpy as np
+from annotations import Annotations
+from augment_data import augment_batch, augment_labels
+from augmentation_plan import PLAN_DTYPE, sample_plans
+
+ANNOTATIONS = Annotations.from_polygons([[(0.1, 0.1), (0.5, 0.1), (0.5, 0.5)], [(0.6, 0.6), (0.9, 0.6), (0.9, 0.9)]], [0, 3])
+
+def sample_batch(count, seed=5):
+    return sample_plans(count, 'a', {}, [50, 50], [50, 50], [0, 100], [50, 50], [0.3, 1.0], [50, 50], [50, 50], [50, 50],
+                        [0.05, 0.5, 0.1, 0.8], seed=seed)
+
+def test_batch_matches_single_samples():
+    images = np.random.default_rng(0).integers(0, 256, (12, 60, 80, 3), dtype=np.uint8)
+    plans = sample_batch(12)
+    for output_size in (None, (64, 48)):
+        outputs, results = augment_batch(images, [ANNOTATIONS] * 12, plans, output_size=output_size)
+        for i in range(12):
+            image, annotations = augment_labels(images[i], ANNOTATIONS, plans[i], 60, 80, '', True, output_size)
+            assert np.array_equal(image, outputs[i])
+            assert np.array_equal(annotations.coords, results[i].coords)
+
+def test_batch_outputs_never_share_memory():
+    # The same source for every sample, as augment_stream passes the variants of one image
+    source = np.random.default_rng(1).integers(0, 256, (60, 80, 3), dtype=np.uint8)
+    plans = sample_batch(16)
+    identity = np.zeros(1, dtype=PLAN_DTYPE)[0]
+    plans[:4] = identity  # Samples whose geometry leaves the image as it is
+    for output_size in (None, (80, 60)):
+        outputs, _ = augment_batch([source] * len(plans), [ANNOTATIONS] * len(plans), plans, output_size=output_size)
+        for i in range(len(plans)):
+            assert not np.shares_memory(outputs[i], source)
+            for j in range(i):
+                assert not np.shares_memory(outputs[i], outputs[j])
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+from stage_profiler import collect
+from batch_augment import prepare_labels
+from annotations import Annotations
+from augment_data import augment_labels, blend_overlay, overlay_detections_on_coco, letterbox_image_and_labels, cover_image
+from test_augment_batch import sample_batch
+
+POLYGONS = [[(0.3, 0.3), (0.6, 0.25), (0.7, 0.6), (0.35, 0.7)], [(0.1, 0.1), (0.2, 0.1), (0.2, 0.2)]]
+
+def filled_image(polygons, width=640, height=480):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    for polygon in polygons:
+        cv2.fillPoly(image, [np.rint(np.array(polygon) * (width, height)).astype(np.int32)], (255, 255, 255))
+    return image
+
+def label_iou(image, annotations):
+    # Overlap of the white shapes in image with the labels drawn on an empty mask
+    (h, w) = image.shape[:2]
+    mask = filled_image(annotations.polygons(), w, h)[..., 0] > 0
+    shapes = image[..., 0] > 127
+    return (shapes & mask).sum() / max((shapes | mask).sum(), 1)
+
+def test_fused_geometry_matches_staged():
+    image = filled_image(POLYGONS)
+    annotations = Annotations.from_polygons(POLYGONS, [0, 1])
+    for plan in sample_batch(40, seed=9):
+        staged_image, staged = augment_labels(image, annotations, plan, 480, 640, '')
+        fused_image, fused = augment_labels(image, annotations, plan, 480, 640, '', True)
+        assert staged_image.shape == fused_image.shape
+        assert np.array_equal(staged.offsets, fused.offsets)
+        assert np.allclose(staged.coords, fused.coords, atol=5e-3)
+        # The single warp puts the pixels where the labels say they are
+        assert label_iou(fused_image, fused) > 0.9
+
+def test_blend_overlay_rounds_like_float_division():
+    alpha = np.arange(256, dtype=np.uint8)[:, None, None]
+    overlay = np.arange(256, dtype=np.uint8)[None, :, None]
+    for value in range(0, 256, 5):
+        background = np.full((256, 256, 1), value, dtype=np.uint8)
+        expected = np.rint((overlay * alpha.astype(np.float64) + value * (255.0 - alpha)) / 255)
+        blend_overlay(background, overlay, alpha)
+        assert np.array_equal(background, expected)
+
+def test_overlay_pastes_only_the_detections():
+    image = filled_image([POLYGONS[0]])
+    annotations = Annotations.from_polygons([POLYGONS[0]], [0])
+    coco_image = np.full((300, 400, 3), 90, dtype=np.uint8)
+    result, labels = overlay_detections_on_coco(coco_image.copy(), image, annotations, 0.5, 0.3, 0.6)
+    assert result.shape == coco_image.shape and len(labels) == 1
+    # White where the moved label is, the untouched background everywhere else
+    inside = filled_image(labels.polygons(), 400, 300)[..., 0] > 0
+    assert label_iou(result, labels) > 0.9
+    assert (result[~inside] == 90).mean() > 0.99
+
+def test_letterbox_keeps_the_aspect_ratio():
+    image = filled_image(POLYGONS)
+    annotations = Annotations.from_polygons(POLYGONS, [0, 1])
+    canvas, labels = letterbox_image_and_labels(image, annotations, (320, 320))
+    assert canvas.shape == (320, 320, 3)
+    # 640x480 fits as 320x240 with 40 pixel bars above and below
+    assert not canvas[:40].any() and not canvas[280:].any()
+    assert np.allclose(labels.coords[:, 0], annotations.coords[:, 0], atol=1e-6)
+    assert np.allclose(labels.coords[:, 1], (annotations.coords[:, 1] * 240 + 40) / 320, atol=1e-6)
+    assert label_iou(canvas, labels) > 0.9
+    assert cover_image(image, (200, 300)).shape == (300, 200, 3)
+
+def test_every_output_has_the_output_size():
+    image = filled_image(POLYGONS)
+    annotations = Annotations.from_polygons(POLYGONS, [0, 1])
+    for plan in sample_batch(20, seed=3):
+        for fused in (False, True):
+            output, labels = augment_labels(image, annotations, plan, 480, 640, '', fused, (416, 256))
+            assert output.shape == (256, 416, 3)
+            assert label_iou(output, labels) > 0.85
+
+def test_simplify_before_and_after_the_augmentation():
+    angles = np.linspace(0, 2 * np.pi, 300, endpoint=False)
+    circle = list(zip(0.5 + 0.3 * np.cos(angles), 0.5 + 0.3 * np.sin(angles)))
+    image = filled_image([circle])
+    annotations = Annotations.from_polygons([circle], [0])
+    settings = {'simplify_tolerance': 1.0, 'simplify_after_clip': True}
+    with collect() as profiler:
+        simplified, simplify_after = prepare_labels(annotations, settings, 640, 480)
+        assert simplify_after == 1.0 and 3 <= len(simplified.coords) < 100
+        for plan in sample_batch(10, seed=4):
+            output, labels = augment_labels(image, simplified, plan, 480, 640, '', True, None, simplify_after)
+            assert label_iou(output, labels) > 0.9
+    counters = profiler.take()['counters']
+    assert counters['simplify_vertices_in'] > counters['simplify_vertices_out']
+    assert prepare_labels(annotations, {}, 640, 480) == (annotations, None)
@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+import batch_augment
+from augment_stream import AugmentationStream, augment_sample
+from augmentation_plan import PLAN_DTYPE
+from test_augment_batch import sample_batch
+from test_incremental_runs import SETTINGS, make_dataset
+
+def write_source(tmp_path):
+    image_path = str(tmp_path / 'source.png')
+    label_path = str(tmp_path / 'source.txt')
+    cv2.imwrite(image_path, np.random.default_rng(2).integers(0, 256, (60, 80, 3), dtype=np.uint8))
+    with open(label_path, 'w') as f:
+        f.write('0 0.1 0.1 0.5 0.1 0.5 0.5\n3 0.6 0.6 0.9 0.6 0.9 0.9\n')
+    return image_path, label_path
+
+def test_staged_outputs_never_share_memory(tmp_path):
+    image_path, label_path = write_source(tmp_path)
+    plans = sample_batch(16)
+    plans[:4] = np.zeros(1, dtype=PLAN_DTYPE)[0]  # Samples whose geometry leaves the image as it is
+    plans[4:6] = np.zeros(1, dtype=PLAN_DTYPE)[0]
+    plans['crop'][4:6] = True  # Crops without a pad, which are views of the source
+    plans['crop_percentage'][4:6] = 0.5
+    for output_size in (None, (80, 60)):
+        batch_augment.worker_settings = {'coco_image_folder': '', 'output_size': output_size}
+        outputs = [image for image, _ in augment_sample((image_path, label_path, plans, None))]
+        assert len(outputs) == len(plans)
+        for i in range(len(outputs)):
+            for j in range(i):
+                assert not np.shares_memory(outputs[i], outputs[j])
+
+def epoch_labels(stream):
+    return [annotations.coords.tobytes() for _, annotations in stream]
+
+def test_epochs_repeat_for_a_seed(tmp_path):
+    make_dataset(str(tmp_path), count=5)
+    with AugmentationStream(str(tmp_path), SETTINGS, workers=0, seed=8, variants_per_image=2) as stream, \
+            AugmentationStream(str(tmp_path), SETTINGS, workers=2, seed=8, variants_per_image=2, prefetch=2) as pooled:
+        assert len(stream) == 10
+        first, second = epoch_labels(stream), epoch_labels(stream)
+        assert len(first) == 10 and first != second
+        # Same epochs with worker processes, and set_epoch goes back to one
+        assert epoch_labels(pooled) == first
+        pooled.set_epoch(1)
+        assert epoch_labels(pooled) == second
@@ -0,0 +1,31 @@
+import numpy as np
+from augmentation_plan import PLAN_DTYPE, SAMPLING_SETTINGS, sample_plans, upgrade_plans
+from test_incremental_runs import SETTINGS
+
+def sample(count, subfolders='a', seed=1, keys=None, **overrides):
+    settings = {**SETTINGS, **overrides}
+    return sample_plans(count, subfolders, *(settings[name] for name in SAMPLING_SETTINGS), seed=seed, keys=keys)
+
+def test_same_seed_same_plans():
+    assert np.array_equal(sample(50), sample(50))
+    assert not np.array_equal(sample(50), sample(50, seed=2))
+
+def test_weights_and_skipped_stages():
+    plans = sample(200, ['a', 'b'] * 100, mirror_weights=[100, 0], crop_weights=[0, 100],
+                   skip_augmentations={'Mirror': ['b'], 'Rotate': ['a']})
+    assert plans['mirror'].tolist() == [True, False] * 100
+    assert not plans['crop'].any()
+    assert plans['rotate'].tolist() == [False, True] * 100
+    assert 0.3 < plans['zoom'].mean() < 0.7
+
+def test_keyed_rows_only_depend_on_their_key():
+    keys = np.array([5, 17, 2 ** 63 + 9], dtype=np.uint64)
+    assert np.array_equal(sample(3, keys=keys)[2], sample(1, keys=keys[2:])[0])
+    assert np.array_equal(sample(3, keys=keys), sample(3, seed=99, keys=keys))
+
+def test_upgrade_fills_new_fields_with_zeros():
+    old_dtype = np.dtype([(name, PLAN_DTYPE.fields[name][0]) for name in PLAN_DTYPE.names[:18]])
+    old_plans = np.zeros(4, dtype=old_dtype)
+    old_plans['mirror'] = True
+    plans = upgrade_plans(old_plans)
+    assert plans.dtype == PLAN_DTYPE and plans['mirror'].all() and not plans['tint'].any()
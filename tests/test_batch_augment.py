@@ -0,0 +1,107 @@
+import os
+import json
+import numpy as np
+import pytest
+from batch_augment import PLANS_FILE, QUARANTINE_FILE, augment_dataset
+from pipelined_io import replace_file
+from test_incremental_runs import SETTINGS, make_dataset
+
+def read_outputs(root):
+    # {path relative to root: bytes} of every file a run wrote, without its cache
+    outputs = {}
+    for directory in ('images', 'labels'):
+        for folder, _, files in os.walk(os.path.join(root, directory)):
+            for name in files:
+                path = os.path.join(folder, name)
+                with open(path, 'rb') as file:
+                    outputs[os.path.relpath(path, root)] = file.read()
+    return outputs
+
+def test_output_does_not_depend_on_the_workers(tmp_path):
+    dataset_root = str(tmp_path / 'data')
+    make_dataset(dataset_root, count=7)
+    outputs = []
+    for workers, chunk_size in ((1, 16), (3, 2)):
+        augmented_root = str(tmp_path / f'augmented_{workers}')
+        report = augment_dataset(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=workers,
+                                 chunk_size=chunk_size, seed=11, resume=False)
+        assert report['counts'] == {'augmented': 7, 'skipped': 0, 'failed': 0}
+        outputs.append(read_outputs(augmented_root))
+    assert len(outputs[0]) == 14 and outputs[0] == outputs[1]
+
+def test_broken_sources_are_counted(tmp_path):
+    dataset_root, augmented_root = str(tmp_path / 'data'), str(tmp_path / 'augmented')
+    make_dataset(dataset_root, count=4)
+    os.remove(os.path.join(dataset_root, 'labels', 'train', 'a', '1.txt'))
+    with open(os.path.join(dataset_root, 'images', 'train', 'a', '2.png'), 'wb') as file:
+        file.write(b'not an image')
+
+    report = augment_dataset(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=2, chunk_size=1, seed=11,
+                             resume=False)
+    assert report['counts'] == {'augmented': 2, 'skipped': 1, 'failed': 1}
+    assert report['statuses'] == ['augmented', 'skipped', 'failed', 'augmented']
+    assert [(os.path.basename(image_path), status) for image_path, status, _ in report['failures']] == \
+        [('1.png', 'skipped'), ('2.png', 'failed')]
+
+    with open(os.path.join(augmented_root, QUARANTINE_FILE)) as file:
+        quarantine = json.load(file)
+    assert quarantine['seed'] == 11
+    assert [(os.path.basename(entry['image']), entry['status'], entry['reason']) for entry in quarantine['quarantined']] == \
+        [('1.png', 'skipped', 'no label file'), ('2.png', 'failed', 'unreadable image')]
+
+def test_saved_plans_replay_a_run(tmp_path):
+    dataset_root = str(tmp_path / 'data')
+    make_dataset(dataset_root, count=5)
+    first_root, replay_root = str(tmp_path / 'first'), str(tmp_path / 'replay')
+    augment_dataset(dataset_root, first_root, SETTINGS, splits=('train',), workers=2, chunk_size=2, seed=4, resume=False)
+    plans = np.load(os.path.join(first_root, PLANS_FILE))
+    augment_dataset(dataset_root, replay_root, SETTINGS, splits=('train',), workers=1, plans=plans, resume=False)
+    assert read_outputs(first_root) == read_outputs(replay_root)
+
+def test_variants_share_one_decode(tmp_path):
+    dataset_root, augmented_root = str(tmp_path / 'data'), str(tmp_path / 'augmented')
+    make_dataset(dataset_root, count=2)
+    report = augment_dataset(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=1, seed=4, resume=False,
+                             variants_per_image=3, profile='summary')
+    assert len(report['plans']) == 6
+    assert report['profile']['stages']['decode'][0] == 2
+    assert report['profile']['counters']['variants'] == 6
+    outputs = read_outputs(augmented_root)
+    names = sorted(os.path.basename(path) for path in outputs if path.startswith('labels'))
+    assert names == ['0.txt', '0_1.txt', '0_2.txt', '1.txt', '1_1.txt', '1_2.txt']
+    # Independently sampled variants of one source
+    assert len({plan.tobytes() for plan in report['plans'][:3]}) == 3
+
+def test_interrupted_run_resumes_after_its_last_chunk(tmp_path):
+    dataset_root = str(tmp_path / 'data')
+    make_dataset(dataset_root, count=6)
+    augmented_root, reference_root = str(tmp_path / 'augmented'), str(tmp_path / 'reference')
+    augment_dataset(dataset_root, reference_root, SETTINGS, splits=('train',), workers=1, chunk_size=2, seed=5, resume=False)
+
+    def interrupt(finished, total):
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        augment_dataset(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=1, chunk_size=2, seed=5,
+                        progress=interrupt)
+
+    # Only the two chunks that did not finish run again
+    report = augment_dataset(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=1, chunk_size=2, seed=5,
+                             profile='summary')
+    assert report['counts']['augmented'] == 6
+    assert report['profile']['counters']['variants'] == 4
+    assert read_outputs(augmented_root) == read_outputs(reference_root)
+
+def test_replace_file_leaves_nothing_behind_on_errors(tmp_path):
+    path = str(tmp_path / 'a.txt')
+    with open(path, 'w') as file:
+        file.write('old')
+
+    def write(temporary):
+        with open(temporary, 'w') as file:
+            file.write('partial')
+        raise OSError('disk full')
+    with pytest.raises(OSError):
+        replace_file(path, write)
+    assert os.listdir(tmp_path) == ['a.txt']
+    with open(path) as file:
+        assert file.read() == 'old'
@@ -0,0 +1,12 @@
+from benchmark_augment import run_benchmarks, compare
+
+def test_every_case_runs_and_regressions_are_found():
+    results = run_benchmarks({'tiny': (96, 64)}, [(2, 8)], repeats=2, progress=None)
+    assert results['meta']['repeats'] == 2
+    assert results['results'] and all(key.endswith('/tiny/2x8') for key in results['results'])
+    assert all(result['median_ms'] >= 0 and result['peak_memory_mb'] >= 0 for result in results['results'].values())
+
+    key = next(iter(results['results']))
+    baseline = {'results': {key: {**results['results'][key], 'median_ms': results['results'][key]['median_ms'] / 2}}}
+    assert [regression[0] for regression in compare(results, baseline, min_ms=0)] == [key]
+    assert compare(results, results) == []
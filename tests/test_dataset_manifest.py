@@ -0,0 +1,68 @@
+import os
+import shutil
+import cv2
+import numpy as np
+from dataset_manifest import DatasetManifest, open_manifest
+from label_store import CACHE_DIR
+
+def write_source(root, split, folder, name, lines=1, size=(40, 30)):
+    for kind in ('images', 'labels'):
+        os.makedirs(os.path.join(root, kind, split, folder), exist_ok=True)
+    cv2.imwrite(os.path.join(root, 'images', split, folder, name + '.png'), np.zeros((size[1], size[0], 3), dtype=np.uint8))
+    if lines is not None:
+        with open(os.path.join(root, 'labels', split, folder, name + '.txt'), 'w') as file:
+            file.write('0 0.1 0.1 0.2 0.1 0.2 0.2\n' * lines)
+
+def scanned_directories(manifest, full=False):
+    # Directories a refresh lists again
+    scanned = []
+    scan_directory = manifest.scan_directory
+    manifest.scan_directory = lambda directory, *args: scanned.append(directory) or scan_directory(directory, *args)
+    manifest.refresh(full)
+    return scanned
+
+def test_sources_come_from_the_headers_and_labels(tmp_path):
+    root = str(tmp_path)
+    write_source(root, 'train', 'a', '0', lines=2, size=(64, 48))
+    write_source(root, 'train', 'a', '1', lines=None)
+    write_source(root, 'val', 'b', '2')
+    manifest = open_manifest(root)
+    assert manifest.directory_names() == ['train', 'train/a', 'val', 'val/b']
+    assert manifest.folder_names() == ['a', 'b']
+    sources = manifest.sources('train/a')
+    assert [source[2:] for source in sources] == [(64, 48, 2), (40, 30, None)]
+    assert sources[1][1] == os.path.join(root, 'labels', 'train', 'a', '1.txt')
+
+def test_refresh_only_lists_changed_directories(tmp_path):
+    root = str(tmp_path)
+    write_source(root, 'train', 'a', '0')
+    write_source(root, 'train', 'b', '1')
+    open_manifest(root)
+
+    # Saved and loaded again, nothing changed
+    manifest = DatasetManifest(root)
+    assert manifest.load()
+    assert scanned_directories(manifest) == []
+
+    write_source(root, 'train', 'b', '2', lines=3)
+    shutil.rmtree(os.path.join(root, 'images', 'train', 'a'))
+    manifest = open_manifest(root, refresh=False)
+    assert scanned_directories(manifest) == ['train', 'train/b']
+    assert manifest.directory_names() == ['train', 'train/b']
+    assert [source[4] for source in manifest.sources('train/b')] == [1, 3]
+
+def test_full_refresh_sees_files_edited_in_place(tmp_path):
+    root = str(tmp_path)
+    write_source(root, 'train', 'a', '0')
+    manifest = open_manifest(root)
+    write_source(root, 'train', 'a', '0', lines=4)  # Rewrites the files, the directories don't change
+    assert manifest.sources('train/a')[0][4] == 1
+    assert len(scanned_directories(manifest, full=True)) == 2
+    assert manifest.sources('train/a')[0][4] == 4
+
+def test_read_only_root_has_no_cache(tmp_path):
+    root = str(tmp_path)
+    write_source(root, 'train', 'a', '0')
+    with open(os.path.join(root, CACHE_DIR), 'w'):
+        pass
+    assert open_manifest(root).sources('train/a')[0][4] == 1
@@ -0,0 +1,83 @@
+import os
+import cv2
+import numpy as np
+from incremental_runs import augment_dataset_incremental
+
+SETTINGS = dict(skip_augmentations={}, mirror_weights=[50, 50], crop_weights=[50, 50], overlay_weights=[0, 100],
+                overlay_scale_weights=[50, 50], overlay_min_max_scale=[0.3, 1.0], maintain_aspect_ratio_weights=[50, 50],
+                zoom_weights=[50, 50], zoom_in_vs_out_weights=[50, 50], zoom_padding=[0.05, 0.5, 0.1, 0.8])
+
+def make_dataset(root, count=4):
+    rng = np.random.default_rng(0)
+    os.makedirs(os.path.join(root, 'images', 'train', 'a'))
+    os.makedirs(os.path.join(root, 'labels', 'train', 'a'))
+    for i in range(count):
+        cv2.imwrite(os.path.join(root, 'images', 'train', 'a', f'{i}.png'), rng.integers(0, 255, (60, 80, 3), dtype=np.uint8))
+        with open(os.path.join(root, 'labels', 'train', 'a', f'{i}.txt'), 'w') as file:
+            file.write('0 0.2 0.2 0.6 0.25 0.5 0.7\n')
+
+def test_incremental_run_with_pending_jobs(tmp_path):
+    dataset_root, augmented_root = str(tmp_path / 'data'), str(tmp_path / 'augmented')
+    make_dataset(dataset_root)
+
+    report = augment_dataset_incremental(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=1, seed=3)
+    assert report['counts']['augmented'] == 4
+    assert report['profile'] is None
+    assert os.path.exists(os.path.join(augmented_root, 'labels', 'train', 'a', '0.txt'))
+
+    # Nothing changed, nothing pending
+    report = augment_dataset_incremental(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=1)
+    assert report['counts']['unchanged'] == 4
+
+def test_incremental_run_passes_the_stage_profile_through(tmp_path):
+    dataset_root, augmented_root = str(tmp_path / 'data'), str(tmp_path / 'augmented')
+    make_dataset(dataset_root, count=2)
+
+    report = augment_dataset_incremental(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=1, seed=3,
+                                         profile='summary')
+    assert report['counts']['augmented'] == 2
+    assert report['profile']['counters']['variants'] == 2
+
+def read_labels(augmented_root):
+    folder = os.path.join(augmented_root, 'labels', 'train', 'a')
+    labels = {}
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name)) as file:
+            labels[name] = file.read()
+    return labels
+
+def test_only_changed_sources_are_augmented_again(tmp_path):
+    dataset_root, augmented_root = str(tmp_path / 'data'), str(tmp_path / 'augmented')
+    make_dataset(dataset_root)
+    augment_dataset_incremental(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=1, seed=3)
+    before = read_labels(augmented_root)
+
+    label_folder = os.path.join(dataset_root, 'labels', 'train', 'a')
+    with open(os.path.join(label_folder, '1.txt'), 'w') as file:
+        file.write('0 0.3 0.3 0.7 0.35 0.6 0.8\n')
+    os.remove(os.path.join(dataset_root, 'images', 'train', 'a', '2.png'))
+    cv2.imwrite(os.path.join(dataset_root, 'images', 'train', 'a', '9.png'), np.zeros((60, 80, 3), dtype=np.uint8))
+    with open(os.path.join(label_folder, '9.txt'), 'w') as file:
+        file.write('1 0.2 0.2 0.6 0.25 0.5 0.7\n')
+
+    report = augment_dataset_incremental(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=1)
+    assert report['seed'] == 3
+    assert {name: report['counts'][name] for name in ('augmented', 'unchanged', 'removed')} == \
+        {'augmented': 2, 'unchanged': 2, 'removed': 1}
+    after = read_labels(augmented_root)
+    assert sorted(after) == ['0.txt', '1.txt', '3.txt', '9.txt']
+    assert after['0.txt'] == before['0.txt'] and after['3.txt'] == before['3.txt']
+    assert not os.path.exists(os.path.join(augmented_root, 'images', 'train', 'a', '2.png'))
+
+    # Plans belong to the source, not its position, so a run from scratch gives the same outputs
+    fresh_root = str(tmp_path / 'fresh')
+    augment_dataset_incremental(dataset_root, fresh_root, SETTINGS, splits=('train',), workers=1, seed=3)
+    assert read_labels(fresh_root) == after
+
+def test_changed_settings_augment_everything_again(tmp_path):
+    dataset_root, augmented_root = str(tmp_path / 'data'), str(tmp_path / 'augmented')
+    make_dataset(dataset_root)
+    augment_dataset_incremental(dataset_root, augmented_root, SETTINGS, splits=('train',), workers=1, seed=3)
+    report = augment_dataset_incremental(dataset_root, augmented_root, {**SETTINGS, 'mirror_weights': [100, 0]},
+                                         splits=('train',), workers=1)
+    assert report['counts']['augmented'] == 4 and report['counts']['unchanged'] == 0
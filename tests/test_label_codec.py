@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from polygon_engine import pack_polygons
+from label_codec import (parse_labels, format_labels, read_labels, write_labels, read_label_files, box_mask, boxes_to_polygons,
+                         polygon_bounds, polygon_areas)
+
+def test_round_trip_at_the_precision(tmp_path):
+    rng = np.random.default_rng(0)
+    coords, offsets = pack_polygons([rng.random((int(rng.integers(3, 40)), 2)).tolist() for _ in range(50)])
+    class_ids = [str(i % 7) for i in range(50)]
+    for precision in (3, 6):
+        parsed_coords, parsed_offsets, parsed_class_ids = parse_labels(format_labels(coords, offsets, class_ids, precision))
+        assert np.array_equal(parsed_offsets, offsets) and parsed_class_ids == class_ids
+        assert np.abs(parsed_coords - coords).max() <= 0.5 * 10 ** -precision + 1e-7
+
+    label_path = str(tmp_path / 'a.txt')
+    write_labels(label_path, coords, offsets, class_ids)
+    parsed_coords, _, _ = read_labels(label_path)
+    assert np.allclose(parsed_coords, coords, atol=1e-6)
+
+def test_parse_tolerates_blank_lines_and_odd_values():
+    coords, offsets, class_ids = parse_labels(b'\r\n0 0.1 0.2 0.3 0.4 0.5 0.6\r\n\r\n  \n12 0.5 0.5 0.2 0.1 0.9\n')
+    assert class_ids == ['0', '12'] and offsets.tolist() == [0, 3, 5]
+    # The trailing unpaired value of the second line is dropped
+    assert np.allclose(coords[3:], [[0.5, 0.5], [0.2, 0.1]])
+    coords, offsets, class_ids = parse_labels('')
+    assert coords.shape == (0, 2) and offsets.tolist() == [0] and class_ids == []
+
+def test_bad_values_name_the_line():
+    with pytest.raises(ValueError, match=r"'0\.2x' on label line 2"):
+        parse_labels(b'0 0.1 0.2 0.3 0.4 0.5 0.6\n1 0.1 0.2x 0.3 0.4 0.5 0.6\n')
+
+def test_box_lines_expand_to_rectangles():
+    coords, offsets, _ = parse_labels(b'0 0.5 0.5 0.2 0.4\n1 0.1 0.1 0.3 0.1 0.3 0.3\n')
+    assert box_mask(offsets).tolist() == [True, False]
+    coords, offsets = boxes_to_polygons(coords, offsets)
+    assert offsets.tolist() == [0, 4, 7]
+    assert np.allclose(coords[:4], [[0.4, 0.3], [0.6, 0.3], [0.6, 0.7], [0.4, 0.7]])
+    assert polygon_bounds(coords, offsets)[0] == pytest.approx([0.4, 0.3, 0.6, 0.7])
+    assert polygon_areas(coords, offsets) == pytest.approx([0.08, 0.02])
+
+def test_many_files_parse_as_one(tmp_path):
+    contents = [b'0 0.1 0.1 0.2 0.1 0.2 0.2\n1 0.5 0.5 0.1 0.1\n', b'', b'2 0.3 0.3 0.4 0.3 0.4 0.4']
+    paths = []
+    for index, content in enumerate(contents):
+        paths.append(str(tmp_path / f'{index}.txt'))
+        with open(paths[-1], 'wb') as file:
+            file.write(content)
+    coords, offsets, class_ids, file_offsets = read_label_files(paths)
+    assert file_offsets.tolist() == [0, 2, 2, 3] and class_ids == ['0', '1', '2']
+    assert np.array_equal(coords[offsets[2]:offsets[3]], parse_labels(contents[2])[0])
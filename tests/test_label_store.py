@@ -0,0 +1,57 @@
+import os
+import numpy as np
+from label_store import CACHE_DIR, open_label_store, store_path
+
+def write_dataset(root):
+    for split, name, lines in (('train', 'a', ['0 0.1 0.1 0.5 0.1 0.5 0.5', '2 0.5 0.5 0.2 0.2']),
+                               ('train', 'b', ['2 0.2 0.2 0.6 0.2 0.6 0.6 0.2 0.6']),
+                               ('val', 'c', ['1 0.0 0.0 1.0 0.0 1.0 1.0'])):
+        os.makedirs(os.path.join(root, 'labels', split), exist_ok=True)
+        with open(os.path.join(root, 'labels', split, name + '.txt'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+def test_store_is_built_and_reopened(tmp_path):
+    write_dataset(str(tmp_path))
+    store = open_label_store(str(tmp_path))
+    assert os.path.exists(os.path.join(store_path(str(tmp_path)), 'index.json'))
+    assert store.class_counts() == {0: 1, 1: 1, 2: 2}
+    assert store.image_count == 3 and store.is_current()
+    assert isinstance(open_label_store(str(tmp_path)).class_ids, np.memmap)
+
+def test_read_only_root_keeps_the_store_in_memory(tmp_path):
+    # A file where the cache directory would go makes every write of the store fail
+    write_dataset(str(tmp_path))
+    with open(os.path.join(str(tmp_path), CACHE_DIR), 'w'):
+        pass
+    store = open_label_store(str(tmp_path))
+    assert store.class_counts() == {0: 1, 1: 1, 2: 2}
+    assert store.images(store.select(classes=[2])) == ['train/a.txt', 'train/b.txt']
+    assert len(store.polygon(1)) == 4  # The box line, as its four corners
+
+def test_queries(tmp_path):
+    write_dataset(str(tmp_path))
+    store = open_label_store(str(tmp_path), coordinate_format='uint16')
+    assert store.coordinate_format == 'uint16'
+    assert np.allclose(store.polygon(0), [[0.1, 0.1], [0.5, 0.1], [0.5, 0.5]], atol=1e-4)
+
+    # Instances: a triangle (area 0.08) and a box (0.04) in train/a, a square (0.16) in train/b, the full val image
+    assert np.allclose(store.areas, [0.08, 0.04, 0.16, 0.5])
+    assert store.select(min_area=0.05).tolist() == [True, False, True, True]
+    assert store.select(classes=[2], folders=['train']).tolist() == [False, True, True, False]
+    assert store.select(bbox_within=(0.3, 0.3, 0.7, 0.7)).tolist() == [False, True, False, False]
+    assert store.images(store.select(max_area=0.1)) == ['train/a.txt']
+    assert store.class_histogram() == {'train': {0: 1, 2: 2}, 'val': {1: 1}}
+
+    classes, matrix = store.cooccurrence()
+    assert classes.tolist() == [0, 1, 2]
+    assert matrix.tolist() == [[1, 0, 1], [0, 1, 0], [1, 0, 2]]
+
+def test_changed_labels_rebuild_the_store(tmp_path):
+    write_dataset(str(tmp_path))
+    assert len(open_label_store(str(tmp_path))) == 4
+    with open(os.path.join(str(tmp_path), 'labels', 'val', 'c.txt'), 'a') as f:
+        f.write('1 0.1 0.1 0.2 0.1 0.2 0.2\n')
+    store = open_label_store(str(tmp_path), check=False)
+    assert len(store) == 4 and not store.is_current()
+    assert len(open_label_store(str(tmp_path))) == 5
+    assert len(open_label_store(str(tmp_path), splits=('val',))) == 2
@@ -0,0 +1,38 @@
+import numpy as np
+import noise_bank
+from noise_bank import NoiseBank, get_noise_bank
+
+def test_noise_is_signed_with_the_requested_sigma():
+    bank = NoiseBank.generate(count=8)
+    image = np.full((600, 700, 3), 128, dtype=np.uint8)
+    for sigma in (4.0, 12.0, 30.0):
+        noise = bank.add(image, sigma, seed=1).astype(np.float64) - 128
+        assert abs(noise.mean()) < 0.2
+        assert abs(noise.std() - sigma) < 0.05 * sigma
+
+def test_noise_saturates_instead_of_wrapping():
+    bank = NoiseBank.generate(count=4)
+    dark = bank.add(np.zeros((300, 300, 3), dtype=np.uint8), 20.0, seed=2)
+    bright = bank.add(np.full((300, 300, 3), 255, dtype=np.uint8), 20.0, seed=2)
+    # Negative noise on black stays black and positive noise on white stays white, no speckles
+    assert 0.4 < (dark == 0).mean() < 0.6 and dark.max() < 128
+    assert 0.4 < (bright == 255).mean() < 0.6 and bright.min() > 128
+
+def test_same_seed_same_noise():
+    bank = NoiseBank.generate(count=4)
+    image = np.random.default_rng(0).integers(0, 256, (300, 520, 3), dtype=np.uint8)
+    first = bank.add(image, 10.0, seed=5)
+    assert np.array_equal(first, bank.add(image, 10.0, seed=5))
+    assert not np.array_equal(first, bank.add(image, 10.0, seed=6))
+    # In place, and for single channel images
+    copy = image.copy()
+    assert bank.add(copy, 10.0, 5, dst=copy) is copy and np.array_equal(copy, first)
+    assert bank.add(image[..., :1], 10.0, seed=5).shape == (300, 520, 1)
+
+def test_cache_file_is_shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(noise_bank, 'noise_banks', {})
+    cache_path = str(tmp_path / 'cache' / 'noise.npy')
+    monkeypatch.setattr(noise_bank, 'cache_file', cache_path)
+    bank = get_noise_bank()
+    assert isinstance(bank.tiles, np.memmap) and get_noise_bank() is bank
+    assert np.array_equal(NoiseBank.load(cache_path).tiles, NoiseBank.generate().tiles)
@@ -0,0 +1,33 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from output_encoding import EncodeStats, get_profile, output_path, encode_image, merge_stats
+
+def test_profiles_pick_the_output_format():
+    assert output_path('out/a.png', get_profile('default')) == 'out/a.png'
+    assert output_path('out/a.png', get_profile('jpeg')) == 'out/a.jpg'
+    assert output_path('out/a.jpeg', get_profile('jpeg')) == 'out/a.jpeg'  # Already a JPEG
+    assert output_path('out/a.jpg', get_profile('webp')) == 'out/a.webp'
+    assert output_path('out/a.png', get_profile({'format': '.bmp'})) == 'out/a.bmp'
+    with pytest.raises(ValueError):
+        get_profile('jpg')
+
+def test_encode_counts_bytes_per_format(tmp_path):
+    image = np.random.default_rng(0).integers(0, 256, (64, 96, 3), dtype=np.uint8)
+    stats = EncodeStats()
+    sizes = {}
+    for name in ('default', 'png_fast', 'jpeg_small'):
+        profile = get_profile(name)
+        path = output_path(str(tmp_path / f'{name}.png'), profile)
+        assert encode_image(path, image, profile, stats)
+        sizes[name] = os.path.getsize(path)
+        assert cv2.imread(path).shape == image.shape
+
+    totals = stats.take()
+    assert totals['.png'][:2] == (2, sizes['default'] + sizes['png_fast'])
+    assert totals['.jpg'][:2] == (1, sizes['jpeg_small'])
+    assert stats.take() == {}
+    assert merge_stats({'.png': (1, 10, 0.5)}, totals)['.png'][:2] == (3, 10 + totals['.png'][1])
+    # Only the rename puts the file in place, nothing is left next to it
+    assert sorted(os.listdir(tmp_path)) == ['default.png', 'jpeg_small.jpg', 'png_fast.png']
@@ -0,0 +1,65 @@
+import threading
+import time
+import cv2
+import numpy as np
+import overlay_pool
+from overlay_pool import OverlayBackgroundPool
+
+def make_backgrounds(directory, count=3):
+    for i in range(count):
+        cv2.imwrite(str(directory / f'{i}.png'), np.full((20, 30, 3), 40 * i, dtype=np.uint8))
+
+def slow_read(seconds, error=None):
+    def read(path, target_size=None):
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+        return cv2.imread(path)
+    return read
+
+def load_while_decoding(pool, index):
+    # Starts a decode on one thread and loads the same index on another while it runs. Returns
+    # what each got, the image or the exception
+    results = {}
+    def load(name):
+        try:
+            results[name] = pool.load(index)
+        except Exception as e:
+            results[name] = e
+    first = threading.Thread(target=load, args=('first',), daemon=True)
+    first.start()
+    while index not in pool.loading:
+        time.sleep(0.001)
+    waiter = threading.Thread(target=load, args=('waiter',), daemon=True)
+    waiter.start()
+    first.join(5)
+    waiter.join(5)
+    assert not waiter.is_alive(), "the waiter never got the result of the decode"
+    return results
+
+def test_waiter_gets_a_background_the_cache_did_not_keep(tmp_path, monkeypatch):
+    make_backgrounds(tmp_path)
+    monkeypatch.setattr(overlay_pool, 'read_image', slow_read(0.1))
+    pool = OverlayBackgroundPool(str(tmp_path), memory_budget_mb=0, prefetch=0)  # Too small to cache anything
+
+    results = load_while_decoding(pool, 1)
+    assert results['waiter'] is not None
+    assert np.array_equal(results['waiter'], results['first'])
+    assert not pool.cache
+
+def test_waiter_gets_the_decode_error(tmp_path, monkeypatch):
+    make_backgrounds(tmp_path)
+    monkeypatch.setattr(overlay_pool, 'read_image', slow_read(0.1, OSError('disk gone')))
+    pool = OverlayBackgroundPool(str(tmp_path), prefetch=0)
+
+    results = load_while_decoding(pool, 0)
+    assert isinstance(results['first'], OSError)
+    assert isinstance(results['waiter'], OSError)
+    assert not pool.loading
+
+def test_pick_is_the_same_background_regardless_of_caching(tmp_path):
+    make_backgrounds(tmp_path)
+    cached = OverlayBackgroundPool(str(tmp_path), prefetch=0)
+    uncached = OverlayBackgroundPool(str(tmp_path), memory_budget_mb=0, prefetch=0)
+    for value in (0.0, 0.4, 0.9):
+        assert np.array_equal(cached.pick(value), uncached.pick(value))
@@ -0,0 +1,59 @@
+import cv2
+import numpy as np
+from augmentation_plan import PLAN_DTYPE
+from photometric import MURK_COLOR, MURK_TINT, MURK_CONTRAST, MURK_NOISE, has_photometric, apply_photometric, gaussian_blur
+
+def make_plan(**fields):
+    plan = np.zeros(1, dtype=PLAN_DTYPE)[0]
+    plan['saturation_factor'] = plan['value_factor'] = 1.0
+    for name, value in fields.items():
+        plan[name] = value
+    return plan
+
+def random_image(seed=0, shape=(48, 64, 3)):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+def test_no_op_plan_returns_the_image():
+    image = random_image()
+    plan = make_plan()
+    assert not has_photometric(plan)
+    assert apply_photometric(image, plan) is image
+
+def test_one_lut_matches_the_ops_one_after_another():
+    image = random_image()
+    plan = make_plan(tint=True, tint_color=(10, 200, 30), tint_strength=0.25, contrast=True, contrast_factor=1.3,
+                     brightness=True, brightness_shift=-12.0, hsv=True, value_factor=0.9)
+    expected = image.astype(np.float64)
+    expected = expected * 0.75 + np.array([10, 200, 30]) * 0.25
+    expected = (expected - 128) * 1.3 + 128 - 12
+    expected = np.clip(np.rint(expected * 0.9), 0, 255)
+    # Rounded once at the end instead of after every op
+    output = apply_photometric(image, plan)
+    assert np.abs(output - expected).max() <= 1
+
+    dst = np.empty_like(image)
+    assert apply_photometric(image, plan, dst) is dst and np.array_equal(dst, output)
+
+def test_hue_wraps_and_saturation_scales():
+    image = random_image(1)
+    plan = make_plan(hsv=True, hue_shift=170.0, saturation_factor=0.5)
+    hsv = cv2.cvtColor(apply_photometric(image, plan), cv2.COLOR_BGR2HSV).astype(np.int32)
+    source = cv2.cvtColor(image, cv2.COLOR_BGR2HSV).astype(np.int32)
+    # Compared through a second conversion, so a few levels off around dark and gray pixels
+    saturated = (source[..., 1] > 100) & (source[..., 2] > 100)
+    hue_error = (hsv[..., 0] - (source[..., 0] + 170) % 180 + 90) % 180 - 90
+    assert np.median(np.abs(hue_error[saturated])) <= 2
+    assert np.median(np.abs(hsv[..., 1] - source[..., 1] * 0.5)[saturated]) <= 3
+
+def test_large_blurs_run_downsampled():
+    image = cv2.resize(random_image(2, (30, 40, 3)), (320, 240), interpolation=cv2.INTER_CUBIC)
+    for sigma in (1.5, 6.0, 12.0):
+        expected = cv2.GaussianBlur(image, (0, 0), sigma).astype(np.int16)
+        assert np.abs(gaussian_blur(image, sigma) - expected)[20:-20, 20:-20].mean() < 1.5
+
+def test_murk_tints_halves_the_contrast_and_adds_noise():
+    image = np.full((256, 256, 3), 200, dtype=np.uint8)
+    output = apply_photometric(image, make_plan(murk=True, noise_seed=3)).astype(np.float64)
+    expected = (200 * (1 - MURK_TINT) + np.array(MURK_COLOR) * MURK_TINT) * MURK_CONTRAST
+    assert np.allclose(output.mean(axis=(0, 1)), expected, atol=1.0)
+    assert abs(output.std() - MURK_NOISE * MURK_CONTRAST) < 1.5
@@ -0,0 +1,85 @@
+import time
+import threading
+import cv2
+import numpy as np
+from pipelined_io import PrefetchingReader, AsyncWriter, read_image, read_image_size, reduction_factor
+
+def test_reader_keeps_the_order_and_bounds_the_read_ahead():
+    started = []
+    lock = threading.Lock()
+
+    def load(item):
+        with lock:
+            started.append(item)
+        time.sleep(0.002 * (item % 3))
+        return item * item
+
+    for threads in (0, 3):
+        started.clear()
+        reader = PrefetchingReader(load, range(30), threads, depth=4)
+        for index, (item, result) in enumerate(reader):
+            assert (item, result) == (index, index * index)
+            # Loads never get more than depth items ahead of the consumer
+            assert len(started) <= index + 4
+        assert sorted(started) == list(range(30))
+
+def test_writer_reports_the_first_error_per_key():
+    written = []
+
+    def write(key, value):
+        if value == 'raise':
+            raise OSError('disk full')
+        if value == 'fail':
+            return False
+        written.append((key, value))
+
+    for threads in (0, 2):
+        written.clear()
+        writer = AsyncWriter(threads, depth=2)
+        for key, value in ((0, 'a'), (1, 'fail'), (1, 'raise'), (2, 'raise'), (3, 'b')):
+            writer.submit(key, write, key, value)
+        assert writer.flush() == {1: 'write failed', 2: 'OSError: disk full'}
+        assert sorted(written) == [(0, 'a'), (3, 'b')]
+        assert writer.flush() == {}
+        writer.close()
+
+def test_writer_blocks_once_depth_writes_are_queued():
+    release = threading.Event()
+    running = []
+    writer = AsyncWriter(1, depth=2)
+    submitter = threading.Thread(target=lambda: [writer.submit(i, lambda: running.append(release.wait(5))) for i in range(5)],
+                                 daemon=True)
+    submitter.start()
+    time.sleep(0.1)
+    # One write runs, one waits in the queue and the third submit blocks
+    assert submitter.is_alive() and len(writer.futures) == 2
+    release.set()
+    submitter.join(5)
+    assert writer.flush() == {} and len(running) == 5
+    writer.close()
+
+def smooth_image(width, height):
+    # Gradients, so a reduced decode and a full decode plus resize are comparable
+    x = np.linspace(0, 255, width)[None, :]
+    y = np.linspace(0, 255, height)[:, None]
+    return np.dstack([x + 0 * y, y + 0 * x, (x + y) / 2]).astype(np.uint8)
+
+def test_reduction_keeps_the_longer_side_at_least_the_target():
+    for width, height, target_size in ((4000, 3000, 640), (1280, 720, 640), (1279, 720, 640), (500, 900, 100), (300, 200, 640)):
+        factor = reduction_factor(width, height, target_size)
+        assert factor in (1, 2, 4, 8)
+        assert max(width, height) / factor >= target_size or factor == 1
+        assert factor == 8 or max(width, height) / (factor * 2) < target_size
+
+def test_reduced_decode_matches_a_full_decode(tmp_path):
+    image = smooth_image(1000, 700)
+    for extension in ('.jpg', '.png'):
+        path = str(tmp_path / f'source{extension}')
+        cv2.imwrite(path, image)
+        assert read_image_size(path) == (1000, 700)
+        reduced = read_image(path, target_size=240)
+        full = cv2.resize(read_image(path), (240, 168), interpolation=cv2.INTER_AREA)
+        assert reduced.shape == (168, 240, 3)
+        assert np.abs(reduced.astype(np.int16) - full).mean() < 2
+        # Never scaled up
+        assert read_image(path, target_size=2000).shape == (700, 1000, 3)
@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+import pytest
+from polygon_engine import (pack_polygons, unpack_polygons, compose, scale_translate_matrix, mirror_matrix,
+                            pixel_rotation_matrix, transform_coords, transform_polygons, clip_polygons, split_half_plane,
+                            simplify_polygons)
+
+def circle(count, radius, center=(0.5, 0.5)):
+    angles = np.linspace(0, 2 * np.pi, count, endpoint=False)
+    return list(zip(center[0] + radius * np.cos(angles), center[1] + radius * np.sin(angles)))
+
+def test_pack_round_trip():
+    polygons = [[(0.1, 0.2), (0.3, 0.4), (0.5, 0.6)], [], [(0.7, 0.8), (0.9, 1.0)]]
+    coords, offsets = pack_polygons(polygons)
+    assert coords.dtype == np.float32 and offsets.tolist() == [0, 3, 3, 5]
+    assert np.allclose(unpack_polygons(coords, offsets)[0], polygons[0])
+    assert unpack_polygons(coords, offsets)[1] == []
+    coords, offsets = pack_polygons([])
+    assert coords.shape == (0, 2) and offsets.tolist() == [0]
+
+def test_compose_applies_matrices_in_order():
+    # Scale first, then translate
+    matrix = compose(scale_translate_matrix(2.0, 3.0), scale_translate_matrix(tx=1.0, ty=-1.0))
+    assert np.allclose(matrix @ [1.0, 1.0, 1.0], [3.0, 2.0, 1.0])
+
+def test_transform_mirrors_and_clips():
+    assert np.allclose(transform_polygons([[(0.25, 0.5), (1.0, 0.0)]], mirror_matrix())[0], [(0.75, 0.5), (0.0, 0.0)])
+    coords = np.array([[0.5, 0.5], [0.9, 0.1]], dtype=np.float32)
+    moved = transform_coords(coords, scale_translate_matrix(tx=0.2, ty=-0.2))
+    assert np.allclose(moved, [[0.7, 0.3], [1.0, 0.0]])
+    assert np.allclose(transform_coords(coords, scale_translate_matrix(tx=0.2), clip=False)[1], [1.1, 0.1])
+
+def test_rotation_matches_opencv():
+    # Labels have to follow the image that cv2.warpAffine rotates
+    for angle in (-30.0, 15.0, 90.0):
+        expected = cv2.getRotationMatrix2D((40.0, 30.0), angle, 1.0)
+        expected[:, 2] += (60.0 - 40.0, 50.0 - 30.0)
+        assert np.allclose(pixel_rotation_matrix(angle, (40.0, 30.0), (60.0, 50.0))[:2], expected)
+
+def star(rng, center, radius, count):
+    # Random simple polygon: vertices at increasing angles around center, less than half a turn apart
+    angles = (np.arange(count) + rng.uniform(0, 0.9, count)) * 2 * np.pi / count
+    radii = radius * rng.uniform(0.3, 1.0, count)
+    return list(zip(center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)))
+
+def areas(coords, offsets):
+    x, y = coords[:, 0].astype(np.float64), coords[:, 1].astype(np.float64)
+    return [0.5 * abs(np.dot(x[a:b], np.roll(y[a:b], -1)) - np.dot(y[a:b], np.roll(x[a:b], -1)))
+            for a, b in zip(offsets[:-1], offsets[1:])]
+
+def test_clip_matches_shapely():
+    geometry = pytest.importorskip('shapely.geometry')
+    rng = np.random.default_rng(3)
+    polygons = [star(rng, rng.uniform(-0.2, 1.2, 2), rng.uniform(0.05, 0.5), int(rng.integers(3, 30))) for _ in range(200)]
+    coords, offsets = pack_polygons(polygons)
+    clipped, clipped_offsets, parents = clip_polygons(coords, offsets, np.arange(len(polygons)))
+    assert clipped.min() >= 0 and clipped.max() <= 1
+
+    clipped_areas = np.bincount(parents, weights=areas(clipped, clipped_offsets), minlength=len(polygons))
+    unit_box = geometry.box(0, 0, 1, 1)
+    for index, polygon in enumerate(polygons):
+        assert clipped_areas[index] == pytest.approx(geometry.Polygon(polygon).intersection(unit_box).area, abs=1e-5)
+
+def test_clip_splits_u_shapes_and_keeps_class_ids():
+    # A U above the image with its arms reaching in, so clipping leaves the two arm tips as separate parts
+    u_shape = [(0.2, -0.5), (0.8, -0.5), (0.8, 0.3), (0.6, 0.3), (0.6, -0.2), (0.4, -0.2), (0.4, 0.3), (0.2, 0.3)]
+    outside = [(1.5, 1.5), (1.8, 1.5), (1.8, 1.8)]
+    coords, offsets = pack_polygons([outside, u_shape])
+    clipped, clipped_offsets, class_ids = clip_polygons(coords, offsets, ['7', '3'])
+    assert class_ids == ['3', '3']
+    assert areas(clipped, clipped_offsets) == pytest.approx([0.2 * 0.3, 0.2 * 0.3])
+
+    parts = split_half_plane(np.array(u_shape, dtype=np.float32), 1, 0.0, 1.0)
+    assert sorted(part[:, 0].min() for part in parts) == pytest.approx([0.2, 0.6])
+
+def distance_to_outline(points, outline):
+    # Distance of every point to the closest edge of the closed outline
+    a, b = outline, np.roll(outline, -1, axis=0)
+    ab = b - a
+    t = np.clip(((points[:, None] - a) * ab).sum(axis=2) / np.maximum((ab * ab).sum(axis=1), 1e-12), 0, 1)
+    closest = a + t[..., None] * ab
+    return np.sqrt(((points[:, None] - closest) ** 2).sum(axis=2)).min(axis=1)
+
+def test_simplify_drops_vertices_within_tolerance():
+    coords, offsets = pack_polygons([circle(400, 0.3), circle(50, 0.02, (0.1, 0.1))])
+    scale = (640, 480)
+    for tolerance in (0.5, 2.0, 8.0):
+        simplified, new_offsets = simplify_polygons(coords, offsets, tolerance, scale)
+        counts = np.diff(new_offsets)
+        assert (counts >= 3).all() and (counts < np.diff(offsets)).all()
+        for i in range(2):
+            original = coords[offsets[i]:offsets[i + 1]] * scale
+            kept = simplified[new_offsets[i]:new_offsets[i + 1]] * scale
+            assert distance_to_outline(original, kept).max() <= tolerance + 1e-3
+
+def test_simplify_keeps_a_triangle_of_small_polygons():
+    # Tolerances far beyond the polygon size leave the start, farthest and third vertex
+    coords, offsets = pack_polygons([circle(400, 0.01), circle(400, 0.3)])
+    simplified, new_offsets = simplify_polygons(coords, offsets, 1000.0, (640, 480))
+    assert np.diff(new_offsets).tolist() == [3, 3]
+    triangle = simplified[:3] * (640, 480)
+    (ax, ay), (bx, by) = triangle[1] - triangle[0], triangle[2] - triangle[0]
+    assert abs(ax * by - ay * bx) > 0
+
+def test_simplify_leaves_triangles_and_boxes_alone():
+    coords, offsets = pack_polygons([[(0.1, 0.1), (0.2, 0.1), (0.2, 0.2)], [(0.3, 0.3), (0.4, 0.4)]])
+    simplified, new_offsets = simplify_polygons(coords, offsets, 1000.0, (640, 480))
+    assert np.array_equal(simplified, coords) and np.array_equal(new_offsets, offsets)
@@ -0,0 +1,34 @@
+import numpy as np
+from run_journal import RunJournal
+
+def test_start_after_resume_closes_the_resumed_file(tmp_path):
+    plans = np.zeros(3)
+    journal = RunJournal(str(tmp_path))
+    journal.start('fingerprint', 7, plans)
+    journal.close()
+
+    # A journal with no finished chunks resumes with nothing done, so the run starts it again
+    journal = RunJournal(str(tmp_path))
+    seed, _, done = journal.resume('fingerprint')
+    assert (seed, done) == (7, {})
+    resumed_file = journal.file
+    journal.start('fingerprint', 7, plans)
+    assert resumed_file.closed
+    journal.finish()
+    assert journal.file is None
+
+def test_resume_returns_finished_chunks(tmp_path):
+    # Results as process_chunk returns them, one (status, message) pair per job
+    chunks = {0: [('augmented', None), ('skipped', 'no label file')],
+              1: [('failed', 'write error: disk full'), ('augmented', None)]}
+    journal = RunJournal(str(tmp_path))
+    journal.start('fingerprint', 7, np.zeros(3))
+    for chunk_index, results in chunks.items():
+        journal.record(chunk_index, results)
+    journal.close()
+
+    journal = RunJournal(str(tmp_path))
+    assert journal.resume('other') is None
+    seed, plans, done = journal.resume('fingerprint')
+    assert (seed, done) == (7, chunks)
+    journal.close()
@@ -0,0 +1,47 @@
+import csv
+import json
+import stage_profiler
+from stage_profiler import collect, stage, count, empty_profile, merge_profiles, format_profile, write_trace
+from annotations import Annotations
+from augment_data import augment_labels
+from test_augment_batch import sample_batch
+from test_augment_data import POLYGONS, filled_image
+
+def test_stages_and_counts_are_no_ops_without_a_profiler():
+    assert stage_profiler.active is None
+    with stage('crop'):
+        count('crop_dropped', 3)
+    assert not stage_profiler.enabled()
+
+def test_pipeline_stages_are_timed_and_counted():
+    image = filled_image(POLYGONS)
+    annotations = Annotations.from_polygons(POLYGONS, [0, 1])
+    plans = sample_batch(10, seed=2)
+    with collect() as profiler:
+        for plan in plans:
+            augment_labels(image, annotations, plan, 480, 640, '')
+    assert stage_profiler.active is None
+    totals = profiler.take()
+    assert totals['counters']['variants'] == 10 and totals['counters']['instances_in'] == 20
+    assert totals['stages']['rotate'][0] == int(plans['rotate'].sum())
+    assert totals['stages']['mirror'][0] == int(plans['mirror'].sum())
+    assert profiler.take() == empty_profile()
+
+def test_profiles_merge_and_trace(tmp_path):
+    with collect(trace=True) as profiler:
+        with stage('decode'):
+            pass
+        count('bytes_written', 10)
+    part = profiler.take()
+    totals = merge_profiles(merge_profiles(empty_profile(), part), part)
+    assert totals['stages']['decode'][0] == 2 and totals['counters'] == {'bytes_written': 20}
+    assert len(totals['events']) == 2
+    assert any(line.split()[0] == 'decode' for line in format_profile(totals))
+
+    write_trace(str(tmp_path / 'trace.csv'), totals)
+    with open(tmp_path / 'trace.csv') as file:
+        rows = list(csv.DictReader(file))
+    assert [row['stage'] for row in rows] == ['decode', 'decode']
+    write_trace(str(tmp_path / 'trace.json'), totals)
+    with open(tmp_path / 'trace.json') as file:
+        assert json.load(file)['stages']['decode']['calls'] == 2
@@ -2,9 +2,14 @@ import json
 import os
 import shutil
 import random
+import sys
+import numpy as np
 from sklearn.model_selection import train_test_split
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from polygon_engine import simplify_polygons
 
-def convert_coco_to_yolo(json_file_path, output_dir):
+def convert_coco_to_yolo(json_file_path, output_dir, simplify_tolerance=None):
+    # simplify_tolerance (pixels) drops the vertices CVAT puts along smooth edges, see polygon_engine.simplify_polygons
     # Load COCO JSON
     with open(json_file_path) as f:
         data = json.load(f)
@@ -13,8 +18,17 @@ def convert_coco_to_yolo(json_file_path, output_dir):
     category_mapping = {cat['id']: cat['name'] for cat in data['categories']}
 
     # Function to convert COCO polygon to YOLO format
+    vertices = [0, 0]  # Before and after simplification
+
     def coco_to_yolo_polygon(coco_polygon, img_width, img_height):
         # Assuming coco_polygon is a flat list [x1, y1, x2, y2, ..., xn, yn]
+        vertices[0] += len(coco_polygon) // 2
+        if simplify_tolerance:
+            # COCO coordinates are in pixels already
+            points = np.asarray(coco_polygon, dtype=np.float64).reshape(-1, 2)
+            points = simplify_polygons(points, np.array([0, len(points)], dtype=np.int32), simplify_tolerance)[0]
+            coco_polygon = points.reshape(-1).tolist()
+        vertices[1] += len(coco_polygon) // 2
         yolo_polygon = []
         for i in range(0, len(coco_polygon), 2):
             x, y = coco_polygon[i], coco_polygon[i+1]
@@ -41,6 +55,9 @@ def convert_coco_to_yolo(json_file_path, output_dir):
                     line = f"{category_mapping[category_id]} " + " ".join(f"{x} {y}" for x, y in yolo_polygon)
                     f.write(line + '\n')
 
+    if simplify_tolerance and vertices[0]:
+        print(f"Simplified polygons: {vertices[0]} -> {vertices[1]} vertices ({100 * (vertices[1] - vertices[0]) / vertices[0]:+.0f}%)")
+
 def copy_and_rename_files_in_order(input_folder_path, output_folder_path, rename=True):
     # Ensure the output directory exists
     os.makedirs(output_folder_path, exist_ok=True)
@@ -98,7 +115,7 @@ def replace_labels_in_directory(root_dir, label_mapping):
 def split_dataset(folder_list, val_split_ratio=0.2):
     return train_test_split(folder_list, test_size=val_split_ratio, random_state=42)
 
-def process_folder_structure(parent_folder_path, label_output_base='output_data', image_output_base='output_images', dataset_base='Dataset', val_split_ratio=0.2, add_to_dataset=True):
+def process_folder_structure(parent_folder_path, label_output_base='output_data', image_output_base='output_images', dataset_base='Dataset', val_split_ratio=0.2, add_to_dataset=True, simplify_tolerance=None):
     folder_name = os.path.basename(parent_folder_path)
     
     # Paths for input files
@@ -130,7 +147,7 @@ def process_folder_structure(parent_folder_path, label_output_base='output_data'
             json_file_path = os.path.join(annotations_folder, json_files[0])
             
             # Convert annotations
-            convert_coco_to_yolo(json_file_path, label_output_dir)
+            convert_coco_to_yolo(json_file_path, label_output_dir, simplify_tolerance)
             
             # Define label mapping
             label_mapping = {
@@ -1,52 +1,25 @@
 import os
+import sys
 import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from label_store import open_label_store
 
 def load_segmentation_annotations(dataset_folder):
-    data = {
-        'x_center': [],
-        'y_center': [],
-        'width': [],
-        'height': [],
-        'area': []
-    }
-
-    for split in ['train', 'val']:
-        split_folder = os.path.join(dataset_folder, 'labels', split)
-        for folder_name in os.listdir(split_folder):
-            folder_path = os.path.join(split_folder, folder_name)
-            if os.path.isdir(folder_path):
-                for file_name in os.listdir(folder_path):
-                    if file_name.endswith('.txt'):
-                        with open(os.path.join(folder_path, file_name), 'r') as f:
-                            for line in f:
-                                points = list(map(float, line.strip().split()[1:]))
-                                x_points = points[0::2]
-                                y_points = points[1::2]
-
-                                # Compute bounding box
-                                x_min = min(x_points)
-                                x_max = max(x_points)
-                                y_min = min(y_points)
-                                y_max = max(y_points)
-
-                                width = x_max - x_min
-                                height = y_max - y_min
-                                x_center = (x_min + x_max) / 2
-                                y_center = (y_min + y_max) / 2
-
-                                # Calculate the area of the polygon
-                                area = 0.5 * np.abs(np.dot(x_points, np.roll(y_points, 1)) - np.dot(y_points, np.roll(x_points, 1)))
-
-                                data['x_center'].append(x_center)
-                                data['y_center'].append(y_center)
-                                data['width'].append(width)
-                                data['height'].append(height)
-                                data['area'].append(area)
-
-    return pd.DataFrame(data)
+    # Bounding boxes and areas are precomputed in the label store, which is only rebuilt when labels changed
+    store = open_label_store(dataset_folder, ('train', 'val'))
+    keep = np.diff(store.offsets) > 0
+    x_min, y_min, x_max, y_max = np.asarray(store.bboxes)[keep].T
+
+    return pd.DataFrame({
+        'x_center': (x_min + x_max) / 2,
+        'y_center': (y_min + y_max) / 2,
+        'width': x_max - x_min,
+        'height': y_max - y_min,
+        'area': np.asarray(store.areas)[keep]
+    })
 
 def analyze_polygons(df):
     print("Summary Statistics for Polygon Bounding Boxes and Areas:")
@@ -1,23 +1,22 @@
 import os
+import sys
 import glob
 import shutil
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from label_codec import read_labels, write_labels, boxes_to_polygons, polygon_bounds
 
-def convert_polygon_to_bbox(polygon_points):
-    x_coords = polygon_points[0::2]
-    y_coords = polygon_points[1::2]
-    
-    x_min = min(x_coords)
-    x_max = max(x_coords)
-    y_min = min(y_coords)
-    y_max = max(y_coords)
+def convert_polygons_to_bboxes(coords, offsets, class_ids):
+    # Packed box labels for all polygons of a file, each box is two "points" (center, size).
+    # Lines without points are dropped
+    keep = np.diff(offsets) > 0
+    x_min, y_min, x_max, y_max = polygon_bounds(*boxes_to_polygons(coords, offsets))[keep].T
     
     # Center x, y and width, height
-    bbox_x_center = (x_min + x_max) / 2.0
-    bbox_y_center = (y_min + y_max) / 2.0
-    bbox_width = x_max - x_min
-    bbox_height = y_max - y_min
+    bboxes = np.stack([(x_min + x_max) / 2.0, (y_min + y_max) / 2.0, x_max - x_min, y_max - y_min], axis=1)
     
-    return bbox_x_center, bbox_y_center, bbox_width, bbox_height
+    bbox_offsets = np.arange(0, 2 * len(bboxes) + 1, 2, dtype=np.int32)
+    return bboxes.reshape(-1, 2), bbox_offsets, [class_id for class_id, kept in zip(class_ids, keep.tolist()) if kept]
 
 def copy_and_convert_dataset(original_dataset_path, new_dataset_path):
     labels_path = os.path.join(original_dataset_path, "labels")
@@ -52,24 +51,11 @@ def copy_and_convert_dataset(original_dataset_path, new_dataset_path):
                 os.makedirs(new_folder_labels_path)
             
             for txt_file in glob.glob(os.path.join(root, "*.txt")):
-                with open(txt_file, 'r') as file:
-                    lines = file.readlines()
-                
-                converted_lines = []
-                for line in lines:
-                    parts = line.strip().split()
-                    class_id = parts[0]
-                    polygon_points = list(map(float, parts[1:]))
-                    
-                    bbox = convert_polygon_to_bbox(polygon_points)
-                    bbox_str = f"{class_id} {bbox[0]} {bbox[1]} {bbox[2]} {bbox[3]}"
-                    converted_lines.append(bbox_str)
+                bboxes, bbox_offsets, class_ids = convert_polygons_to_bboxes(*read_labels(txt_file))
                 
                 # Write the new bbox annotations to the output folder
                 new_txt_file = os.path.join(new_folder_labels_path, os.path.basename(txt_file))
-                with open(new_txt_file, 'w') as out_file:
-                    for bbox_line in converted_lines:
-                        out_file.write(bbox_line + '\n')
+                write_labels(new_txt_file, bboxes, bbox_offsets, class_ids)
     
     print(f"Dataset copied and converted. New dataset saved at {new_dataset_path}.")
 
@@ -1,28 +1,20 @@
 import os
+import sys
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
 from collections import defaultdict
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from label_store import open_label_store
 
 def scan_dataset_for_labels(dataset_folder):
-    label_folder = os.path.join(dataset_folder, 'labels')
     class_occurrence = defaultdict(lambda: defaultdict(int))
 
-    for split in ['train', 'val']:
-        split_folder = os.path.join(label_folder, split)
-        for root, _, files in os.walk(split_folder):
-            for file in files:
-                if file.endswith('.txt'):
-                    with open(os.path.join(root, file), 'r') as f:
-                        classes = set()
-                        for line in f:
-                            class_id = int(line.split()[0])
-                            classes.add(class_id)
-                        
-                        # Update co-occurrence matrix
-                        for c1 in classes:
-                            for c2 in classes:
-                                class_occurrence[c1][c2] += 1
+    # Co-occurrence matrix straight from the label store
+    classes, matrix = open_label_store(dataset_folder, ('train', 'val')).cooccurrence()
+    for i, c1 in enumerate(classes.tolist()):
+        for j, c2 in enumerate(classes.tolist()):
+            class_occurrence[c1][c2] = int(matrix[i, j])
 
     return class_occurrence
 
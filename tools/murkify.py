@@ -1,29 +1,22 @@
 import cv2
 import os
+import sys
 import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from augmentation_plan import PLAN_DTYPE
+from photometric import apply_photometric
 
 def apply_murky_effect(image):
     # Convert the image to BGR if it is not already
     if len(image.shape) == 2 or image.shape[2] == 1:
         image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
 
-    # Apply a greenish tint
-    green_tint = np.full_like(image, (0, 50, 0), dtype=np.uint8)
-    murky_image = cv2.addWeighted(image, 0.7, green_tint, 0.3, 0)
-
-    # Add Gaussian blur to simulate murkiness
-    blurred_image = cv2.GaussianBlur(murky_image, (15, 15), 0)
-
-    # Add random noise
-    noise = np.random.normal(0, 25, blurred_image.shape).astype(np.uint8)
-    noisy_image = cv2.add(blurred_image, noise)
-
-    # Reduce contrast
-    alpha = 0.5  # Contrast control (1.0-3.0)
-    beta = 0    # Brightness control (0-100)
-    final_image = cv2.convertScaleAbs(noisy_image, alpha=alpha, beta=beta)
-
-    return final_image
+    # Greenish tint, blur, noise and reduced contrast, the murk op of the photometric stage.
+    # Set {'murk': p} in the photometric setting to murkify while augmenting instead
+    plan = np.zeros(1, dtype=PLAN_DTYPE)[0]
+    plan['murk'] = True
+    plan['noise_seed'] = np.random.randint(2 ** 32, dtype=np.uint64)
+    return apply_photometric(image, plan)
 
 def process_folder(input_folder, output_folder):
     if not os.path.exists(output_folder):
@@ -2,6 +2,9 @@ import tkinter as tk
 from tkinter import ttk, Canvas
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 import os
+from label_codec import read_labels
+from polygon_engine import unpack_polygons
+from dataset_manifest import open_manifest
 
 class PolygonVisualizerApp:
     def __init__(self, base_dir):
@@ -16,6 +19,7 @@ class PolygonVisualizerApp:
         self.frames = {'train': [], 'val': []}
         self.current_frame_index = 0
 
+        self.manifest = open_manifest(self.base_dir)
         self.video_names = self.get_video_names()
         self.setup_video_selection()
         self.setup_image_slider() 
@@ -56,12 +60,10 @@ class PolygonVisualizerApp:
 
     def get_video_names(self):
         video_names = set()
-        for split in ['train', 'val']:
-            split_dir = os.path.join(self.base_dir, "images", split)
-            if os.path.isdir(split_dir):
-                for name in os.listdir(split_dir):
-                    if os.path.isdir(os.path.join(split_dir, name)):
-                        video_names.add(name)
+        for directory in self.manifest.directory_names():
+            parts = directory.split('/')
+            if len(parts) == 2:
+                video_names.add(parts[1])
         return sorted(video_names)
 
     def setup_video_selection(self):
@@ -104,19 +106,12 @@ class PolygonVisualizerApp:
     def load_video_frames(self, event=None):
         self.frames = {'train': [], 'val': []}
         video_name = self.current_video_name.get()
+        self.manifest.refresh()
         for split in ['train', 'val']:
-            img_dir = os.path.join(self.base_dir, "images", split, video_name)
-            label_dir = os.path.join(self.base_dir, "labels", split, video_name)
-            self.frames[split] = []
-            if os.path.isdir(img_dir) and os.path.isdir(label_dir):
-                all_files = [f for f in os.listdir(img_dir) if f.endswith('.jpg')]
-                sorted_files = sorted(all_files, key=lambda x: int(x.split('.')[0]))
-                print("Files in directory (filtered):", sorted_files)
-                for frame in sorted_files:
-                    img_path = os.path.join(img_dir, frame)
-                    label_path = os.path.join(label_dir, os.path.splitext(frame)[0] + ".txt")
-                    if os.path.isfile(img_path) and os.path.isfile(label_path):
-                        self.frames[split].append((img_path, label_path))
+            # Frames with a label file, from the manifest instead of listing the directories
+            sources = [(img_path, label_path) for img_path, label_path, _, _, instances in self.manifest.sources(f"{split}/{video_name}")
+                       if img_path.endswith('.jpg') and instances is not None]
+            self.frames[split] = sorted(sources, key=lambda source: int(os.path.basename(source[0]).split('.')[0]))
         self.display_image(self.current_split, 0)
 
         # Update the slider's range based on the number of frames in the current split
@@ -189,16 +184,16 @@ class PolygonVisualizerApp:
 
         font = ImageFont.truetype("arial.ttf", 24)  # Adjust the font size and path as needed
 
-        for line in open(label_path, 'r'):
-            parts = line.strip().split()
-            class_id = parts[0]
+        # Parse the labels once and scale every point to the canvas
+        coords, offsets, class_ids = read_labels(label_path)
+        polygons = unpack_polygons(coords * (canvas_width, canvas_height), offsets)
+
+        for class_id, polygon in zip(class_ids, polygons):
             color = self.class_colors.get(class_id, 'yellow')  # Use class-specific color
 
             # Convert hex color to RGBA with semi-transparency for the fill
             fill_color = tuple(int(color[i:i+2], 16) for i in (1, 3, 5)) + (128,)
 
-            polygon = [(float(parts[i]) * canvas_width, float(parts[i + 1]) * canvas_height) for i in range(1, len(parts), 2)]
-
             # Draw the polygon with a thicker line and semi-transparent fill on the temporary image
             temp_draw.polygon(polygon, outline=color, fill=fill_color, width=3)
 
@@ -207,16 +202,13 @@ class PolygonVisualizerApp:
 
         # Now, draw points and text on the composited image
         final_draw = ImageDraw.Draw(resized_image)
-        for line in open(label_path, 'r'):
-            parts = line.strip().split()
-            polygon = [(float(parts[i]) * canvas_width, float(parts[i + 1]) * canvas_height) for i in range(1, len(parts), 2)]
-            
+        for class_id, polygon in zip(class_ids, polygons):
             # Draw points on each vertex
             for (x, y) in polygon:
                 r = 2  # Radius for the points
                 final_draw.ellipse((x - r, y - r, x + r, y + r), fill="red", outline="red")
 
-            class_name = self.class_names.get(parts[0], 'Unknown')
+            class_name = self.class_names.get(class_id, 'Unknown')
             # Adjust text position to avoid overlap with polygon edges
             text_position = (polygon[0][0] + 10, polygon[0][1] + 10)
 